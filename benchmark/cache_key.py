@@ -0,0 +1,65 @@
+import collections
+import collections.abc
+import timeit
+
+# 兼容Python3.10及以上版本
+if not hasattr(collections, r'Iterable'):
+    collections.Iterable = collections.abc.Iterable
+
+from pynaja.cache.base import CacheKeyBuilder
+from pynaja.common.async_base import Utils
+
+
+class Service:
+
+    def __init__(self, name):
+
+        self.name = name
+
+    def __repr__(self):
+
+        return f'<Service {self.name}>'
+
+    async def get_user(self, user_id, *, fields=None, with_detail=False):
+
+        return user_id
+
+
+CASES = {
+    r'scalar': ((10086,), {}),
+    r'string': ((r'user_10086', r'zh_CN'), {}),
+    r'kwargs': ((10086,), {r'fields': (r'id', r'name', r'avatar'), r'with_detail': True}),
+    r'unhashable': (([1, 2, 3], {r'page': 1, r'size': 20}), {}),
+}
+
+
+def main(number=0x20000):
+
+    service = Service(r'default')
+
+    func = service.get_user
+
+    builder = CacheKeyBuilder(func)
+
+    print(f'{"case":<12}{"params_sign(us)":>18}{"CacheKeyBuilder(us)":>22}{"speedup":>10}')
+
+    for name, (args, kwargs) in CASES.items():
+
+        sign_time = timeit.timeit(lambda: Utils.params_sign(func, *args, **kwargs), number=number)
+        key_time = timeit.timeit(lambda: builder(*args, **kwargs), number=number)
+
+        print(
+            f'{name:<12}{sign_time / number * 1e6:>18.3f}{key_time / number * 1e6:>22.3f}'
+            f'{sign_time / key_time:>9.1f}x'
+        )
+
+    # repr相同的不同对象在params_sign中会得到相同的签名
+    print(
+        r'same repr collision:',
+        Utils.params_sign(Service(r'a').get_user) == Utils.params_sign(Service(r'a').get_user),
+        CacheKeyBuilder.make_item(Service(r'a')) == CacheKeyBuilder.make_item(Service(r'a')),
+    )
+
+
+if __name__ == r'__main__':
+    main()
@@ -0,0 +1,246 @@
+import heapq
+import re
+from collections import Counter
+
+from pynaja.cache.redis import ShardedCacheClient
+from pynaja.common.async_base import Utils
+
+# 键名中被视为变量的片段(纯数字、长十六进制串)，聚合时替换为通配符
+KEY_VARIABLE_SEGMENT = re.compile(r'^(\d+|[0-9a-fA-F]{16,}|[0-9a-fA-F-]{36})$')
+KEY_SEGMENT_SPLITTER = re.compile(r'([:_.|/])')
+
+
+class KeyspaceReport(dict):
+    """键空间分析报告
+    """
+
+    @property
+    def scanned(self):
+
+        return self.get(r'scanned', 0)
+
+    @property
+    def prefixes(self):
+
+        return self.get(r'prefixes', {})
+
+    @property
+    def largest(self):
+
+        return self.get(r'largest', [])
+
+    @property
+    def no_ttl(self):
+
+        return self.get(r'no_ttl', {})
+
+    @property
+    def codecs(self):
+
+        return self.get(r'codecs', {})
+
+
+class KeyspaceAnalyzer:
+    """Redis键空间内存分析器
+
+    使用SCAN抽样键，通过pipeline批量执行MEMORY USAGE、TYPE、PTTL和OBJECT ENCODING，不会长时间阻塞Redis
+
+    按键名模式聚合内存占用，统计最大的键、没有过期时间的键，并抽样字符串值统计编解码器和压缩率
+
+    """
+
+    def __init__(
+            self, cache, value_codec=None,
+            *, prefix_depth=2, top_count=0x20, memory_samples=5, value_sample_limit=0x10000
+    ):
+
+        self._cache = cache
+        self._value_codec = value_codec
+
+        self._prefix_depth = prefix_depth
+        self._top_count = top_count
+        self._memory_samples = memory_samples
+        self._value_sample_limit = value_sample_limit
+
+    def key_pattern(self, key):
+        """将键名转换为聚合模式，取前prefix_depth个片段，变量片段替换为*
+        """
+
+        global KEY_VARIABLE_SEGMENT, KEY_SEGMENT_SPLITTER
+
+        tokens = KEY_SEGMENT_SPLITTER.split(key)
+
+        segments = tokens[:self._prefix_depth * 2 - 1]
+
+        for index in range(0, len(segments), 2):
+            if KEY_VARIABLE_SEGMENT.match(segments[index]):
+                segments[index] = r'*'
+
+        result = r''.join(segments)
+
+        if len(tokens) > len(segments):
+            result += tokens[len(segments)] + r'*'
+
+        return result
+
+    def _get_client(self, key):
+
+        if isinstance(self._cache, ShardedCacheClient):
+            return self._cache.get_node_client(key)
+        else:
+            return self._cache
+
+    def _group_keys(self, keys):
+
+        groups = {}
+
+        for key in keys:
+            groups.setdefault(self._get_client(key), []).append(key)
+
+        return groups.items()
+
+    async def _inspect_keys(self, client, keys):
+
+        pipe = client.pipeline()
+
+        for key in keys:
+            pipe.memory_usage(key, self._memory_samples)
+            pipe.type(key)
+            pipe.pttl(key)
+            pipe.object_encoding(key)
+
+        result = await pipe.execute(return_exceptions=True)
+
+        for index, key in enumerate(keys):
+
+            memory, _type, ttl, encoding = result[index * 4:index * 4 + 4]
+
+            # 抽样期间被删除的键
+            if isinstance(memory, Exception) or memory is None:
+                continue
+
+            yield key, int(memory), Utils.basestring(_type), ttl, encoding
+
+    async def _sample_values(self, client, keys, codecs):
+
+        if not keys:
+            return
+
+        for val in await client._mget(*keys):
+
+            if not val:
+                continue
+
+            try:
+                codec, stream = self._value_codec.unpack(val)
+                name = codec.name if codec is not None else r'legacy'
+                compressed = len(stream) != len(val) - 1
+            except Exception as _:
+                name, stream, compressed = r'unknown', val, False
+
+            stat = codecs.get(name)
+
+            if stat is None:
+                stat = codecs[name] = {r'count': 0, r'compressed': 0, r'stored_bytes': 0, r'raw_bytes': 0}
+
+            stat[r'count'] += 1
+            stat[r'compressed'] += 1 if compressed else 0
+            stat[r'stored_bytes'] += len(val)
+            stat[r'raw_bytes'] += len(stream)
+
+    async def analyze(self, match=None, sample_count=0x2710, scan_count=0x100, rate_limit=0):
+        """抽样分析键空间，rate_limit为每秒最多分析的键数量，0为不限制
+        """
+
+        scanned = 0
+        total_memory = 0
+
+        prefixes = {}
+        largest = []
+        no_ttl = {r'count': 0, r'memory': 0, r'largest': []}
+        codecs = {}
+
+        start_time = Utils.loop_time()
+
+        async for keys in self._cache.iscan(match=match, count=scan_count, batch=True):
+
+            keys = keys[:sample_count - scanned]
+
+            for client, items in self._group_keys(keys):
+
+                value_keys = []
+
+                async for key, memory, _type, ttl, encoding in self._inspect_keys(client, items):
+
+                    scanned += 1
+                    total_memory += memory
+
+                    pattern = self.key_pattern(key)
+
+                    stat = prefixes.get(pattern)
+
+                    if stat is None:
+                        stat = prefixes[pattern] = {
+                            r'count': 0, r'memory': 0, r'max_memory': 0, r'no_ttl': 0, r'types': Counter(),
+                        }
+
+                    stat[r'count'] += 1
+                    stat[r'memory'] += memory
+                    stat[r'max_memory'] = max(stat[r'max_memory'], memory)
+                    stat[r'types'][_type] += 1
+
+                    item = (memory, key, _type, encoding, ttl)
+
+                    if len(largest) < self._top_count:
+                        heapq.heappush(largest, item)
+                    elif memory > largest[0][0]:
+                        heapq.heapreplace(largest, item)
+
+                    if ttl == -1:
+
+                        stat[r'no_ttl'] += 1
+
+                        no_ttl[r'count'] += 1
+                        no_ttl[r'memory'] += memory
+
+                        if len(no_ttl[r'largest']) < self._top_count:
+                            heapq.heappush(no_ttl[r'largest'], item)
+                        elif memory > no_ttl[r'largest'][0][0]:
+                            heapq.heapreplace(no_ttl[r'largest'], item)
+
+                    if self._value_codec is not None and _type == r'string' and memory <= self._value_sample_limit:
+                        value_keys.append(key)
+
+                if self._value_codec is not None:
+                    await self._sample_values(client, value_keys, codecs)
+
+            if rate_limit > 0:
+                await Utils.sleep(max(0, scanned / rate_limit - (Utils.loop_time() - start_time)))
+
+            if scanned >= sample_count:
+                break
+
+        for stat in codecs.values():
+            stat[r'ratio'] = (stat[r'stored_bytes'] / stat[r'raw_bytes']) if stat[r'raw_bytes'] > 0 else 1
+
+        for stat in prefixes.values():
+            stat[r'mean_memory'] = stat[r'memory'] / stat[r'count']
+            stat[r'types'] = dict(stat[r'types'])
+
+        no_ttl[r'largest'] = [self._format_item(item) for item in sorted(no_ttl[r'largest'], reverse=True)]
+
+        return KeyspaceReport(
+            scanned=scanned,
+            total_memory=total_memory,
+            prefixes=dict(sorted(prefixes.items(), key=lambda x: x[1][r'memory'], reverse=True)),
+            largest=[self._format_item(item) for item in sorted(largest, reverse=True)],
+            no_ttl=no_ttl,
+            codecs=codecs,
+        )
+
+    @staticmethod
+    def _format_item(item):
+
+        memory, key, _type, encoding, ttl = item
+
+        return {r'key': key, r'memory': memory, r'type': _type, r'encoding': encoding, r'ttl': ttl}
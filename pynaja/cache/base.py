@@ -1,20 +1,186 @@
 import asyncio
+import hashlib
+import inspect
+import pickle
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import MappingProxyType
 
 from cachetools import TTLCache
 
+from pynaja.cache.tinylfu import TinyLFUCache
 from pynaja.common.async_base import Utils
 
 
+# 值相等但类型不同的标量(如1、1.0、True)需要标记类型，str是最常见的参数类型，不标记以减少开销
+CACHE_KEY_TAGGED_TYPES = frozenset((int, float, bool, complex, bytes, type(None)))
+
+# 不可哈希参数的摘要长度(字节)
+CACHE_KEY_DIGEST_SIZE = 0x10
+
+
+class _KeywordMark:
+    """缓存键中位置参数与关键字参数的分隔标记
+    """
+
+    __slots__ = []
+
+    def __repr__(self):
+
+        return r'<kwargs>'
+
+
+CACHE_KEY_KWARGS_MARK = _KeywordMark()
+
+
+class CacheKeyBuilder:
+    """函数缓存键生成器
+
+    直接使用参数值组成可哈希的元组作为缓存键，标量参数附带类型标记，不可哈希的容器按结构转换为元组，
+    无法结构化转换的参数才使用序列化摘要
+
+    key_funcs为参数名或位置索引到键函数的映射，键函数返回值代替参数值参与生成缓存键，设置为None时忽略该参数
+
+    """
+
+    def __init__(self, func, key_funcs=None):
+
+        self._func = func
+
+        self._arg_funcs = {}
+        self._kwarg_funcs = {}
+
+        if key_funcs:
+
+            try:
+                params = list(inspect.signature(func).parameters.values())
+            except (TypeError, ValueError) as _:
+                params = []
+
+            positions = {
+                param.name: index for index, param in enumerate(params)
+                if param.kind in (param.POSITIONAL_ONLY, param.POSITIONAL_OR_KEYWORD)
+            }
+
+            for name, key_func in key_funcs.items():
+
+                if isinstance(name, int):
+                    self._arg_funcs[name] = key_func
+                    continue
+
+                self._kwarg_funcs[name] = key_func
+
+                if name in positions:
+                    self._arg_funcs[positions[name]] = key_func
+
+    def __call__(self, *args, **kwargs):
+
+        global CACHE_KEY_KWARGS_MARK
+
+        make_item = self.make_item
+
+        if not kwargs and not self._arg_funcs:
+            return (self._func,) + tuple(map(make_item, args))
+
+        key = [self._func]
+
+        if self._arg_funcs:
+            for index, val in enumerate(args):
+                if index in self._arg_funcs:
+                    key_func = self._arg_funcs[index]
+                    if key_func is None:
+                        continue
+                    val = key_func(val)
+                key.append(make_item(val))
+        else:
+            key.extend(map(make_item, args))
+
+        if kwargs:
+
+            key.append(CACHE_KEY_KWARGS_MARK)
+
+            for name in (sorted(kwargs) if len(kwargs) > 1 else kwargs):
+
+                val = kwargs[name]
+
+                if name in self._kwarg_funcs:
+                    key_func = self._kwarg_funcs[name]
+                    if key_func is None:
+                        continue
+                    val = key_func(val)
+
+                key.append(name)
+                key.append(make_item(val))
+
+        return tuple(key)
+
+    @classmethod
+    def make_item(cls, val):
+
+        global CACHE_KEY_TAGGED_TYPES
+
+        _type = type(val)
+
+        if _type is str:
+            return val
+
+        if _type in CACHE_KEY_TAGGED_TYPES:
+            return _type, val
+
+        if _type is tuple:
+            return _type, tuple(cls.make_item(item) for item in val)
+
+        try:
+            hash(val)
+        except TypeError as _:
+            return _type, cls._freeze(val)
+        else:
+            return _type, val
+
+    @classmethod
+    def _freeze(cls, val):
+
+        if isinstance(val, (list, tuple)):
+            return tuple(cls.make_item(item) for item in val)
+
+        if isinstance(val, dict):
+            return frozenset((cls.make_item(_key), cls.make_item(_val)) for _key, _val in val.items())
+
+        if isinstance(val, (set, frozenset)):
+            return frozenset(val)
+
+        return cls.digest(val)
+
+    @staticmethod
+    def digest(val):
+        """不可哈希且无法结构化转换的参数，使用序列化数据的摘要，无法序列化时退化为repr
+        """
+
+        global CACHE_KEY_DIGEST_SIZE
+
+        try:
+            stream = pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+        except Exception as _:
+            stream = repr(val).encode()
+
+        return hashlib.blake2b(stream, digest_size=CACHE_KEY_DIGEST_SIZE).digest()
+
+
 class StackCache:
     """堆栈缓存
 
     使用运行内存作为高速缓存，可有效提高并发的处理能力
 
+    启用tinylfu时使用TinyLFUCache作为缓存引擎，maxsize为weigher计算的权重上限，支持数据独立的过期时间和命中统计
+
     """
 
-    def __init__(self, maxsize=0xff, ttl=60):
+    def __init__(self, maxsize=0xff, ttl=60, *, tinylfu=False, weigher=None):
 
-        self._cache = TTLCache(maxsize, ttl)
+        if tinylfu or weigher is not None:
+            self._cache = TinyLFUCache(maxsize, ttl, weigher=weigher)
+        else:
+            self._cache = TTLCache(maxsize, ttl)
 
     def has(self, key):
 
@@ -24,9 +190,14 @@ class StackCache:
 
         return self._cache.get(key, default)
 
-    def set(self, key, val):
+    def set(self, key, val, ttl=None):
 
-        self._cache[key] = val
+        if ttl is None:
+            self._cache[key] = val
+        elif isinstance(self._cache, TinyLFUCache):
+            self._cache.set(key, val, ttl)
+        else:
+            raise TypeError(r'Entry ttl requires tinylfu engine')
 
     def incr(self, key, val=1):
 
@@ -56,35 +227,137 @@ class StackCache:
 
         return self._cache.clear()
 
+    def stats(self):
+
+        if isinstance(self._cache, TinyLFUCache):
+            return self._cache.stats()
+        else:
+            return None
+
+
+class _FuncCacheItem:
+
+    __slots__ = [r'result', r'refresh_time', r'expire_time']
+
+    def __init__(self, result, refresh_time, expire_time):
+
+        self.result = result
+        self.refresh_time = refresh_time
+        self.expire_time = expire_time
+
 
 class FuncCache:
     """函数缓存
 
     使用堆栈缓存实现的函数缓存，在有效期内函数签名一致就会命中缓存
 
+    negative_ttl大于0时，函数返回None的结果也会按negative_ttl缓存，避免不存在的数据反复穿透到数据源
+
+    refresh_ahead为0~1之间的比例，缓存数据的存活时间超过ttl的该比例后，由单个后台任务提前重新计算，
+    期间调用方继续获得当前缓存的结果
+
+    key_funcs参见CacheKeyBuilder，例如key_funcs={r'self': None}可以让不同实例共享缓存
+
     """
 
-    def __init__(self, maxsize=0xff, ttl=10):
+    def __init__(
+            self, maxsize=0xff, ttl=10,
+            *, tinylfu=False, weigher=None, negative_ttl=0, refresh_ahead=0, key_funcs=None
+    ):
+
+        if not (0 <= refresh_ahead < 1):
+            raise ValueError(f'Refresh ahead out of range: {refresh_ahead}')
+
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._refresh_ahead = refresh_ahead
+
+        if weigher is not None:
+            result_weigher = weigher
+            # 缓存保存的是_FuncCacheItem包装对象，按函数结果计算权重
+            weigher = lambda key, item: result_weigher(key, item.result)
+
+        self._cache = StackCache(maxsize, max(ttl, negative_ttl), tinylfu=tinylfu, weigher=weigher)
+
+        self._refreshing = set()
+
+        self._key_funcs = key_funcs
+
+    @property
+    def cache(self):
+
+        return self._cache
+
+    def _make_item(self, result):
+
+        now_time = Utils.loop_time()
+
+        if result is None:
+            return _FuncCacheItem(None, None, now_time + self._negative_ttl)
+
+        if self._refresh_ahead > 0:
+            refresh_time = now_time + self._ttl * self._refresh_ahead
+        else:
+            refresh_time = None
+
+        return _FuncCacheItem(result, refresh_time, now_time + self._ttl)
+
+    def _set_result(self, func_sign, result):
+
+        if result is not None or self._negative_ttl > 0:
+            self._cache.set(func_sign, self._make_item(result))
+
+    async def _refresh(self, func_sign, func, args, kwargs):
 
-        self._cache = StackCache(maxsize, ttl)
+        try:
+
+            result = await Utils.awaitable_wrapper(
+                func(*args, **kwargs)
+            )
+
+            self._set_result(func_sign, result)
+
+        except Exception as err:
+
+            Utils.log.exception(err)
+
+        finally:
+
+            self._refreshing.discard(func_sign)
 
     def __call__(self, func):
 
+        key_builder = CacheKeyBuilder(func, self._key_funcs)
+
         @Utils.func_wraps(func)
         async def _wrapper(*args, **kwargs):
 
-            func_sign = Utils.params_sign(func, *args, **kwargs)
+            func_sign = key_builder(*args, **kwargs)
 
-            result = self._cache.get(func_sign)
+            item = self._cache.get(func_sign)
 
-            if result is None:
+            if item is not None:
 
-                result = await Utils.awaitable_wrapper(
-                    func(*args, **kwargs)
-                )
+                now_time = Utils.loop_time()
 
-                if result is not None:
-                    self._cache.set(func_sign, result)
+                if now_time < item.expire_time:
+
+                    if item.refresh_time is not None and now_time >= item.refresh_time \
+                            and func_sign not in self._refreshing:
+
+                        self._refreshing.add(func_sign)
+
+                        Utils.create_task(
+                            self._refresh(func_sign, func, args, kwargs)
+                        )
+
+                    return item.result
+
+            result = await Utils.awaitable_wrapper(
+                func(*args, **kwargs)
+            )
+
+            self._set_result(func_sign, result)
 
             return result
 
@@ -96,54 +369,138 @@ class ShareFuture:
 
     同一时刻并发调用函数时，使用该装饰器的函数签名一致的调用，会共享计算结果
 
+    计算过程中的异常和取消会传递给所有等待者；单个调用方超时或被取消不影响其他调用方，所有调用方都放弃等待后计算任务才会被取消
+
+    copy为结果的复制策略：share直接共享结果对象，deepcopy为每个等待者深拷贝一份(默认)，frozen将结果转换为只读视图后共享
+
+    timeout为等待结果的默认超时时间，可以通过ShareFuture.wait_timeout为单次调用设置超时时间
+
     """
 
-    def __init__(self):
+    COPY_SHARE = r'share'
+    COPY_DEEPCOPY = r'deepcopy'
+    COPY_FROZEN = r'frozen'
+
+    _wait_timeout = ContextVar(r'share_future_wait_timeout', default=None)
+
+    def __init__(self, *, key_funcs=None, copy=COPY_DEEPCOPY, timeout=None):
+
+        if copy not in (self.COPY_SHARE, self.COPY_DEEPCOPY, self.COPY_FROZEN):
+            raise ValueError(f'Unknown copy policy: {copy}')
 
         self._future = {}
+        self._waiters = {}
+
+        self._key_funcs = key_funcs
+
+        self._copy = copy
+        self._timeout = timeout
+
+    @classmethod
+    @contextmanager
+    def wait_timeout(cls, timeout):
+        """在当前上下文中设置等待共享结果的超时时间
+        """
+
+        token = cls._wait_timeout.set(timeout)
+
+        try:
+            yield
+        finally:
+            cls._wait_timeout.reset(token)
+
+    @classmethod
+    def freeze(cls, val):
+        """将结果递归转换为只读视图：dict转为MappingProxyType，list转为tuple，set转为frozenset
+        """
+
+        if isinstance(val, dict):
+            return MappingProxyType({_key: cls.freeze(_val) for _key, _val in val.items()})
+
+        if isinstance(val, (list, tuple)):
+            return tuple(cls.freeze(item) for item in val)
+
+        if isinstance(val, set):
+            return frozenset(val)
+
+        return val
+
+    async def _run(self, coro):
+
+        result = await coro
+
+        if self._copy == self.COPY_FROZEN:
+            result = self.freeze(result)
+
+        return result
 
     def __call__(self, func):
 
+        key_builder = CacheKeyBuilder(func, self._key_funcs)
+
         @Utils.func_wraps(func)
         async def _wrapper(*args, **kwargs):
 
-            future = None
-
-            func_sign = Utils.params_sign(func, *args, **kwargs)
+            func_sign = key_builder(*args, **kwargs)
 
-            if func_sign in self._future:
+            future = self._future.get(func_sign)
 
-                future = asyncio.Future()
+            # 已取消但尚未清理的任务不再共享
+            leader = future is None or future.cancelled()
 
-                self._future[func_sign].append(future)
+            if leader:
 
-            else:
+                coro = func(*args, **kwargs)
 
-                future = Utils.create_task(
-                    func(*args, **kwargs)
-                )
-
-                if future is None:
-                    TypeError(r'Not Coroutine Object')
+                if not asyncio.iscoroutine(coro):
+                    raise TypeError(r'Not Coroutine Object')
 
-                self._future[func_sign] = [future]
+                future = self._future[func_sign] = Utils.create_task(self._run(coro))
 
                 future.add_done_callback(
                     Utils.func_partial(self._clear_future, func_sign)
                 )
 
-            return await future
+            self._waiters[future] = self._waiters.get(future, 0) + 1
+
+            timeout = self._wait_timeout.get()
+
+            if timeout is None:
+                timeout = self._timeout
+
+            try:
+
+                if timeout is None:
+                    result = await asyncio.shield(future)
+                else:
+                    result = await asyncio.wait_for(asyncio.shield(future), timeout)
+
+            finally:
+
+                self._release_waiter(future)
+
+            if not leader and self._copy == self.COPY_DEEPCOPY:
+                result = Utils.deepcopy(result)
+
+            return result
 
         return _wrapper
 
-    def _clear_future(self, func_sign, _):
+    def _release_waiter(self, future):
+
+        count = self._waiters.pop(future, 0) - 1
 
-        if func_sign not in self._future:
-            return
+        if count > 0:
+            self._waiters[future] = count
+        elif not future.done():
+            # 所有调用方都已放弃等待
+            future.cancel()
 
-        futures = self._future.pop(func_sign)
+    def _clear_future(self, func_sign, future):
 
-        result = futures.pop(0).result()
+        if self._future.get(func_sign) is future:
+            del self._future[func_sign]
 
-        for future in futures:
-            future.set_result(Utils.deepcopy(result))
+        # 标记异常已被获取，避免所有调用方都放弃等待时输出未获取异常的警告
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,497 @@
+import heapq
+import pickle
+
+from collections import Counter
+from collections.abc import Mapping, Sequence
+
+from pynaja.common.async_base import Utils
+
+# 头字节结构：低4位为编解码器ID，最高位为压缩标记，次高位为预置字典标记(其后跟随1字节字典ID)
+VALUE_CODEC_ID_MASK = 0x0f
+VALUE_CODEC_COMPRESSED_FLAG = 0x80
+VALUE_CODEC_ZDICT_FLAG = 0x40
+
+# zlib预置字典的有效长度上限(滑动窗口大小)
+ZDICT_MAX_SIZE = 0x8000
+
+
+class CodecAbstract:
+    """编解码器抽象类
+
+    子类实现encode和decode接口，codec_id取值范围为1~15，会写入数据头字节
+
+    """
+
+    def __init__(self, codec_id, name):
+
+        if not (0 < codec_id <= VALUE_CODEC_ID_MASK):
+            raise ValueError(f'Codec id out of range: {codec_id}')
+
+        self._id = codec_id
+        self._name = name
+
+    @property
+    def id(self):
+
+        return self._id
+
+    @property
+    def name(self):
+
+        return self._name
+
+    def encode(self, val):
+
+        raise NotImplementedError()
+
+    def decode(self, stream):
+
+        raise NotImplementedError()
+
+
+class PickleCodec(CodecAbstract):
+    """pickle编解码器
+    """
+
+    def __init__(self, protocol=pickle.HIGHEST_PROTOCOL):
+
+        super().__init__(0x01, r'pickle')
+
+        self._protocol = protocol
+
+    def encode(self, val):
+
+        return pickle.dumps(val, self._protocol)
+
+    def decode(self, stream):
+
+        return pickle.loads(stream)
+
+
+class JsonCodec(CodecAbstract):
+    """json编解码器，用于需要跨语言读取的数据
+    """
+
+    def __init__(self):
+
+        super().__init__(0x02, r'json')
+
+    def encode(self, val):
+
+        return Utils.utf8(Utils.json_encode(val))
+
+    def decode(self, stream):
+
+        return Utils.json_decode(bytes(stream))
+
+
+class RawCodec(CodecAbstract):
+    """原始字节直通编解码器
+    """
+
+    def __init__(self):
+
+        super().__init__(0x03, r'raw')
+
+    def encode(self, val):
+
+        return bytes(val)
+
+    def decode(self, stream):
+
+        return bytes(stream)
+
+
+class ValueCodec:
+    """Redis值编解码器
+
+    按注册的编解码器对值进行序列化，超过阈值的数据才进行zlib压缩，并使用头字节标记编码方式
+
+    设置了预置字典(zdict)时，超过zdict_threshold的数据使用字典压缩，字典ID写入头部，便于字典轮换
+
+    兼容旧版本Utils.pickle_dumps写入的数据(zlib流头字节固定为0x78)
+
+    header为False(默认)时仍写入旧版本格式，保证滚动升级期间未升级的进程可以读取新写入的数据，
+    所有读取方升级后再开启header使用头字节格式；非pickle的默认编解码器和预置字典只能在header格式下使用
+
+    """
+
+    def __init__(
+            self, default=r'pickle',
+            *, header=False, compress_threshold=0x400, compress_level=6, pickle_protocol=pickle.HIGHEST_PROTOCOL,
+            zdicts=None, zdict_id=None, zdict_threshold=0x20
+    ):
+
+        if not header and default != r'pickle':
+            raise ValueError(f'Codec {default} requires header format')
+
+        self._header = header
+
+        self._codecs = {}
+        self._codec_names = {}
+
+        self._compress_threshold = compress_threshold
+        self._compress_level = compress_level
+
+        self._zdicts = {}
+        self._zdict_id = None
+        self._zdict_threshold = zdict_threshold
+
+        if zdicts:
+            for _id, _zdict in zdicts.items():
+                self.register_zdict(_id, _zdict)
+
+        if zdict_id is not None:
+            self.use_zdict(zdict_id)
+
+        self.register(PickleCodec(pickle_protocol))
+        self.register(JsonCodec())
+        self.register(RawCodec())
+
+        self._raw_codec = self._codec_names[r'raw']
+        self._default_codec = self._codec_names[default]
+
+    @property
+    def default(self):
+
+        return self._default_codec.name
+
+    @property
+    def header(self):
+
+        return self._header
+
+    def register(self, codec):
+
+        if not isinstance(codec, CodecAbstract):
+            raise TypeError(r'Not CodecAbstract object')
+
+        _codec = self._codecs.get(codec.id)
+
+        if _codec is not None and _codec.name != codec.name:
+            raise ValueError(f'Codec id {codec.id} already registered by {_codec.name}')
+
+        self._codecs[codec.id] = self._codec_names[codec.name] = codec
+
+    def get_codec(self, name):
+
+        return self._codec_names[name]
+
+    @property
+    def zdict_id(self):
+
+        return self._zdict_id
+
+    def register_zdict(self, zdict_id, zdict):
+
+        if not (0 <= zdict_id <= 0xff):
+            raise ValueError(f'Zdict id out of range: {zdict_id}')
+
+        self._zdicts[zdict_id] = bytes(zdict[-ZDICT_MAX_SIZE:])
+
+    def use_zdict(self, zdict_id):
+
+        if zdict_id is not None and zdict_id not in self._zdicts:
+            raise ValueError(f'Zdict id not registered: {zdict_id}')
+
+        if zdict_id is not None and not self._header:
+            raise ValueError(r'Zdict requires header format')
+
+        self._zdict_id = zdict_id
+
+    def encode(self, val, codec=None):
+        """编码数据，旧版本格式下指定了codec时使用头字节格式
+        """
+
+        if codec is None and not self._header:
+            return Utils.pickle_dumps(val)
+
+        if codec is not None:
+            codec = self._codec_names[codec]
+        elif type(val) is bytes:
+            codec = self._raw_codec
+        else:
+            codec = self._default_codec
+
+        header = bytes((codec.id,))
+        stream = codec.encode(val)
+
+        if self._zdict_id is not None and self._zdict_threshold <= len(stream):
+
+            _stream = Utils.zlib_compress(stream, self._compress_level, self._zdicts[self._zdict_id])
+
+            if len(_stream) < len(stream):
+                header = bytes((codec.id | VALUE_CODEC_COMPRESSED_FLAG | VALUE_CODEC_ZDICT_FLAG, self._zdict_id))
+                stream = _stream
+
+        elif 0 < self._compress_threshold <= len(stream):
+
+            _stream = Utils.zlib_compress(stream, self._compress_level)
+
+            if len(_stream) < len(stream):
+                header = bytes((codec.id | VALUE_CODEC_COMPRESSED_FLAG,))
+                stream = _stream
+
+        return header + stream
+
+    def unpack(self, val):
+        """解析头部并解压，返回编解码器和原始序列化数据，旧版本数据的编解码器为None
+        """
+
+        header = val[0]
+
+        codec = None
+
+        if header & ~(VALUE_CODEC_ID_MASK | VALUE_CODEC_COMPRESSED_FLAG | VALUE_CODEC_ZDICT_FLAG) == 0:
+            codec = self._codecs.get(header & VALUE_CODEC_ID_MASK)
+
+        if codec is None:
+            return None, Utils.zlib_decompress(val)
+
+        if header & VALUE_CODEC_ZDICT_FLAG:
+
+            zdict = self._zdicts.get(val[1])
+
+            if zdict is None:
+                raise ValueError(f'Zdict id not registered: {val[1]}')
+
+            stream = Utils.zlib_decompress(memoryview(val)[2:], zdict)
+
+        elif header & VALUE_CODEC_COMPRESSED_FLAG:
+
+            stream = Utils.zlib_decompress(memoryview(val)[1:])
+
+        else:
+
+            stream = memoryview(val)[1:]
+
+        return codec, stream
+
+    def decode(self, val):
+
+        if not val:
+            return val
+
+        codec, stream = self.unpack(val)
+
+        if codec is None:
+            return pickle.loads(stream)
+
+        return codec.decode(stream)
+
+
+class LazyList(Sequence):
+    """延迟解码列表
+
+    保存原始数据，元素在首次访问时解码并缓存，空值(None或空字节)原样返回
+
+    """
+
+    __slots__ = [r'_raw', r'_items', r'_decoder']
+
+    _UNDECODED = object()
+
+    def __init__(self, raw, decoder):
+
+        self._raw = raw
+        self._items = [self._UNDECODED] * len(raw)
+        self._decoder = decoder
+
+    def _decode(self, index):
+
+        item = self._items[index]
+
+        if item is self._UNDECODED:
+
+            val = self._raw[index]
+
+            item = self._items[index] = self._decoder(val) if val else val
+
+        return item
+
+    def __getitem__(self, index):
+
+        if isinstance(index, slice):
+            return [self._decode(_index) for _index in range(*index.indices(len(self._raw)))]
+
+        return self._decode(index)
+
+    def __len__(self):
+
+        return len(self._raw)
+
+    def __eq__(self, other):
+
+        return list(self) == other
+
+    def __repr__(self):
+
+        return f'<LazyList size:{len(self._raw)}>'
+
+    def raw(self, index):
+
+        return self._raw[index]
+
+
+class LazyDict(Mapping):
+    """延迟解码字典
+
+    保存原始数据，值在首次访问时解码并缓存，空值(None或空字节)原样返回
+
+    """
+
+    __slots__ = [r'_raw', r'_items', r'_decoder']
+
+    def __init__(self, raw, decoder):
+
+        self._raw = raw
+        self._items = {}
+        self._decoder = decoder
+
+    def __getitem__(self, key):
+
+        if key in self._items:
+            return self._items[key]
+
+        val = self._raw[key]
+
+        item = self._items[key] = self._decoder(val) if val else val
+
+        return item
+
+    def __iter__(self):
+
+        return iter(self._raw)
+
+    def __len__(self):
+
+        return len(self._raw)
+
+    def __contains__(self, key):
+
+        return key in self._raw
+
+    def __eq__(self, other):
+
+        return dict(self.items()) == other
+
+    def __repr__(self):
+
+        return f'<LazyDict size:{len(self._raw)}>'
+
+    def raw(self, key):
+
+        return self._raw[key]
+
+
+class ZDictTrainer:
+    """zlib预置字典训练器
+
+    简化版的COVER算法：统计样本中跨样本重复出现的kmer，贪心挑选覆盖收益最高的片段拼接成字典，
+    收益越高的片段越靠近字典尾部(zlib对近距离匹配的编码更短)
+
+    """
+
+    def __init__(self, dict_size=ZDICT_MAX_SIZE, segment_size=0x40, kmer_size=0x08):
+
+        self._dict_size = min(dict_size, ZDICT_MAX_SIZE)
+        self._segment_size = segment_size
+        self._kmer_size = kmer_size
+
+        self._samples = []
+
+    @property
+    def sample_count(self):
+
+        return len(self._samples)
+
+    def add_sample(self, stream):
+
+        if len(stream) >= self._kmer_size:
+            self._samples.append(bytes(stream))
+
+    def _iter_kmers(self, stream):
+
+        size = self._kmer_size
+
+        return (stream[index:index + size] for index in range(len(stream) - size + 1))
+
+    def train(self):
+
+        frequency = Counter()
+
+        for sample in self._samples:
+            frequency.update(set(self._iter_kmers(sample)))
+
+        # 只在一个样本中出现的kmer对其他数据没有压缩收益
+        for kmer in [kmer for kmer, count in frequency.items() if count < 2]:
+            del frequency[kmer]
+
+        heap = []
+        step = max(1, self._segment_size // 2)
+
+        for sample in self._samples:
+            for index in range(0, max(1, len(sample) - self._segment_size + 1), step):
+                segment = sample[index:index + self._segment_size]
+                score = sum(frequency[kmer] for kmer in set(self._iter_kmers(segment)))
+                if score > 0:
+                    heap.append((-score, segment))
+
+        heapq.heapify(heap)
+
+        segments = []
+        total_size = 0
+
+        while heap and total_size < self._dict_size:
+
+            _, segment = heapq.heappop(heap)
+
+            kmers = set(self._iter_kmers(segment))
+            score = sum(frequency[kmer] for kmer in kmers)
+
+            if score <= 0:
+                continue
+
+            # 惰性贪心：重新计算后收益下降的片段放回堆中重新排序
+            if heap and score < -heap[0][0]:
+                heapq.heappush(heap, (-score, segment))
+                continue
+
+            for kmer in kmers:
+                frequency[kmer] = 0
+
+            segments.append(segment)
+            total_size += len(segment)
+
+        segments.reverse()
+
+        return b''.join(segments)[-self._dict_size:]
+
+    async def sample_keyspace(self, cache, value_codec, match=None, sample_count=0x400, scan_count=0x100):
+        """通过SCAN抽样线上键空间，将解压后的原始序列化数据作为训练样本
+        """
+
+        cursor = 0
+
+        while self.sample_count < sample_count:
+
+            cursor, keys = await cache.scan(cursor, match, scan_count)
+
+            if keys:
+
+                for val in await cache._mget(*keys):
+
+                    if not val:
+                        continue
+
+                    try:
+                        _, stream = value_codec.unpack(val)
+                    except Exception as _:
+                        continue
+
+                    self.add_sample(stream)
+
+            if cursor == 0:
+                break
+
+        return self.sample_count
@@ -1,27 +1,174 @@
+import asyncio
+import functools
+import inspect
+from collections import Counter
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+
 import aioredis
-from aioredis.errors import ReplyError, MaxClientsError, AuthError, ReadOnlyError
+from aioredis.abc import AbcPool
+from aioredis.errors import ReplyError, MaxClientsError, AuthError, ReadOnlyError, PipelineError
 from aioredis.util import _NOTSET
-from aioredis.commands.string import StringCommandsMixin
+from aioredis.pubsub import Receiver
 from aioredis.commands.transaction import Pipeline, MultiExec
 
-from pynaja.common.async_base import Utils, AsyncContextManager, AsyncCirculator
+from pynaja.cache.base import StackCache, ShareFuture
+from pynaja.cache.codec import ValueCodec, LazyList, LazyDict
+from pynaja.common.async_base import Utils, AsyncContextManager, AsyncCirculator, AsyncCirculatorForSecond, MultiTasks
 from pynaja.common.base import WeakContextVar
-from pynaja.event.async_event import DistributedEvent
+from pynaja.common.error import RedisPoolOverload, RedisChunkMissing
+from pynaja.common.struct import ConsistentHash, Histogram
+from pynaja.event.async_event import DistributedEvent, StreamEvent
 
 REDIS_ERROR_RETRY_COUNT = 0x1f
 REDIS_POOL_WATER_LEVEL_WARNING_LINE = 0x08
 
+# 通配符删除时每批UNLINK的键数量
+REDIS_DELETE_BATCH_SIZE = 0x200
+
+# 大对象分块存储：每块字节数、每个pipeline读写的块数量、旧版本数据块的保留时间(秒)
+REDIS_CHUNK_SIZE = 0x80000
+REDIS_CHUNK_BATCH_SIZE = 0x08
+REDIS_CHUNK_EXPIRE_GRACE = 60
+
+# 分布式锁等待释放通知的最长间隔(秒)，用于兜底锁超时自动释放等没有通知的情况
+MLOCK_NOTIFY_WAIT_INTERVAL = 1
+
+# 分布式锁fencing token计数器，所有锁共用(分片模式下每个节点一个)，不随锁过期以保证token单调递增
+MLOCK_FENCE_KEY = r'process_lock_fence'
+
+# 自适应连接池：获取连接等待时间的P95超过扩容线时扩容，达到上限后超过过载线时快速失败(秒)
+REDIS_POOL_ACQUIRE_WAIT_GROW_LINE = 0.005
+REDIS_POOL_ACQUIRE_WAIT_SHED_LINE = 0.1
+
+# 自动管道模式下需要独占连接的命令(阻塞、事务、订阅类)
+REDIS_AUTO_PIPELINE_EXCLUDED_COMMANDS = {
+    b'BLPOP', b'BRPOP', b'BRPOPLPUSH', b'BZPOPMIN', b'BZPOPMAX', b'XREAD', b'XREADGROUP',
+    b'WATCH', b'UNWATCH', b'MULTI', b'EXEC', b'DISCARD',
+    b'SUBSCRIBE', b'UNSUBSCRIBE', b'PSUBSCRIBE', b'PUNSUBSCRIBE', b'MONITOR',
+}
+
+# 配置了从库时路由到从库执行的只读命令
+REDIS_READONLY_COMMANDS = {
+    b'GET', b'MGET', b'STRLEN', b'GETRANGE', b'EXISTS', b'TYPE', b'TTL', b'PTTL',
+    b'HGET', b'HMGET', b'HGETALL', b'HKEYS', b'HVALS', b'HLEN', b'HEXISTS', b'HSTRLEN', b'HSCAN',
+    b'SMEMBERS', b'SISMEMBER', b'SCARD', b'SRANDMEMBER', b'SDIFF', b'SINTER', b'SUNION', b'SSCAN',
+    b'LRANGE', b'LINDEX', b'LLEN',
+    b'ZRANGE', b'ZREVRANGE', b'ZRANGEBYSCORE', b'ZREVRANGEBYSCORE', b'ZSCORE', b'ZCARD', b'ZCOUNT',
+    b'ZRANK', b'ZREVRANK', b'ZSCAN',
+    b'SCAN', b'KEYS',
+}
+
+# 启用近端缓存时需要广播失效的写命令及其键参数位置
+# 近端缓存只保存字符串和哈希字段，列表、集合等命令只能作用于对应类型或不存在的键，不会使本地数据过期，无需失效
+REDIS_NEAR_CACHE_WRITE_COMMANDS = {
+    **dict.fromkeys(
+        (
+            b'SET', b'SETEX', b'PSETEX', b'SETNX', b'GETSET', b'GETDEL', b'GETEX', b'APPEND', b'SETRANGE', b'SETBIT',
+            b'INCR', b'INCRBY', b'INCRBYFLOAT', b'DECR', b'DECRBY',
+            b'EXPIRE', b'PEXPIRE', b'EXPIREAT', b'PEXPIREAT', b'PERSIST', b'MOVE', b'RESTORE',
+            b'HSET', b'HSETNX', b'HMSET', b'HDEL', b'HINCRBY', b'HINCRBYFLOAT',
+            b'SINTERSTORE', b'SUNIONSTORE', b'SDIFFSTORE', b'ZUNIONSTORE', b'ZINTERSTORE', b'ZDIFFSTORE',
+            b'ZRANGESTORE', b'GEOSEARCHSTORE',
+        ),
+        slice(0, 1)
+    ),
+    b'DEL': slice(None),
+    b'UNLINK': slice(None),
+    b'RENAME': slice(0, 2),
+    b'RENAMENX': slice(0, 2),
+    b'MSET': slice(0, None, 2),
+    b'MSETNX': slice(0, None, 2),
+    b'BITOP': slice(1, 2),
+    b'COPY': slice(1, 2),
+}
+
+# 仅在写入成功(返回非零)时需要失效的条件写命令
+REDIS_NEAR_CACHE_CONDITIONAL_COMMANDS = {b'SETNX', b'MSETNX', b'HSETNX', b'RENAMENX', b'COPY'}
+
+# 需要清空近端缓存的命令
+REDIS_NEAR_CACHE_FLUSH_COMMANDS = {b'FLUSHDB', b'FLUSHALL', b'SWAPDB'}
+
+# 分片模式下要求所有键位于同一节点的多键命令及其键参数位置
+REDIS_SHARDED_MULTI_KEY_COMMANDS = {
+    **dict.fromkeys(
+        (
+            r'sdiff', r'sinter', r'sunion', r'sdiffstore', r'sinterstore', r'sunionstore',
+            r'blpop', r'brpop', r'bzpopmin', r'bzpopmax', r'zunionstore', r'zinterstore',
+            r'pfcount', r'pfmerge', r'bitop_and', r'bitop_or', r'bitop_xor', r'bitop_not',
+        ),
+        slice(None)
+    ),
+    **dict.fromkeys((r'rename', r'renamenx', r'smove', r'rpoplpush', r'brpoplpush'), slice(0, 2)),
+}
+
+_REDIS_READ_PRIMARY = ContextVar(r'redis_read_primary', default=False)
+
+
+@contextmanager
+def read_from_primary():
+    """在当前上下文中强制从主库读取，用于写后立即读等对一致性有要求的场景
+    """
+
+    token = _REDIS_READ_PRIMARY.set(True)
+
+    try:
+        yield
+    finally:
+        _REDIS_READ_PRIMARY.reset(token)
+
 
 class RedisPool:
     """Redis连接管理
     """
 
-    def __init__(self, address, password=None, *, minsize=8, maxsize=32, db=0, expire=0, key_prefix=None, **settings):
+    def __init__(
+            self, address, password=None,
+            *, minsize=8, maxsize=32, db=0, expire=0, key_prefix=None, auto_pipeline=False,
+            near_cache_size=0, near_cache_ttl=60, near_cache_copy=ShareFuture.COPY_DEEPCOPY, value_codec=None,
+            metrics=True, adaptive_maxsize=0, adaptive_interval=5,
+            **settings
+    ):
 
         self._pool = None
         self._expire = expire
         self._key_prefix = key_prefix
 
+        self._auto_pipeline = auto_pipeline
+        self._pipeline_buffer = None
+
+        self._near_cache_size = near_cache_size
+        self._near_cache_ttl = near_cache_ttl
+        self._near_cache_copy = near_cache_copy
+        self._near_cache = None
+
+        self._value_codec = ValueCodec() if value_codec is None else value_codec
+
+        self._lock_notifier = LockNotifier(self)
+
+        self._replica_selector = None
+
+        self._pubsub = None
+
+        self._metrics = RedisPoolMetrics() if metrics or adaptive_maxsize > 0 else None
+
+        self._adaptive_maxsize = adaptive_maxsize
+        self._adaptive_interval = adaptive_interval
+        self._controller = None
+
+        self._script_registry = ScriptRegistry()
+        self._script_registry.register(r'mlock_renew', MLock._renew_script)
+        self._script_registry.register(r'mlock_unlock', MLock._unlock_script)
+        self._script_registry.register(r'mlock_release', MLock._release_script)
+        self._script_registry.register(r'mlock_lock', MLock._lock_script)
+        self._script_registry.register(r'mlock_fair_lock', MLock._fair_lock_script)
+        self._script_registry.register(r'mrwlock_read_lock', MRWLock._read_lock_script)
+        self._script_registry.register(r'mrwlock_write_lock', MRWLock._write_lock_script)
+        self._script_registry.register(r'mrwlock_read_renew', MRWLock._read_renew_script)
+        self._script_registry.register(r'mrwlock_read_release', MRWLock._read_release_script)
+        self._script_registry.register(r'near_cache_get', NearCache._get_script)
+        self._script_registry.register(r'near_cache_hget', NearCache._hget_script)
+
         self._settings = settings
 
         self._settings[r'address'] = address
@@ -34,7 +181,32 @@ class RedisPool:
 
     def __await__(self):
 
-        self._pool = yield from aioredis.create_pool(**self._settings).__await__()
+        maxsize = self._settings[r'maxsize']
+
+        if self._adaptive_maxsize > maxsize:
+
+            # 底层连接池按自适应上限创建，当前上限由AdaptivePool控制
+            pool = yield from aioredis.create_pool(
+                **dict(self._settings, maxsize=self._adaptive_maxsize)
+            ).__await__()
+
+            self._pool = AdaptivePool(pool, maxsize)
+
+            self._controller = RedisPoolController(
+                self._pool, self._metrics, self._adaptive_maxsize, self._adaptive_interval
+            )
+
+        else:
+
+            self._pool = yield from aioredis.create_pool(**self._settings).__await__()
+
+        if self._auto_pipeline:
+            self._pipeline_buffer = AutoPipelineBuffer(self._pool, self._metrics)
+
+        if self._near_cache_size > 0:
+            self._near_cache = NearCache(self, self._near_cache_size, self._near_cache_ttl, self._near_cache_copy)
+
+        yield from self._load_scripts().__await__()
 
         Utils.log.info(f"Redis {self._settings[r'address']} initialized: {self._pool.size}/{self._pool.maxsize}")
 
@@ -42,970 +214,3423 @@ class RedisPool:
 
     async def close(self):
 
-        if self._pool is not None:
-            self._pool.close()
-            await self._pool.wait_closed()
+        if self._pubsub is not None:
+            await self._pubsub.close()
+            self._pubsub = None
 
-            self._pool = None
+        if self._replica_selector is not None:
+            for pool in self._replica_selector.pools:
+                await pool.close()
+            self._replica_selector = None
 
-    def get_client(self):
+        if self._controller is not None:
+            self._controller.stop()
+            self._controller = None
 
-        client = None
+        if self._pipeline_buffer is not None:
+            await self._pipeline_buffer.flush()
+            self._pipeline_buffer = None
+
+        if self._near_cache is not None:
+            self._near_cache.clear()
+            self._near_cache = None
 
         if self._pool is not None:
-            client = CacheClient(self._pool, self._expire, self._key_prefix)
+            self._pool.close()
+            await self._pool.wait_closed()
 
-        return client
+            self._pool = None
 
+    @property
+    def value_codec(self):
 
-class RedisDelegate:
-    """Redis功能组件
-    """
+        return self._value_codec
 
-    def __init__(self):
+    @property
+    def lock_notifier(self):
 
-        self._redis_pool = None
+        return self._lock_notifier
 
-        self._cache_client_context = WeakContextVar(f'cache_client_{Utils.uuid1()}')
+    @property
+    def script_registry(self):
+
+        return self._script_registry
 
     @property
-    def redis_pool(self):
+    def metrics(self):
 
-        return self._redis_pool
+        return self._metrics
 
-    async def async_init_redis(self, *args, **kwargs):
+    @property
+    def pubsub(self):
+        """进程内共享的订阅连接，独立于请求连接池
+        """
 
-        self._redis_pool = await RedisPool(*args, **kwargs)
+        if self._pubsub is None:
+            self._pubsub = PubSubMultiplexer(self)
 
-    async def async_close_redis(self):
+        return self._pubsub
 
-        if self._redis_pool is not None:
-            await self._redis_pool.close()
-            self._redis_pool = None
+    def get_pubsub(self, channel):
 
-    async def cache_health(self):
+        return self.pubsub
 
-        result = False
+    async def create_connection(self, key=None):
+        """创建独立于连接池的专用连接，用于订阅和阻塞读取等长时间占用连接的场景
+        """
 
-        async with self.get_cache_client() as cache:
-            result = bool(await cache.time())
+        settings = {
+            name: val for name, val in self._settings.items()
+            if name in (r'address', r'db', r'password', r'ssl', r'encoding', r'timeout')
+        }
 
-        return result
+        return await aioredis.create_redis(**settings)
 
-    def get_cache_client(self, *, alone=False):
+    def stats(self):
+        """连接池运行指标：连接数量、获取连接等待时间、各命令耗时分布和错误计数
+        """
 
-        client = None
+        if self._metrics is None or self._pool is None:
+            return None
 
-        if alone:
+        return self._metrics.snapshot(self._pool)
 
-            client = self._redis_pool.get_client()
+    async def _load_scripts(self):
 
-        else:
+        async with self.get_client() as cache:
+            for source in self._script_registry.scripts.values():
+                await cache.script_load(source)
 
-            client = self._cache_client_context.get()
+    def register_script(self, name, source):
 
-            if client is None:
+        return self._script_registry.register(name, source)
 
-                client = self._redis_pool.get_client()
+    def add_replica(self, pool):
 
-                if client:
-                    self._cache_client_context.set(client)
+        if self._replica_selector is None:
+            self._replica_selector = ReplicaSelector()
 
-        return client
+        self._replica_selector.add(pool)
 
-    def share_cache(self, cache, ckey):
+    def get_client(self, *, read_primary=False):
 
-        return ShareCache(cache, ckey)
+        client = None
 
-    def event_dispatcher(self, channel_name, channel_count):
+        if self._pool is not None:
+            client = CacheClient(
+                self._pool, self._expire, self._key_prefix,
+                pipeline_buffer=self._pipeline_buffer, near_cache=self._near_cache,
+                value_codec=self._value_codec, lock_notifier=self._lock_notifier,
+                script_registry=self._script_registry, metrics=self._metrics,
+                replica_selector=None if read_primary else self._replica_selector
+            )
 
-        return DistributedEvent(self._redis_pool, channel_name, channel_count)
+        return client
 
 
-class CacheClient(aioredis.Redis, AsyncContextManager):
-    """Redis客户端对象，使用with进行上下文管理
+class RedisPoolMetrics:
+    """Redis连接池指标
 
-    将连接委托给客户端对象管理，提高了整体连接的使用率
+    记录获取连接的等待时间、各命令的耗时分布和错误计数
 
     """
 
-    def __init__(self, pool, expire, key_prefix):
+    def __init__(self):
 
-        super().__init__(None)
+        self.acquire_wait = Histogram()
+        self.command_latency = {}
+        self.errors = Counter()
 
-        self._pool = pool
+        # 供RedisPoolController按周期统计的窗口数据
+        self.acquire_wait_window = Histogram()
 
-        self._expire = expire
+        self.overloaded = False
 
-        self._key_prefix = key_prefix
+    def record_acquire(self, seconds):
 
-    async def _init_conn(self):
+        self.acquire_wait.observe(seconds)
+        self.acquire_wait_window.observe(seconds)
 
-        global REDIS_POOL_WATER_LEVEL_WARNING_LINE
+    def record_command(self, command, seconds):
 
-        if self._pool_or_conn is None and self._pool:
+        histogram = self.command_latency.get(command)
 
-            if (self._pool.maxsize - self._pool.size + self._pool.freesize) < REDIS_POOL_WATER_LEVEL_WARNING_LINE:
-                Utils.log.warning(
-                    f'Redis connection pool not enough: '
-                    f'{self._pool.freesize}({self._pool.size}/{self._pool.maxsize})'
-                )
-            else:
-                Utils.log.debug(
-                    f'Redis connection pool info: '
-                    f'{self._pool.freesize}({self._pool.size}/{self._pool.maxsize})'
-                )
+        if histogram is None:
+            histogram = self.command_latency[command] = Histogram()
 
-            self._pool_or_conn = await self._pool.acquire()
+        histogram.observe(seconds)
 
-    async def _close_conn(self, discard=False):
+    def record_error(self, err):
 
-        if self._pool and self._pool_or_conn:
+        self.errors[type(err).__name__] += 1
 
-            connection, self._pool_or_conn = self._pool_or_conn, None
+    def reset(self):
 
-            if discard:
-                connection.close()
-                await connection.wait_closed()
+        self.acquire_wait.reset()
+        self.acquire_wait_window.reset()
 
-            self._pool.release(connection)
+        self.command_latency.clear()
+        self.errors.clear()
 
-    async def _context_release(self):
+    def snapshot(self, pool):
 
-        await self._close_conn()
+        return {
+            r'minsize': pool.minsize,
+            r'maxsize': pool.maxsize,
+            r'size': pool.size,
+            r'freesize': pool.freesize,
+            r'in_use': pool.size - pool.freesize,
+            r'overloaded': self.overloaded,
+            r'acquire_wait': self.acquire_wait.snapshot(),
+            r'commands': {
+                Utils.basestring(command): histogram.snapshot()
+                for command, histogram in self.command_latency.items()
+            },
+            r'errors': dict(self.errors),
+        }
 
-    async def release(self):
 
-        await self._close_conn()
+class AdaptivePool(AbcPool):
+    """上限可调整的连接池
 
-    async def _safe_execute(self, func, *args, **kwargs):
+    包装按最大上限创建的aioredis连接池，当前上限(maxsize)由信号量控制，调整上限时不需要修改aioredis的内部结构
 
-        global REDIS_ERROR_RETRY_COUNT
+    实现AbcPool接口，可以直接用于aioredis的Pipeline和MultiExec；execute等不占用连接的方法直接委托给底层连接池
 
-        result = None
+    """
 
-        async for times in AsyncCirculator(max_times=REDIS_ERROR_RETRY_COUNT):
+    def __init__(self, pool, maxsize):
 
-            try:
+        self._pool = pool
+        self._maxsize = maxsize
 
-                await self._init_conn()
+        self._semaphore = asyncio.Semaphore(maxsize)
 
-                result = await func(*args, **kwargs)
+    @property
+    def minsize(self):
 
-            except (ReplyError, MaxClientsError, AuthError, ReadOnlyError) as err:
+        return self._pool.minsize
 
-                await self._close_conn(True)
+    @property
+    def maxsize(self):
 
-                raise err
+        return self._maxsize
 
-            except Exception as err:
+    @property
+    def size(self):
 
-                await self._close_conn(True)
+        return self._pool.size
 
-                if times < REDIS_ERROR_RETRY_COUNT:
-                    Utils.log.exception(err)
-                else:
-                    raise err
+    @property
+    def freesize(self):
 
-            else:
+        return self._pool.freesize
 
-                break
+    @property
+    def closed(self):
 
-        return result
+        return self._pool.closed
 
-    async def execute(self, command, *args, **kwargs):
+    @property
+    def address(self):
 
-        return await self._safe_execute(super().execute, command, *args, **kwargs)
+        return self._pool.address
 
-    @staticmethod
-    def _list_basestring(_list):
+    @property
+    def db(self):
 
-        return [Utils.basestring(i) for i in _list]
+        return self._pool.db
 
-    @staticmethod
-    def _val_encode(val):
+    @property
+    def encoding(self):
 
-        return Utils.pickle_dumps(val)
+        return self._pool.encoding
 
-    @staticmethod
-    def _val_decode(val):
+    @property
+    def in_pubsub(self):
 
-        return Utils.pickle_loads(val)
+        return self._pool.in_pubsub
 
-    def _list_decode(self, _list):
+    @property
+    def pubsub_channels(self):
 
-        return map(
-            lambda i: self._val_decode(i) if i else i,
-            _list
-        )
+        return self._pool.pubsub_channels
 
-    def key(self, key, *args, **kwargs):
+    @property
+    def pubsub_patterns(self):
 
-        if self._key_prefix:
-            key = f'{self._key_prefix}_{key}'
+        return self._pool.pubsub_patterns
 
-        if not args and not kwargs:
-            return key
+    def execute(self, command, *args, **kwargs):
 
-        sign = Utils.params_sign(*args, **kwargs)
+        return self._pool.execute(command, *args, **kwargs)
 
-        return f'{key}_{sign}'
+    def execute_pubsub(self, command, *channels):
 
-    def allocate_lock(self, key, expire=60):
+        return self._pool.execute_pubsub(command, *channels)
 
-        return MLock(self, key, expire)
+    def get_connection(self, command, args=()):
 
-    # TRANSACTION COMMANDS
+        return self._pool.get_connection(command, args)
 
-    async def unwatch(self):
+    def resize(self, maxsize):
+        """扩大当前上限，不能超过底层连接池的上限
+        """
 
-        return await self._safe_execute(super().unwatch)
+        maxsize = min(maxsize, self._pool.maxsize)
 
-    async def watch(self, key, *keys):
+        for _ in range(maxsize - self._maxsize):
+            self._semaphore.release()
 
-        return await self._safe_execute(super().watch, key, *keys)
+        self._maxsize = max(maxsize, self._maxsize)
 
-    def multi_exec(self):
+    async def acquire(self, command=None, args=()):
 
-        return MultiExec(self._pool, aioredis.Redis)
+        await self._semaphore.acquire()
 
-    def pipeline(self):
+        try:
+            return await self._pool.acquire(command, args)
+        except BaseException as err:
+            self._semaphore.release()
+            raise err
 
-        return Pipeline(self._pool, aioredis.Redis)
+    def release(self, conn):
 
-    # PUB/SUB COMMANDS
+        try:
+            self._pool.release(conn)
+        finally:
+            self._semaphore.release()
 
-    async def subscribe(self, channel, *channels):
+    @asynccontextmanager
+    async def get(self):
 
-        return await self._safe_execute(super().subscribe, channel, *channels)
+        conn = await self.acquire()
 
-    async def unsubscribe(self, channel, *channels):
+        try:
+            yield conn
+        finally:
+            self.release(conn)
 
-        return await self._safe_execute(super().unsubscribe, channel, *channels)
+    def close(self):
 
-    async def psubscribe(self, pattern, *patterns):
+        self._pool.close()
 
-        return await self._safe_execute(super().psubscribe, pattern, *patterns)
+    async def wait_closed(self):
 
-    async def punsubscribe(self, pattern, *patterns):
+        await self._pool.wait_closed()
 
-        return await self._safe_execute(super().punsubscribe, pattern, *patterns)
 
-    @property
-    def channels(self):
+class RedisPoolController:
+    """连接池自适应控制器
 
-        if self._pool_or_conn is None:
-            return None
+    周期性地检查获取连接等待时间：P95超过扩容线时扩大maxsize，直至上限；达到上限后仍超过过载线时，
+    在连接耗尽的情况下快速失败(RedisPoolOverload)，避免请求在连接池上无限排队
 
-        return self._pool_or_conn.pubsub_channels
+    """
 
-    @property
-    def patterns(self):
+    def __init__(self, pool, metrics, max_limit, interval=5, step=4):
 
-        if self._pool_or_conn is None:
-            return None
+        self._pool = pool
+        self._metrics = metrics
 
-        return self._pool_or_conn.pubsub_patterns
+        self._max_limit = max_limit
+        self._step = step
 
-    @property
-    def in_pubsub(self):
+        self._task = Utils.create_task(self._run(interval))
 
-        if self._pool_or_conn is None:
-            return None
+    def stop(self):
 
-        return self._pool_or_conn.in_pubsub
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
 
-    # GENERIC COMMANDS
+        self._metrics.overloaded = False
 
-    async def delete(self, *keys):
+    async def _run(self, interval):
 
-        _keys = []
+        async for _ in AsyncCirculatorForSecond(interval=interval):
 
-        for key in keys:
+            try:
+                await self._adjust()
+            except Exception as err:
+                Utils.log.exception(err)
 
-            if key.find(r'*') < 0:
-                _keys.append(key)
-            else:
-                _keys.extend((await self.keys(key)))
+    async def _adjust(self):
 
-        result = (await super().delete(*_keys)) if len(_keys) > 0 else 0
+        global REDIS_POOL_ACQUIRE_WAIT_GROW_LINE, REDIS_POOL_ACQUIRE_WAIT_SHED_LINE
 
-        return result
+        window = self._metrics.acquire_wait_window
 
-    def _delete(self, key, *keys):
+        wait_time = window.percentile(95)
 
-        return super().delete(key, *keys)
+        window.reset()
 
-    async def keys(self, pattern):
+        maxsize = self._pool.maxsize
 
-        result = await super().keys(pattern)
+        if wait_time > REDIS_POOL_ACQUIRE_WAIT_GROW_LINE and maxsize < self._max_limit:
 
-        if result is not None:
-            result = [Utils.basestring(key) for key in result]
+            self._resize(min(maxsize + self._step, self._max_limit))
 
-        return result
+            self._metrics.overloaded = False
 
-    def _keys(self, pattern, *, encoding=_NOTSET):
+        else:
 
-        return super().keys(pattern, encoding=encoding)
+            self._metrics.overloaded = wait_time > REDIS_POOL_ACQUIRE_WAIT_SHED_LINE
 
-    async def randomkey(self):
+    def _resize(self, maxsize):
 
-        result = await super().randomkey()
+        self._pool.resize(maxsize)
 
-        if result is not None:
-            result = Utils.basestring(result)
+        Utils.log.info(f'Redis connection pool resized: {self._pool.size}/{self._pool.maxsize}')
 
-        return result
 
-    def _randomkey(self, *, encoding=_NOTSET):
+class ReplicaSelector:
+    """从库选择器
 
-        return super().randomkey(encoding=encoding)
+    按最少未完成请求(least outstanding requests)选择从库
 
-    async def scan(self, cursor=0, match=None, count=None):
+    """
 
-        result = await super().scan(cursor, match, count)
+    def __init__(self):
 
-        if result is not None:
-            result = (result[0], self._list_basestring(result[1]))
+        self._pools = []
+        self._outstanding = []
 
-        return result
+    @property
+    def pools(self):
 
-    def _scan(self, cursor=0, match=None, count=None):
+        return self._pools
 
-        return super().scan(cursor, match, count)
+    def add(self, pool):
 
-    # STRING COMMANDS
+        self._pools.append(pool)
+        self._outstanding.append(0)
 
-    async def get(self, key):
+    def acquire(self):
 
-        result = await super().get(key)
+        index = self._outstanding.index(min(self._outstanding))
 
-        if result is not None:
-            result = self._val_decode(result)
+        self._outstanding[index] += 1
 
-        return result
+        return index
 
-    def _get(self, key, *, encoding=_NOTSET):
+    def release(self, index):
 
-        return super().get(key, encoding=encoding)
+        self._outstanding[index] -= 1
 
-    async def getset(self, key, value):
 
-        _value = self._val_encode(value)
+class _PubSubReceiver(Receiver):
+    """全部频道取消订阅后不自动停止的Receiver，频繁订阅和取消订阅时保持专用连接，仅在连接异常关闭时停止
+    """
 
-        result = await super().getset(key, _value)
+    def check_stop(self, channel, exc=None):
 
-        if result is not None:
-            result = self._val_decode(result)
+        if exc is not None:
+            self.stop()
 
-        return result
 
-    def _getset(self, key, value, *, encoding=_NOTSET):
+class PubSubMultiplexer:
+    """订阅连接复用器
 
-        return super().getset(key, value, encoding=encoding)
+    使用一条独立于连接池的专用连接复用所有频道和模式的订阅，断线后自动重连并恢复订阅
 
-    async def mget(self, key, *keys):
+    断线期间发布的消息会丢失，依赖消息保证一致性的组件可以通过add_connection_callback在连接断开和恢复时收到通知
 
-        result = await super().mget(key, *keys)
+    """
 
-        if result is not None:
-            result = list(self._list_decode(result))
+    def __init__(self, redis_pool):
 
-        return result
+        self._redis_pool = redis_pool
 
-    def _mget(self, key, *keys, encoding=_NOTSET):
+        self._channels = {}
+        self._patterns = {}
 
-        return super().mget(key, *keys, encoding=encoding)
+        self._connection_callbacks = []
+        self._connected = False
 
-    async def set(self, key, value, expire=0):
+        self._conn = None
+        self._receiver = None
 
-        _value = self._val_encode(value)
-        _expire = expire if expire > 0 else self._expire
+        self._task = None
+        self._closed = False
 
-        result = await super().set(key, _value, expire=_expire)
+    @property
+    def channels(self):
 
-        return result
+        return list(self._channels.keys())
 
-    def _set(self, key, value, *, expire=0, pexpire=0, exist=None):
+    @property
+    def patterns(self):
 
-        return super().set(key, value, expire=expire, pexpire=pexpire, exist=exist)
+        return list(self._patterns.keys())
 
-    async def mset(self, key, value, *pairs):
+    @property
+    def connected(self):
 
-        _value = self._val_encode(value)
-        _pairs = [item if index % 2 == 0 else self._val_encode(item) for index, item in enumerate(pairs)]
+        return self._connected
 
-        result = await super().mset(key, _value, *_pairs)
+    def add_connection_callback(self, callback):
+        """订阅连接建立(恢复)和断开时调用callback(connected)
+        """
 
-        return result
+        self._connection_callbacks.append(callback)
 
-    def _mset(self, key, value, *pairs):
+    def remove_connection_callback(self, callback):
 
-        return super().mset(key, value, *pairs)
+        if callback in self._connection_callbacks:
+            self._connection_callbacks.remove(callback)
 
-    async def msetnx(self, key, value, *pairs):
+    async def _notify_connection(self, connected):
 
-        _value = self._val_encode(value)
-        _pairs = [item if index % 2 == 0 else self._val_encode(item) for index, item in enumerate(pairs)]
+        for callback in list(self._connection_callbacks):
 
-        result = await super().msetnx(key, _value, *_pairs)
+            try:
 
-        return result
+                await Utils.awaitable_wrapper(callback(connected))
 
-    def _msetnx(self, key, value, *pairs):
+            except Exception as err:
 
-        return super().msetnx(key, value, *pairs)
+                Utils.log.error(f'pubsub connection callback error: {err}')
 
-    async def psetex(self, key, milliseconds, value):
+    def _start(self):
 
-        _value = self._val_encode(value)
+        if self._task is None and not self._closed:
+            self._task = Utils.create_task(self._subscribe_loop())
 
-        result = await super().psetex(key, milliseconds, _value)
+    def subscribe(self, channel, callback):
 
-        return result
+        callbacks = self._channels.setdefault(Utils.utf8(channel), [])
+        callbacks.append(callback)
 
-    def _psetex(self, key, milliseconds, value):
+        if len(callbacks) == 1 and self._conn is not None:
+            Utils.create_task(self._send(r'subscribe', self._receiver.channel(channel)))
 
-        return super().psetex(key, milliseconds, value)
+        self._start()
 
-    async def setex(self, key, seconds, value):
+    def psubscribe(self, pattern, callback):
 
-        _value = self._val_encode(value)
+        callbacks = self._patterns.setdefault(Utils.utf8(pattern), [])
+        callbacks.append(callback)
 
-        result = await super().setex(key, seconds, _value)
+        if len(callbacks) == 1 and self._conn is not None:
+            Utils.create_task(self._send(r'psubscribe', self._receiver.pattern(pattern)))
 
-        return result
+        self._start()
 
-    def _setex(self, key, seconds, value):
+    def unsubscribe(self, channel, callback):
 
-        return super().setex(key, seconds, value)
+        channel = Utils.utf8(channel)
+        callbacks = self._channels.get(channel)
 
-    async def setnx(self, key, value):
+        if callbacks and callback in callbacks:
 
-        _value = self._val_encode(value)
+            callbacks.remove(callback)
 
-        result = await super().setnx(key, _value)
+            if not callbacks:
 
-        return result
+                del self._channels[channel]
 
-    def _setnx(self, key, value):
+                if self._conn is not None:
+                    Utils.create_task(self._send(r'unsubscribe', channel))
 
-        return super().setnx(key, value)
+    def punsubscribe(self, pattern, callback):
 
-    # SET COMMANDS
+        pattern = Utils.utf8(pattern)
+        callbacks = self._patterns.get(pattern)
 
-    async def sdiff(self, key, *keys):
+        if callbacks and callback in callbacks:
 
-        result = await super().sdiff(key, *keys)
+            callbacks.remove(callback)
 
-        if result is not None:
-            result = self._list_basestring(result)
+            if not callbacks:
 
-        return result
+                del self._patterns[pattern]
 
-    def _sdiff(self, key, *keys):
+                if self._conn is not None:
+                    Utils.create_task(self._send(r'punsubscribe', pattern))
 
-        return super().sdiff(key, *keys)
+    async def _send(self, command, channel):
+        """在专用连接上发送订阅类命令，连接异常时由重连流程按当前订阅状态恢复
+        """
 
-    async def sinter(self, key, *keys):
+        conn = self._conn
 
-        result = await super().sinter(key, *keys)
+        if conn is None:
+            return
 
-        if result is not None:
-            result = self._list_basestring(result)
+        try:
 
-        return result
+            await getattr(conn, command)(channel)
 
-    def _sinter(self, key, *keys):
+        except (aioredis.RedisError, OSError) as err:
 
-        return super().sinter(key, *keys)
+            Utils.log.warning(f'pubsub {command} error: {err}')
 
-    async def smembers(self, key):
+        except KeyError as _:
 
-        result = await super().smembers(key)
+            # 订阅回复到达前已被取消订阅
+            pass
 
-        if result is not None:
-            result = self._list_basestring(result)
+    async def _subscribe_loop(self):
 
-        return result
+        async for _ in AsyncCirculatorForSecond():
 
-    def _smembers(self, key, *, encoding=_NOTSET):
+            if self._closed or not (self._channels or self._patterns):
+                break
 
-        return super().smembers(key, encoding=encoding)
+            subscribed = False
 
-    async def spop(self, key):
+            try:
 
-        result = await super().spop(key)
+                self._receiver = _PubSubReceiver()
+                self._conn = await self._redis_pool.create_connection()
 
-        if result is not None:
-            result = Utils.basestring(result)
+                if self._channels:
+                    await self._conn.subscribe(*(self._receiver.channel(name) for name in self._channels))
 
-        return result
+                if self._patterns:
+                    await self._conn.psubscribe(*(self._receiver.pattern(name) for name in self._patterns))
 
-    def _spop(self, key, *, encoding=_NOTSET):
+                Utils.log.info(
+                    f'pubsub connection created: {len(self._channels)} channels, {len(self._patterns)} patterns'
+                )
 
-        return super().spop(key, encoding=encoding)
+                subscribed = self._connected = True
 
-    async def srandmember(self, key, count=1):
+                await self._notify_connection(True)
 
-        result = await super().srandmember(key, count)
+                async for channel, message in self._receiver.iter():
+                    await self._dispatch(channel, message)
 
-        if result is not None:
-            result = self._list_basestring(result)
+            except (aioredis.RedisError, OSError) as err:
 
-        return result
+                Utils.log.error(f'pubsub connection error: {err}')
 
-    def _srandmember(self, key, count=None):
+            finally:
 
-        return super().srandmember(key, count)
+                if self._conn is not None:
+                    self._conn.close()
+                    await self._conn.wait_closed()
+                    self._conn = None
 
-    async def sunion(self, key, *keys):
+                if subscribed:
+                    self._connected = False
+                    await self._notify_connection(False)
 
-        result = await super().sunion(key, *keys)
+        self._task = None
 
-        if result is not None:
-            result = self._list_basestring(result)
+    async def _dispatch(self, channel, message):
 
-        return result
+        if channel.is_pattern:
+            callbacks = self._patterns.get(channel.name)
+            _, message = message
+        else:
+            callbacks = self._channels.get(channel.name)
 
-    def _sunion(self, key, *keys):
+        if not callbacks:
+            return
 
-        return super().sunion(key, *keys)
+        for callback in list(callbacks):
 
-    async def sscan(self, key, cursor=0, match=None, count=None):
+            try:
 
-        result = await super().sscan(key, cursor, match, count)
+                await Utils.awaitable_wrapper(callback(message))
 
-        if result is not None:
-            result = (result[0], self._list_basestring(result[1]))
+            except Exception as err:
 
-        return result
+                Utils.log.error(f'pubsub callback error: {err}')
 
-    def _sscan(self, key, cursor=0, match=None, count=None):
+    async def close(self):
 
-        return super().sscan(key, cursor, match, count)
+        self._closed = True
 
-    # HASH COMMANDS
+        if self._receiver is not None:
+            self._receiver.stop()
 
-    async def hget(self, key, field):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
 
-        result = await super().hget(key, field)
+        if self._conn is not None:
+            self._conn.close()
+            await self._conn.wait_closed()
+            self._conn = None
 
-        if result is not None:
-            result = self._val_decode(result)
 
-        return result
+class ScriptRegistry:
+    """Lua脚本注册表
 
-    def _hget(self, key, field, *, encoding=_NOTSET):
+    缓存脚本的SHA1摘要，通过EVALSHA执行，服务端脚本缓存丢失(如故障切换后)时自动重新加载
 
-        return super().hget(key, field, encoding=encoding)
+    """
 
-    async def hgetall(self, key):
+    def __init__(self):
 
-        result = await super().hgetall(key)
+        self._scripts = {}
+        self._digests = {}
 
-        if result is not None:
-            result = {Utils.basestring(key): self._val_decode(val) for key, val in result.items()}
+    @property
+    def scripts(self):
 
-        return result
+        return self._scripts
 
-    def _hgetall(self, key, *, encoding=_NOTSET):
+    def register(self, name, source):
 
-        return super().hgetall(key, encoding=encoding)
+        self._scripts[name] = source
 
-    async def hkeys(self, key):
+        return self.digest(source)
 
-        result = await super().hkeys(key)
+    def get_source(self, script):
 
-        if result is not None:
-            result = [Utils.basestring(key) for key in result]
+        return self._scripts.get(script, script)
 
-        return result
+    def digest(self, source):
 
-    def _hkeys(self, key, *, encoding=_NOTSET):
+        digest = self._digests.get(source)
 
-        return super().hkeys(key, encoding=encoding)
+        if digest is None:
+            digest = self._digests[source] = Utils.sha1(source)
 
-    async def hmget(self, key, field, *fields):
+        return digest
 
-        result = await super().hmget(key, field, *fields)
 
-        if result is not None:
-            result = list(self._list_decode(result))
+class AutoPipelineBuffer:
+    """Redis自动管道
 
-        return result
+    收集同一事件循环帧内发出的命令，合并成一次管道写入，每个调用方的Future单独返回结果
 
-    def _hmget(self, key, field, *fields, encoding=_NOTSET):
+    """
 
-        return super().hmget(key, field, *fields, encoding=encoding)
+    def __init__(self, pool, metrics=None):
 
-    async def hmset(self, key, field, value, *pairs):
+        self._pool = pool
+        self._metrics = metrics
 
-        _value = self._val_encode(value)
-        _pairs = [item if index % 2 == 0 else self._val_encode(item) for index, item in enumerate(pairs)]
+        self._commands = []
+        self._flush_handle = None
+        self._flush_tasks = set()
 
-        result = await super().hmset(key, field, _value, *_pairs)
+    def execute(self, command, *args, **kwargs):
 
-        return result
+        future = asyncio.get_event_loop().create_future()
 
-    def _hmset(self, key, field, value, *pairs):
+        self._commands.append((future, command, args, kwargs))
 
-        return super().hmset(key, field, value, *pairs)
+        if self._flush_handle is None:
+            self._flush_handle = Utils.call_soon(self._schedule_flush)
 
-    async def hmset_dict(self, key, *args, **kwargs):
+        return future
 
-        for _arg in args:
-            if isinstance(_arg, dict):
-                kwargs.update({key: self._val_encode(val) for key, val in _arg.items()})
+    def _schedule_flush(self):
 
-        return await super().hmset_dict(key, kwargs)
+        self._flush_handle = None
 
-    def _hmset_dict(self, key, *args, **kwargs):
+        commands, self._commands = self._commands, []
 
-        return super().hmset_dict(key, *args, **kwargs)
+        if commands:
+            task = Utils.create_task(self._send_commands(commands))
+            task.add_done_callback(self._flush_tasks.discard)
+            self._flush_tasks.add(task)
 
-    async def hset(self, key, field, value):
+    async def flush(self):
 
-        _value = self._val_encode(value)
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._schedule_flush()
 
-        result = await super().hset(key, field, _value)
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
 
-        return result
+    async def _send_commands(self, commands):
 
-    def _hset(self, key, field, value):
+        waiters = []
 
-        return super().hset(key, field, value)
+        try:
 
-    async def hsetnx(self, key, field, value):
+            acquire_time = Utils.loop_time()
 
-        _value = self._val_encode(value)
+            async with self._pool.get() as conn:
 
-        result = await super().hsetnx(key, field, _value)
+                if self._metrics is not None:
+                    self._metrics.record_acquire(Utils.loop_time() - acquire_time)
 
-        return result
+                with conn._buffered():
 
-    def _hsetnx(self, key, field, value):
+                    for future, command, args, kwargs in commands:
 
-        return super().hsetnx(key, field, value)
+                        if future.done():
+                            continue
 
-    async def hvals(self, key):
+                        try:
+                            waiter = conn.execute(command, *args, **kwargs)
+                        except Exception as err:
+                            future.set_exception(err)
+                        else:
+                            waiter.add_done_callback(Utils.func_partial(self._set_result, future))
+                            waiters.append(waiter)
 
-        result = await super().hvals(key)
+                if waiters:
+                    await asyncio.gather(*waiters, return_exceptions=True)
 
-        if result is not None:
-            result = list(self._list_decode(result))
+        except Exception as err:
 
-        return result
+            for future, _, _, _ in commands:
+                if not future.done():
+                    future.set_exception(err)
 
-    def _hvals(self, key, *, encoding=_NOTSET):
+    @staticmethod
+    def _set_result(future, waiter):
 
-        return super().hvals(key, encoding=encoding)
+        if future.done():
+            return
 
-    async def hscan(self, key, cursor=0, match=None, count=None):
+        if waiter.cancelled():
+            future.cancel()
+        elif waiter.exception() is not None:
+            future.set_exception(waiter.exception())
+        else:
+            future.set_result(waiter.result())
 
-        result = await super().hscan(key, cursor, match, count)
 
-        if result is not None:
-            result = (result[0], [(Utils.basestring(key), self._val_decode(val),) for key, val in result[1]])
+class ShardedRedisPool:
+    """分片Redis连接管理
 
-        return result
+    每个地址对应一个RedisPool，键按一致性哈希路由到节点，路由时忽略key_prefix并支持{hash tag}
 
-    def _hscan(self, key, cursor=0, match=None, count=None):
+    """
 
-        return super().hscan(key, cursor, match, count)
+    def __init__(self, addresses, password=None, *, key_prefix=None, vnodes=0xa0, **settings):
 
-    # LIST COMMANDS
+        self._key_prefix = key_prefix
 
-    async def blpop(self, key, *, timeout=0):
+        self._nodes = {
+            str(address): RedisPool(address, password, key_prefix=key_prefix, **settings)
+            for address in addresses
+        }
 
-        result = await super().blpop(key, timeout=timeout)
+        self._ring = ConsistentHash(self._nodes.keys(), vnodes)
 
-        if result is not None:
-            result = self._val_decode(result[1])
+    def __await__(self):
 
-        return result
+        yield from asyncio.gather(*(Utils.awaitable_wrapper(pool) for pool in self._nodes.values())).__await__()
 
-    def _blpop(self, key, *keys, timeout=0, encoding=_NOTSET):
+        return self
 
-        return super().blpop(key, *keys, timeout=timeout, encoding=encoding)
+    @property
+    def nodes(self):
 
-    async def brpop(self, key, *, timeout=0):
+        return list(self._nodes.values())
 
-        result = await super().brpop(key, timeout=timeout)
+    @property
+    def key_prefix(self):
 
-        if result is not None:
-            result = self._val_decode(result[1])
+        return self._key_prefix
 
-        return result
+    @property
+    def value_codec(self):
 
-    def _brpop(self, key, *keys, timeout=0, encoding=_NOTSET):
+        return self.nodes[0].value_codec
 
-        return super().brpop(key, *keys, timeout=timeout, encoding=encoding)
+    async def close(self):
 
-    async def brpoplpush(self, sourcekey, destkey, timeout=0):
+        await asyncio.gather(*(pool.close() for pool in self._nodes.values()))
 
-        result = await super().brpoplpush(sourcekey, destkey, timeout)
+    def register_script(self, name, source):
 
-        if result is not None:
-            result = self._val_decode(result)
+        for pool in self._nodes.values():
+            pool.register_script(name, source)
 
-        return result
+    def stats(self):
 
-    def _brpoplpush(self, sourcekey, destkey, timeout=0, encoding=_NOTSET):
+        return {address: pool.stats() for address, pool in self._nodes.items()}
 
-        return super().brpoplpush(sourcekey, destkey, timeout, encoding)
+    def route_key(self, key):
 
-    async def lindex(self, key, index):
+        key = Utils.basestring(key)
 
-        result = await super().lindex(key, index)
+        if self._key_prefix and key.startswith(f'{self._key_prefix}_'):
+            key = key[len(self._key_prefix) + 1:]
 
-        if result is not None:
-            result = self._val_decode(result)
+        start = key.find(r'{')
 
-        return result
+        if start >= 0:
 
-    def _lindex(self, key, index, *, encoding=_NOTSET):
+            end = key.find(r'}', start + 1)
 
-        return super().lindex(key, index, encoding=encoding)
+            if end > start + 1:
+                key = key[start + 1:end]
 
-    async def linsert(self, key, pivot, value, before=False):
+        return key
 
-        _pivot = self._val_encode(pivot)
-        _value = self._val_encode(value)
+    def get_node(self, key):
 
-        result = await super().linsert(key, _pivot, _value, before=before)
+        return self._nodes[self._ring.get_node(self.route_key(key))]
 
-        return result
+    def get_pubsub(self, channel):
 
-    def _linsert(self, key, pivot, value, before=False):
+        return self.get_node(channel).pubsub
 
-        return super().linsert(key, pivot, value, before=before)
+    async def create_connection(self, key=None):
 
-    async def lpop(self, key):
+        pool = self.nodes[0] if key is None else self.get_node(key)
 
-        result = await super().lpop(key)
+        return await pool.create_connection()
 
-        if result is not None:
-            result = self._val_decode(result)
+    def get_client(self, *, read_primary=False):
 
-        return result
+        return ShardedCacheClient(self, read_primary)
 
-    def _lpop(self, key, *, encoding=_NOTSET):
 
-        return super().lpop(key, encoding=encoding)
+class RedisDelegate:
+    """Redis功能组件
+    """
 
-    async def lpush(self, key, value, *values):
+    def __init__(self):
 
-        _value = self._val_encode(value)
-        _values = [self._val_encode(val) for val in values]
+        self._redis_pool = None
 
-        result = await super().lpush(key, _value, *_values)
+        self._counters = []
 
-        return result
+        self._cache_client_context = WeakContextVar(f'cache_client_{Utils.uuid1()}')
 
-    def _lpush(self, key, value, *values):
+    @property
+    def redis_pool(self):
 
-        return super().lpush(key, value, *values)
+        return self._redis_pool
 
-    async def lpushx(self, key, value):
+    async def async_init_redis(self, *args, **kwargs):
 
-        _value = self._val_encode(value)
+        self._redis_pool = await RedisPool(*args, **kwargs)
 
-        result = await super().lpushx(key, _value)
+    async def async_init_redis_replica(self, *args, **kwargs):
 
-        return result
+        self._redis_pool.add_replica(await RedisPool(*args, **kwargs))
 
-    def _lpushx(self, key, value):
+    async def async_init_sharded_redis(self, *args, **kwargs):
 
-        return super().lpushx(key, value)
+        self._redis_pool = await ShardedRedisPool(*args, **kwargs)
 
-    async def lrange(self, key, start, stop):
+    def register_script(self, name, source):
 
-        result = await super().lrange(key, start, stop)
+        return self._redis_pool.register_script(name, source)
 
-        if result is not None:
-            result = list(self._list_decode(result))
+    async def async_close_redis(self):
 
-        return result
+        for counter in self._counters:
+            try:
+                await counter.close()
+            except Exception as err:
+                Utils.log.exception(err)
+
+        self._counters.clear()
+
+        if self._redis_pool is not None:
+            await self._redis_pool.close()
+            self._redis_pool = None
+
+    def cache_stats(self):
+
+        return self._redis_pool.stats()
+
+    async def cache_health(self):
+
+        result = False
+
+        async with self.get_cache_client() as cache:
+            result = bool(await cache.time())
+
+        return result
+
+    @staticmethod
+    def read_from_primary():
+
+        return read_from_primary()
+
+    def get_cache_client(self, *, alone=False, primary=False):
+
+        client = None
+
+        if alone or primary:
+
+            client = self._redis_pool.get_client(read_primary=primary)
+
+        else:
+
+            client = self._cache_client_context.get()
+
+            if client is None:
+
+                client = self._redis_pool.get_client()
+
+                if client:
+                    self._cache_client_context.set(client)
+
+        return client
+
+    def share_cache(self, cache, ckey, soft_ttl=0, beta=1.0):
+
+        return ShareCache(cache, ckey, soft_ttl, beta)
+
+    def local_counter(self, *, flush_size=0x400, flush_interval=1, expire=0):
+
+        counter = LocalCounter(self._redis_pool, flush_size=flush_size, flush_interval=flush_interval, expire=expire)
+
+        self._counters.append(counter)
+
+        return counter
+
+    def event_dispatcher(self, channel_name, channel_count):
+
+        return DistributedEvent(self._redis_pool, channel_name, channel_count)
+
+    def stream_dispatcher(self, stream_name, group_name, stream_count=1, **kwargs):
+
+        return StreamEvent(self._redis_pool, stream_name, group_name, stream_count, **kwargs)
+
+
+class NearCache:
+    """近端缓存
+
+    在进程内存中保存解码后的热点数据，写操作通过Redis频道广播失效消息，保证所有进程和节点的一致性
+
+    读取时同时获取键的剩余有效期，本地数据的有效期不超过Redis中数据的有效期
+
+    copy为返回数据的复制策略(参见ShareFuture)：deepcopy为每次返回深拷贝(默认)，frozen保存只读视图并直接返回，
+    share直接返回缓存对象，调用方修改返回值会影响其他调用方
+
+    """
+
+    _EVENT_TYPE = r'near_cache_invalidate'
+
+    _get_script = '''
+local val = redis.call("get",KEYS[1])
+if val then
+    return {val,redis.call("pttl",KEYS[1])}
+else
+    return false
+end
+'''
+
+    _hget_script = '''
+local val = redis.call("hget",KEYS[1],ARGV[1])
+if val then
+    return {val,redis.call("pttl",KEYS[1])}
+else
+    return false
+end
+'''
+
+    def __init__(self, redis_pool, maxsize=0xffff, ttl=60, copy=ShareFuture.COPY_DEEPCOPY):
+
+        if copy not in (ShareFuture.COPY_SHARE, ShareFuture.COPY_DEEPCOPY, ShareFuture.COPY_FROZEN):
+            raise ValueError(f'Unknown copy policy: {copy}')
+
+        # 缓存项为(过期时间, 数据)，过期时间为0表示只受本地ttl限制
+        self._values = StackCache(maxsize, ttl)
+        self._fields = StackCache(maxsize, ttl)
+
+        self._copy = copy
+
+        # 失效版本号，读取期间发生过失效的结果不会写入本地缓存
+        self._version = 0
+
+        self._event = DistributedEvent(redis_pool, r'near_cache', 1)
+        self._event.add_listener(self._EVENT_TYPE, self._event_handler)
+
+        # 失效消息的订阅连接断开期间会丢失消息，断开和恢复时都清空本地缓存，断开期间不写入本地缓存
+        self._available = self._event.connected
+        self._event.add_connection_callback(self._connection_handler)
+
+    @property
+    def version(self):
+
+        return self._version
+
+    def _store(self, value):
+        """返回(缓存保存的对象, 返回给调用方的对象)
+        """
+
+        if self._copy == ShareFuture.COPY_DEEPCOPY:
+            return Utils.deepcopy(value), value
+
+        if self._copy == ShareFuture.COPY_FROZEN:
+            value = ShareFuture.freeze(value)
+
+        return value, value
+
+    def _load(self, value):
+
+        if value is not _NOTSET and self._copy == ShareFuture.COPY_DEEPCOPY:
+            value = Utils.deepcopy(value)
+
+        return value
+
+    @staticmethod
+    def _expire_time(pttl):
+
+        return (Utils.loop_time() + pttl / 1000) if pttl > 0 else 0
+
+    @staticmethod
+    def _get_item(cache, key):
+
+        item = cache.get(key)
+
+        if item is None:
+            return None
+
+        if 0 < item[0] <= Utils.loop_time():
+            cache.delete(key)
+            return None
+
+        return item
+
+    def get_value(self, key):
+
+        item = self._get_item(self._values, key)
+
+        return _NOTSET if item is None else self._load(item[1])
+
+    def set_value(self, key, value, version, pttl=-1):
+        """写入本地缓存，pttl为Redis中数据的剩余有效期(毫秒)，返回应交给调用方的数据
+        """
+
+        if not self._available or version != self._version:
+            return value
+
+        cached, value = self._store(value)
+
+        self._values.set(key, (self._expire_time(pttl), cached))
+
+        return value
+
+    def get_field(self, key, field):
+
+        item = self._get_item(self._fields, key)
+
+        return _NOTSET if item is None else self._load(item[1].get(field, _NOTSET))
+
+    def set_field(self, key, field, value, version, pttl=-1):
+        """写入本地缓存，pttl为Redis中数据的剩余有效期(毫秒)，返回应交给调用方的数据
+        """
+
+        if not self._available or version != self._version:
+            return value
+
+        cached, value = self._store(value)
+
+        item = self._get_item(self._fields, key)
+
+        if item is None:
+            self._fields.set(key, (self._expire_time(pttl), {field: cached}))
+        else:
+            item[1][field] = cached
+
+        return value
+
+    def discard(self, *keys):
+
+        self._version += 1
+
+        for key in keys:
+
+            if self._values.has(key):
+                self._values.delete(key)
+
+            if self._fields.has(key):
+                self._fields.delete(key)
+
+    def clear(self):
+
+        self._version += 1
+
+        self._values.clear()
+        self._fields.clear()
+
+    async def invalidate(self, *keys):
+
+        keys = [Utils.basestring(key) for key in keys]
+
+        if keys:
+
+            self.discard(*keys)
+
+            try:
+                await self._event.dispatch(self._EVENT_TYPE, keys)
+            except Exception as err:
+                # 本地缓存已丢弃，其他节点只能依赖本地ttl过期
+                Utils.log.error(f'near cache invalidation publish error: {err}')
+
+    async def invalidate_all(self):
+
+        self.clear()
+
+        try:
+            await self._event.dispatch(self._EVENT_TYPE, None)
+        except Exception as err:
+            Utils.log.error(f'near cache invalidation publish error: {err}')
+
+    def _connection_handler(self, connected):
+
+        self._available = connected
+
+        self.clear()
+
+    def _event_handler(self, keys):
+
+        if keys is None:
+            self.clear()
+        else:
+            self.discard(*keys)
+
+
+class LockNotifier:
+    """分布式锁释放通知
+
+    每个锁使用独立的通知频道，进程内存在等待者时才订阅(复用连接池的专用订阅连接)，最后一个等待者离开后取消订阅，
+    锁释放时只通知该锁的订阅者，无需轮询Redis
+
+    """
+
+    def __init__(self, redis_pool):
+
+        self._redis_pool = redis_pool
+
+        self._waiters = {}
+        self._callbacks = {}
+
+    @staticmethod
+    def _gen_channel(lock_tag):
+
+        return f'mlock_notify_{lock_tag}'
+
+    def watch(self, lock_tag):
+
+        waiter = asyncio.get_event_loop().create_future()
+
+        waiters = self._waiters.setdefault(lock_tag, set())
+
+        if not waiters:
+
+            channel = self._gen_channel(lock_tag)
+            callback = self._callbacks[lock_tag] = Utils.func_partial(self._on_message, lock_tag)
+
+            self._redis_pool.get_pubsub(channel).subscribe(channel, callback)
+
+        waiters.add(waiter)
+
+        return waiter
+
+    def unwatch(self, lock_tag, waiter):
+
+        waiters = self._waiters.get(lock_tag)
+
+        if waiters is not None:
+
+            waiters.discard(waiter)
+
+            if not waiters:
+
+                del self._waiters[lock_tag]
+
+                channel = self._gen_channel(lock_tag)
+                callback = self._callbacks.pop(lock_tag)
+
+                self._redis_pool.get_pubsub(channel).unsubscribe(channel, callback)
+
+    @staticmethod
+    async def wait(waiter, timeout):
+
+        await asyncio.wait({waiter}, timeout=timeout)
+
+        return waiter.done()
+
+    async def notify(self, lock_tag):
+
+        self._wakeup(lock_tag)
+
+        channel = self._gen_channel(lock_tag)
+
+        async with self._redis_pool.get_client() as cache:
+            await cache.publish(channel, b'1')
+
+    def _on_message(self, lock_tag, message):
+
+        self._wakeup(lock_tag)
+
+    def _wakeup(self, lock_tag):
+
+        for waiter in self._waiters.get(lock_tag, ()):
+            if not waiter.done():
+                waiter.set_result(True)
+
+
+class CacheClient(aioredis.Redis, AsyncContextManager):
+    """Redis客户端对象，使用with进行上下文管理
+
+    将连接委托给客户端对象管理，提高了整体连接的使用率
+
+    配置了从库时，只读命令路由到从库；同一客户端执行过写命令后，直到释放前的读取都在主库执行，保证读己之写
+
+    """
+
+    def __init__(
+            self, pool, expire, key_prefix,
+            *, pipeline_buffer=None, near_cache=None, value_codec=None, lock_notifier=None, script_registry=None,
+            metrics=None, replica_selector=None
+    ):
+
+        super().__init__(None)
+
+        self._pool = pool
+
+        self._expire = expire
+
+        self._key_prefix = key_prefix
+
+        self._pipeline_buffer = pipeline_buffer
+
+        self._near_cache = near_cache
+
+        self._value_codec = ValueCodec() if value_codec is None else value_codec
+
+        self._lock_notifier = lock_notifier
+
+        self._script_registry = ScriptRegistry() if script_registry is None else script_registry
+
+        self._metrics = metrics
+
+        self._replica_selector = replica_selector
+        self._replica_clients = {}
+
+        # 执行过写命令后读取固定在主库，自动管道模式下写命令不占用专用连接，需要单独记录
+        self._wrote = False
+
+    @property
+    def lock_notifier(self):
+
+        return self._lock_notifier
+
+    @property
+    def value_codec(self):
+
+        return self._value_codec
+
+    @property
+    def default_expire(self):
+
+        return self._expire
+
+    async def _init_conn(self):
+
+        global REDIS_POOL_WATER_LEVEL_WARNING_LINE
+
+        if self._pool_or_conn is None and self._pool:
+
+            if (self._pool.maxsize - self._pool.size + self._pool.freesize) < REDIS_POOL_WATER_LEVEL_WARNING_LINE:
+                Utils.log.warning(
+                    f'Redis connection pool not enough: '
+                    f'{self._pool.freesize}({self._pool.size}/{self._pool.maxsize})'
+                )
+            else:
+                Utils.log.debug(
+                    f'Redis connection pool info: '
+                    f'{self._pool.freesize}({self._pool.size}/{self._pool.maxsize})'
+                )
+
+            metrics = self._metrics
+
+            if metrics is None:
+                self._pool_or_conn = await self._pool.acquire()
+                return
+
+            if metrics.overloaded and self._pool.freesize == 0 and self._pool.size >= self._pool.maxsize:
+                raise RedisPoolOverload(f'Redis connection pool overloaded: {self._pool.size}/{self._pool.maxsize}')
+
+            acquire_time = Utils.loop_time()
+
+            self._pool_or_conn = await self._pool.acquire()
+
+            metrics.record_acquire(Utils.loop_time() - acquire_time)
+
+    async def _close_conn(self, discard=False):
+
+        if self._pool and self._pool_or_conn:
+
+            connection, self._pool_or_conn = self._pool_or_conn, None
+
+            if discard:
+                connection.close()
+                await connection.wait_closed()
+
+            self._pool.release(connection)
+
+    async def _release_replicas(self):
+
+        for client in self._replica_clients.values():
+            await client.release()
+
+        self._replica_clients.clear()
+
+    async def _context_release(self):
+
+        await self._close_conn()
+        await self._release_replicas()
+
+        self._wrote = False
+
+    async def release(self):
+
+        await self._close_conn()
+        await self._release_replicas()
+
+        self._wrote = False
+
+    async def _safe_execute(self, func, *args, **kwargs):
+
+        global REDIS_ERROR_RETRY_COUNT
+
+        result = None
+
+        async for times in AsyncCirculator(max_times=REDIS_ERROR_RETRY_COUNT):
+
+            try:
+
+                await self._init_conn()
+
+                result = await func(*args, **kwargs)
+
+            except RedisPoolOverload as err:
+
+                self._record_error(err)
+
+                raise err
+
+            except (ReplyError, MaxClientsError, AuthError, ReadOnlyError) as err:
+
+                self._record_error(err)
+
+                await self._close_conn(True)
+
+                raise err
+
+            except Exception as err:
+
+                self._record_error(err)
+
+                await self._close_conn(True)
+
+                if times < REDIS_ERROR_RETRY_COUNT:
+                    Utils.log.exception(err)
+                else:
+                    raise err
+
+            else:
+
+                break
+
+        return result
+
+    async def _safe_pipeline_execute(self, command, *args, **kwargs):
+
+        global REDIS_ERROR_RETRY_COUNT
+
+        result = None
+
+        async for times in AsyncCirculator(max_times=REDIS_ERROR_RETRY_COUNT):
+
+            try:
+
+                result = await self._pipeline_buffer.execute(command, *args, **kwargs)
+
+            except (ReplyError, MaxClientsError, AuthError, ReadOnlyError) as err:
+
+                self._record_error(err)
+
+                raise err
+
+            except Exception as err:
+
+                self._record_error(err)
+
+                if times < REDIS_ERROR_RETRY_COUNT:
+                    Utils.log.exception(err)
+                else:
+                    raise err
+
+            else:
+
+                break
+
+        return result
+
+    def _is_auto_pipeline(self, command):
+
+        global REDIS_AUTO_PIPELINE_EXCLUDED_COMMANDS
+
+        if self._pipeline_buffer is None or self._pool_or_conn is not None:
+            return False
+
+        return Utils.utf8(command).upper() not in REDIS_AUTO_PIPELINE_EXCLUDED_COMMANDS
+
+    def _record_error(self, err):
+
+        if self._metrics is not None:
+            self._metrics.record_error(err)
+
+    def _is_replica_read(self, command):
+
+        global REDIS_READONLY_COMMANDS
+
+        # 持有专用连接时(WATCH事务等)在该连接上执行，执行过写命令后在主库读取，保证事务语义和读己之写
+        if self._replica_selector is None or self._pool_or_conn is not None or _REDIS_READ_PRIMARY.get():
+            return False
+
+        if Utils.utf8(command).upper() not in REDIS_READONLY_COMMANDS:
+            self._wrote = True
+
+        return not self._wrote
+
+    async def _replica_execute(self, command, *args, **kwargs):
+
+        index = self._replica_selector.acquire()
+
+        try:
+
+            client = self._replica_clients.get(index)
+
+            if client is None:
+                client = self._replica_clients[index] = self._replica_selector.pools[index].get_client()
+
+            return await client.execute(command, *args, **kwargs)
+
+        finally:
+
+            self._replica_selector.release(index)
+
+    async def _execute(self, command, *args, **kwargs):
+
+        if self._is_replica_read(command):
+            return await self._replica_execute(command, *args, **kwargs)
+
+        if self._is_auto_pipeline(command):
+            return await self._safe_pipeline_execute(command, *args, **kwargs)
+
+        return await self._safe_execute(super().execute, command, *args, **kwargs)
+
+    async def execute(self, command, *args, **kwargs):
+
+        if self._metrics is None:
+
+            result = await self._execute(command, *args, **kwargs)
+
+        else:
+
+            start_time = Utils.loop_time()
+
+            try:
+                result = await self._execute(command, *args, **kwargs)
+            finally:
+                self._metrics.record_command(command, Utils.loop_time() - start_time)
+
+        if self._near_cache is not None:
+            await self._near_write(command, args, result)
+
+        return result
+
+    @staticmethod
+    def _list_basestring(_list):
+
+        return [Utils.basestring(i) for i in _list]
+
+    def _val_encode(self, val):
+
+        return self._value_codec.encode(val)
+
+    def _val_decode(self, val):
+
+        return self._value_codec.decode(val)
+
+    async def _near_write(self, command, args, result):
+        """写命令执行成功后失效近端缓存中受影响的键
+        """
+
+        global REDIS_NEAR_CACHE_WRITE_COMMANDS, REDIS_NEAR_CACHE_CONDITIONAL_COMMANDS, REDIS_NEAR_CACHE_FLUSH_COMMANDS
+
+        command = Utils.utf8(command).upper()
+
+        if command in REDIS_NEAR_CACHE_FLUSH_COMMANDS:
+            await self._near_cache.invalidate_all()
+            return
+
+        if command in REDIS_NEAR_CACHE_CONDITIONAL_COMMANDS and not result:
+            return
+
+        if command == b'SORT':
+            keys = [
+                args[index + 1] for index in range(len(args) - 1)
+                if isinstance(args[index], (str, bytes)) and Utils.utf8(args[index]).upper() == b'STORE'
+            ]
+        else:
+            key_slice = REDIS_NEAR_CACHE_WRITE_COMMANDS.get(command)
+            keys = args[key_slice] if key_slice is not None else None
+
+        if keys:
+            await self._near_cache.invalidate(*keys)
+
+    def _list_decode(self, _list):
+
+        return map(
+            lambda i: self._val_decode(i) if i else i,
+            _list
+        )
+
+    def _lazy_list(self, _list):
+
+        return LazyList(_list, self._value_codec.decode)
+
+    def _lazy_dict(self, _dict):
+
+        return LazyDict(_dict, self._value_codec.decode)
+
+    def key(self, key, *args, **kwargs):
+
+        if self._key_prefix:
+            key = f'{self._key_prefix}_{key}'
+
+        if not args and not kwargs:
+            return key
+
+        sign = Utils.params_sign(*args, **kwargs)
+
+        return f'{key}_{sign}'
+
+    def allocate_lock(self, key, expire=60, *, fair=False, watchdog=False):
+
+        return MLock(self, key, expire, fair, watchdog=watchdog)
+
+    def chunked_value(self, key, *, chunk_size=None, batch_size=None, compress=True):
+
+        return ChunkedValue(self, key, chunk_size=chunk_size, batch_size=batch_size, compress=compress)
+
+    def allocate_rwlock(self, key, expire=60, *, write=False, watchdog=False):
+
+        return MRWLock(self, key, expire, write, watchdog=watchdog)
+
+    async def run_script(self, script, keys=[], args=[]):
+        """通过EVALSHA执行脚本，script为注册的脚本名或者脚本源码
+        """
+
+        source = self._script_registry.get_source(script)
+        digest = self._script_registry.digest(source)
+
+        try:
+            return await self.evalsha(digest, keys, args)
+        except ReplyError as err:
+            if not str(err).startswith(r'NOSCRIPT'):
+                raise err
+
+        await self.script_load(source)
+
+        return await self.evalsha(digest, keys, args)
+
+    # TRANSACTION COMMANDS
+
+    async def unwatch(self):
+
+        return await self._safe_execute(super().unwatch)
+
+    async def watch(self, key, *keys):
+
+        return await self._safe_execute(super().watch, key, *keys)
+
+    def multi_exec(self):
+        """编码事务，命令参数和返回结果与客户端方法一致，在WATCH之后调用时使用同一连接
+        """
+
+        return CacheMultiExec(self)
+
+    def pipeline(self):
+        """编码pipeline，命令参数和返回结果与客户端方法一致
+        """
+
+        return CachePipeline(self)
+
+    def raw_multi_exec(self):
+
+        return MultiExec(self._pool, aioredis.Redis)
+
+    def raw_pipeline(self):
+
+        return Pipeline(self._pool, aioredis.Redis)
+
+    # PUB/SUB COMMANDS
+
+    async def subscribe(self, channel, *channels):
+
+        return await self._safe_execute(super().subscribe, channel, *channels)
+
+    async def unsubscribe(self, channel, *channels):
+
+        return await self._safe_execute(super().unsubscribe, channel, *channels)
+
+    async def psubscribe(self, pattern, *patterns):
+
+        return await self._safe_execute(super().psubscribe, pattern, *patterns)
+
+    async def punsubscribe(self, pattern, *patterns):
+
+        return await self._safe_execute(super().punsubscribe, pattern, *patterns)
+
+    @property
+    def channels(self):
+
+        if self._pool_or_conn is None:
+            return None
+
+        return self._pool_or_conn.pubsub_channels
+
+    @property
+    def patterns(self):
+
+        if self._pool_or_conn is None:
+            return None
+
+        return self._pool_or_conn.pubsub_patterns
+
+    @property
+    def in_pubsub(self):
+
+        if self._pool_or_conn is None:
+            return None
+
+        return self._pool_or_conn.in_pubsub
+
+    # GENERIC COMMANDS
+
+    def memory_usage(self, key, samples=None):
+        """获取键及其值占用的内存字节数，samples为嵌套类型的抽样元素数量
+        """
+
+        if samples is None:
+            return self.execute(b'MEMORY', b'USAGE', key)
+        else:
+            return self.execute(b'MEMORY', b'USAGE', key, b'SAMPLES', samples)
+
+    async def delete(self, *keys):
+
+        _keys = []
+        _patterns = []
+
+        for key in keys:
+
+            if key.find(r'*') < 0:
+                _keys.append(key)
+            else:
+                _patterns.append(key)
+
+        result = (await super().delete(*_keys)) if len(_keys) > 0 else 0
+
+        for pattern in _patterns:
+            result += await self.delete_pattern(pattern)
+
+        return result
+
+    async def delete_pattern(self, pattern, *, batch_size=None, rate_limit=0):
+        """使用SCAN遍历匹配的键并分批UNLINK，不会像KEYS一样长时间阻塞Redis
+
+        rate_limit为每秒最多删除的键数量，0为不限制
+
+        """
+
+        global REDIS_DELETE_BATCH_SIZE
+
+        if batch_size is None:
+            batch_size = REDIS_DELETE_BATCH_SIZE
+
+        result = 0
+
+        _keys = []
+
+        start_time = Utils.loop_time()
+
+        # 从库的数据可能滞后，在主库遍历才能删除全部匹配的键
+        with read_from_primary():
+
+            async for keys in self.iscan(match=pattern, count=batch_size, batch=True):
+
+                _keys.extend(keys)
+
+                if len(_keys) < batch_size:
+                    continue
+
+                result += await self._unlink_batch(_keys)
+                _keys = []
+
+                if rate_limit > 0:
+                    await Utils.sleep(max(0, result / rate_limit - (Utils.loop_time() - start_time)))
+
+            if _keys:
+                result += await self._unlink_batch(_keys)
+
+        return result
+
+    async def _unlink_batch(self, keys):
+
+        result = await super().unlink(*keys)
+
+        return result
+
+    def _delete(self, key, *keys):
+
+        return super().delete(key, *keys)
+
+    async def keys(self, pattern):
+
+        result = await super().keys(pattern)
+
+        if result is not None:
+            result = [Utils.basestring(key) for key in result]
+
+        return result
+
+    def _keys(self, pattern, *, encoding=_NOTSET):
+
+        return super().keys(pattern, encoding=encoding)
+
+    async def randomkey(self):
+
+        result = await super().randomkey()
+
+        if result is not None:
+            result = Utils.basestring(result)
+
+        return result
+
+    def _randomkey(self, *, encoding=_NOTSET):
+
+        return super().randomkey(encoding=encoding)
+
+    async def scan(self, cursor=0, match=None, count=None):
+
+        result = await super().scan(cursor, match, count)
+
+        if result is not None:
+            result = (result[0], self._list_basestring(result[1]))
+
+        return result
+
+    def _scan(self, cursor=0, match=None, count=None):
+
+        return super().scan(cursor, match, count)
+
+    @staticmethod
+    async def _scan_iter(scan, batch):
+
+        cursor = None
+
+        while cursor != 0:
+
+            cursor, items = await scan(cursor or 0)
+
+            if not items:
+                continue
+
+            if batch:
+                yield items
+            else:
+                for item in items:
+                    yield item
+
+    def iscan(self, *, match=None, count=None, batch=False):
+        """使用async for遍历键空间，count控制每次SCAN的数量，batch为True时按批次返回列表
+        """
+
+        return self._scan_iter(
+            lambda cursor: self.scan(cursor, match, count),
+            batch
+        )
+
+    # STRING COMMANDS
+
+    async def get(self, key):
+
+        near_cache = self._near_cache
+
+        if near_cache is not None:
+            return await self._near_get(near_cache, key)
+
+        result = await super().get(key)
+
+        if result is not None:
+            result = self._val_decode(result)
+
+        return result
+
+    async def _near_get(self, near_cache, key):
+
+        result = near_cache.get_value(key)
+
+        if result is not _NOTSET:
+            return result
+
+        version = near_cache.version
+
+        # 同时读取键的剩余有效期作为本地缓存有效期的上限
+        result = await self.run_script(NearCache._get_script, [key])
+
+        if result is not None:
+            result = near_cache.set_value(key, self._val_decode(result[0]), version, result[1])
+
+        return result
+
+    def _get(self, key, *, encoding=_NOTSET):
+
+        return super().get(key, encoding=encoding)
+
+    async def getset(self, key, value):
+
+        _value = self._val_encode(value)
+
+        result = await super().getset(key, _value)
+
+        if result is not None:
+            result = self._val_decode(result)
+
+        return result
+
+    def _getset(self, key, value, *, encoding=_NOTSET):
+
+        return super().getset(key, value, encoding=encoding)
+
+    async def mget(self, key, *keys, lazy=False):
+        """批量获取，lazy为True时返回LazyList，元素在首次访问时解码
+        """
+
+        result = await super().mget(key, *keys)
+
+        if result is not None:
+            result = self._lazy_list(result) if lazy else list(self._list_decode(result))
+
+        return result
+
+    def _mget(self, key, *keys, encoding=_NOTSET):
+
+        return super().mget(key, *keys, encoding=encoding)
+
+    async def set(self, key, value, expire=0):
+
+        _value = self._val_encode(value)
+        _expire = expire if expire > 0 else self._expire
+
+        result = await super().set(key, _value, expire=_expire)
+
+        return result
+
+    def _set(self, key, value, *, expire=0, pexpire=0, exist=None):
+
+        return super().set(key, value, expire=expire, pexpire=pexpire, exist=exist)
+
+    async def mset(self, key, value, *pairs):
+
+        _value = self._val_encode(value)
+        _pairs = [item if index % 2 == 0 else self._val_encode(item) for index, item in enumerate(pairs)]
+
+        result = await super().mset(key, _value, *_pairs)
+
+        return result
+
+    def _mset(self, key, value, *pairs):
+
+        return super().mset(key, value, *pairs)
+
+    async def msetnx(self, key, value, *pairs):
+
+        _value = self._val_encode(value)
+        _pairs = [item if index % 2 == 0 else self._val_encode(item) for index, item in enumerate(pairs)]
+
+        result = await super().msetnx(key, _value, *_pairs)
+
+        return result
+
+    def _msetnx(self, key, value, *pairs):
+
+        return super().msetnx(key, value, *pairs)
+
+    async def psetex(self, key, milliseconds, value):
+
+        _value = self._val_encode(value)
+
+        result = await super().psetex(key, milliseconds, _value)
+
+        return result
+
+    def _psetex(self, key, milliseconds, value):
+
+        return super().psetex(key, milliseconds, value)
+
+    async def setex(self, key, seconds, value):
+
+        _value = self._val_encode(value)
+
+        result = await super().setex(key, seconds, _value)
+
+        return result
+
+    def _setex(self, key, seconds, value):
+
+        return super().setex(key, seconds, value)
+
+    async def setnx(self, key, value):
+
+        _value = self._val_encode(value)
+
+        result = await super().setnx(key, _value)
+
+        return result
+
+    def _setnx(self, key, value):
+
+        return super().setnx(key, value)
+
+    # SET COMMANDS
+
+    async def sdiff(self, key, *keys):
+
+        result = await super().sdiff(key, *keys)
+
+        if result is not None:
+            result = self._list_basestring(result)
+
+        return result
+
+    def _sdiff(self, key, *keys):
+
+        return super().sdiff(key, *keys)
+
+    async def sinter(self, key, *keys):
+
+        result = await super().sinter(key, *keys)
+
+        if result is not None:
+            result = self._list_basestring(result)
+
+        return result
+
+    def _sinter(self, key, *keys):
+
+        return super().sinter(key, *keys)
+
+    async def smembers(self, key):
+
+        result = await super().smembers(key)
+
+        if result is not None:
+            result = self._list_basestring(result)
+
+        return result
+
+    def _smembers(self, key, *, encoding=_NOTSET):
+
+        return super().smembers(key, encoding=encoding)
+
+    async def spop(self, key):
+
+        result = await super().spop(key)
+
+        if result is not None:
+            result = Utils.basestring(result)
+
+        return result
+
+    def _spop(self, key, *, encoding=_NOTSET):
+
+        return super().spop(key, encoding=encoding)
+
+    async def srandmember(self, key, count=1):
+
+        result = await super().srandmember(key, count)
+
+        if result is not None:
+            result = self._list_basestring(result)
+
+        return result
+
+    def _srandmember(self, key, count=None):
+
+        return super().srandmember(key, count)
+
+    async def sunion(self, key, *keys):
+
+        result = await super().sunion(key, *keys)
+
+        if result is not None:
+            result = self._list_basestring(result)
+
+        return result
+
+    def _sunion(self, key, *keys):
+
+        return super().sunion(key, *keys)
+
+    async def sscan(self, key, cursor=0, match=None, count=None):
+
+        result = await super().sscan(key, cursor, match, count)
+
+        if result is not None:
+            result = (result[0], self._list_basestring(result[1]))
+
+        return result
+
+    def _sscan(self, key, cursor=0, match=None, count=None):
+
+        return super().sscan(key, cursor, match, count)
+
+    def isscan(self, key, *, match=None, count=None, batch=False):
+
+        return self._scan_iter(
+            lambda cursor: self.sscan(key, cursor, match, count),
+            batch
+        )
+
+    # HASH COMMANDS
+
+    async def hdel(self, key, field, *fields):
+
+        result = await super().hdel(key, field, *fields)
+
+        return result
+
+    def _hdel(self, key, field, *fields):
+
+        return super().hdel(key, field, *fields)
+
+    async def hget(self, key, field):
+
+        near_cache = self._near_cache
+
+        if near_cache is not None:
+            return await self._near_hget(near_cache, key, field)
+
+        result = await super().hget(key, field)
+
+        if result is not None:
+            result = self._val_decode(result)
+
+        return result
+
+    async def _near_hget(self, near_cache, key, field):
+
+        result = near_cache.get_field(key, field)
+
+        if result is not _NOTSET:
+            return result
+
+        version = near_cache.version
+
+        # 同时读取键的剩余有效期作为本地缓存有效期的上限
+        result = await self.run_script(NearCache._hget_script, [key], [field])
+
+        if result is not None:
+            result = near_cache.set_field(key, field, self._val_decode(result[0]), version, result[1])
+
+        return result
+
+    def _hget(self, key, field, *, encoding=_NOTSET):
+
+        return super().hget(key, field, encoding=encoding)
+
+    async def hgetall(self, key, *, lazy=False):
+        """获取哈希表全部字段，lazy为True时返回LazyDict，字段值在首次访问时解码
+        """
+
+        result = await super().hgetall(key)
+
+        if result is not None:
+            if lazy:
+                result = self._lazy_dict({Utils.basestring(key): val for key, val in result.items()})
+            else:
+                result = {Utils.basestring(key): self._val_decode(val) for key, val in result.items()}
+
+        return result
+
+    def _hgetall(self, key, *, encoding=_NOTSET):
+
+        return super().hgetall(key, encoding=encoding)
+
+    async def hkeys(self, key):
+
+        result = await super().hkeys(key)
+
+        if result is not None:
+            result = [Utils.basestring(key) for key in result]
+
+        return result
+
+    def _hkeys(self, key, *, encoding=_NOTSET):
+
+        return super().hkeys(key, encoding=encoding)
+
+    async def hmget(self, key, field, *fields):
+
+        result = await super().hmget(key, field, *fields)
+
+        if result is not None:
+            result = list(self._list_decode(result))
+
+        return result
+
+    def _hmget(self, key, field, *fields, encoding=_NOTSET):
+
+        return super().hmget(key, field, *fields, encoding=encoding)
+
+    async def hmset(self, key, field, value, *pairs):
+
+        _value = self._val_encode(value)
+        _pairs = [item if index % 2 == 0 else self._val_encode(item) for index, item in enumerate(pairs)]
+
+        result = await super().hmset(key, field, _value, *_pairs)
+
+        return result
+
+    def _hmset(self, key, field, value, *pairs):
+
+        return super().hmset(key, field, value, *pairs)
+
+    async def hmset_dict(self, key, *args, **kwargs):
+
+        for _arg in args:
+            if isinstance(_arg, dict):
+                kwargs.update({key: self._val_encode(val) for key, val in _arg.items()})
+
+        result = await super().hmset_dict(key, kwargs)
+
+        return result
+
+    def _hmset_dict(self, key, *args, **kwargs):
+
+        return super().hmset_dict(key, *args, **kwargs)
+
+    async def hset(self, key, field, value):
+
+        _value = self._val_encode(value)
+
+        result = await super().hset(key, field, _value)
+
+        return result
+
+    def _hset(self, key, field, value):
+
+        return super().hset(key, field, value)
+
+    async def hsetnx(self, key, field, value):
+
+        _value = self._val_encode(value)
+
+        result = await super().hsetnx(key, field, _value)
+
+        return result
+
+    def _hsetnx(self, key, field, value):
+
+        return super().hsetnx(key, field, value)
+
+    async def hvals(self, key, *, lazy=False):
+
+        result = await super().hvals(key)
+
+        if result is not None:
+            result = self._lazy_list(result) if lazy else list(self._list_decode(result))
+
+        return result
+
+    def _hvals(self, key, *, encoding=_NOTSET):
+
+        return super().hvals(key, encoding=encoding)
+
+    async def hscan(self, key, cursor=0, match=None, count=None):
+
+        result = await super().hscan(key, cursor, match, count)
+
+        if result is not None:
+            result = (result[0], [(Utils.basestring(key), self._val_decode(val),) for key, val in result[1]])
+
+        return result
+
+    def _hscan(self, key, cursor=0, match=None, count=None):
+
+        return super().hscan(key, cursor, match, count)
+
+    def ihscan(self, key, *, match=None, count=None, batch=False):
+
+        return self._scan_iter(
+            lambda cursor: self.hscan(key, cursor, match, count),
+            batch
+        )
+
+    # LIST COMMANDS
+
+    async def blpop(self, key, *, timeout=0):
+
+        result = await super().blpop(key, timeout=timeout)
+
+        if result is not None:
+            result = self._val_decode(result[1])
+
+        return result
+
+    def _blpop(self, key, *keys, timeout=0, encoding=_NOTSET):
+
+        return super().blpop(key, *keys, timeout=timeout, encoding=encoding)
+
+    async def brpop(self, key, *, timeout=0):
+
+        result = await super().brpop(key, timeout=timeout)
+
+        if result is not None:
+            result = self._val_decode(result[1])
+
+        return result
+
+    def _brpop(self, key, *keys, timeout=0, encoding=_NOTSET):
+
+        return super().brpop(key, *keys, timeout=timeout, encoding=encoding)
+
+    async def brpoplpush(self, sourcekey, destkey, timeout=0):
+
+        result = await super().brpoplpush(sourcekey, destkey, timeout)
+
+        if result is not None:
+            result = self._val_decode(result)
+
+        return result
+
+    def _brpoplpush(self, sourcekey, destkey, timeout=0, encoding=_NOTSET):
+
+        return super().brpoplpush(sourcekey, destkey, timeout, encoding)
+
+    async def lindex(self, key, index):
+
+        result = await super().lindex(key, index)
+
+        if result is not None:
+            result = self._val_decode(result)
+
+        return result
+
+    def _lindex(self, key, index, *, encoding=_NOTSET):
+
+        return super().lindex(key, index, encoding=encoding)
+
+    async def linsert(self, key, pivot, value, before=False):
+
+        _pivot = self._val_encode(pivot)
+        _value = self._val_encode(value)
+
+        result = await super().linsert(key, _pivot, _value, before=before)
+
+        return result
+
+    def _linsert(self, key, pivot, value, before=False):
+
+        return super().linsert(key, pivot, value, before=before)
+
+    async def lpop(self, key):
+
+        result = await super().lpop(key)
+
+        if result is not None:
+            result = self._val_decode(result)
+
+        return result
+
+    def _lpop(self, key, *, encoding=_NOTSET):
+
+        return super().lpop(key, encoding=encoding)
+
+    async def lpush(self, key, value, *values):
+
+        _value = self._val_encode(value)
+        _values = [self._val_encode(val) for val in values]
+
+        result = await super().lpush(key, _value, *_values)
+
+        return result
+
+    def _lpush(self, key, value, *values):
+
+        return super().lpush(key, value, *values)
+
+    async def lpushx(self, key, value):
+
+        _value = self._val_encode(value)
+
+        result = await super().lpushx(key, _value)
+
+        return result
+
+    def _lpushx(self, key, value):
+
+        return super().lpushx(key, value)
+
+    async def lrange(self, key, start, stop, *, lazy=False):
+
+        result = await super().lrange(key, start, stop)
+
+        if result is not None:
+            result = self._lazy_list(result) if lazy else list(self._list_decode(result))
+
+        return result
 
     def _lrange(self, key, start, stop, *, encoding=_NOTSET):
 
-        return super().lrange(key, start, stop, encoding=encoding)
+        return super().lrange(key, start, stop, encoding=encoding)
+
+    async def lrem(self, key, count, value):
+
+        _value = self._val_encode(value)
+
+        result = await super().lrem(key, count, _value)
+
+        return result
+
+    def _lrem(self, key, count, value):
+
+        return super().lrem(key, count, value)
+
+    async def lset(self, key, index, value):
+
+        _value = self._val_encode(value)
+
+        result = await super().lset(key, index, _value)
+
+        return result
+
+    def _lset(self, key, index, value):
+
+        return super().lset(key, index, value)
+
+    async def rpop(self, key):
+
+        result = await super().rpop(key)
+
+        if result is not None:
+            result = self._val_decode(result)
+
+        return result
+
+    def _rpop(self, key, *, encoding=_NOTSET):
+
+        return super().rpop(self, key, encoding=encoding)
+
+    async def rpoplpush(self, sourcekey, destkey):
+
+        result = await super().rpoplpush(sourcekey, destkey)
+
+        if result is not None:
+            result = self._val_decode(result)
+
+        return result
+
+    def _rpoplpush(self, sourcekey, destkey, *, encoding=_NOTSET):
+
+        return super().rpoplpush(sourcekey, destkey, encoding=encoding)
+
+    async def rpush(self, key, value, *values):
+
+        _value = self._val_encode(value)
+        _values = [self._val_encode(val) for val in values]
+
+        result = await super().rpush(key, _value, *_values)
+
+        return result
+
+    def _rpush(self, key, value, *values):
+
+        return super().rpush(key, value, *values)
+
+    async def rpushx(self, key, value):
+
+        _value = self._val_encode(value)
+
+        result = await super().rpushx(key, _value)
+
+        return result
+
+    def _rpushx(self, key, value):
+
+        return super().rpushx(key, value)
+
+
+class PipelineCacheClient(CacheClient):
+    """pipeline命令客户端
+
+    复用CacheClient的编解码方法，命令写入pipeline缓冲区，结果在pipeline执行后解码
+
+    """
+
+    def __init__(self, client, buffer):
+
+        super().__init__(
+            None, client._expire, client._key_prefix,
+            near_cache=client._near_cache, value_codec=client._value_codec, script_registry=client._script_registry
+        )
+
+        self._buffer = buffer
+
+    def execute(self, command, *args, **kwargs):
+
+        future = self._buffer.execute(command, *args, **kwargs)
+
+        if self._near_cache is None:
+            return future
+
+        return self._near_write_future(future, command, args)
+
+    async def _near_write_future(self, future, command, args):
+
+        result = await future
+
+        await self._near_write(command, args, result)
+
+        return result
+
+    async def delete(self, *keys):
+
+        for key in keys:
+            if key.find(r'*') >= 0:
+                raise ValueError(f'Pattern not supported in pipeline: {key}')
+
+        return await super().delete(*keys)
+
+    async def run_script(self, script, keys=[], args=[]):
+
+        digest = self._script_registry.digest(self._script_registry.get_source(script))
+
+        return await self.evalsha(digest, keys, args)
+
+
+class _EagerAwaitable:
+    """继续驱动已经同步执行过第一步的协程，转发任务的send和throw
+    """
+
+    __slots__ = [r'_coro', r'_yielded']
+
+    def __init__(self, coro, yielded):
+
+        self._coro = coro
+        self._yielded = yielded
+
+    def __await__(self):
+
+        coro, yielded = self._coro, self._yielded
+
+        while True:
+
+            try:
+
+                value = yield yielded
+
+            except BaseException as err:
+
+                try:
+                    yielded = coro.throw(err)
+                except StopIteration as stop:
+                    return stop.value
+
+            else:
+
+                try:
+                    yielded = coro.send(value)
+                except StopIteration as stop:
+                    return stop.value
+
+
+def _eager_future(coro):
+    """同步执行协程直到第一次挂起，之后以任务方式继续执行
+
+    pipeline命令在第一步中完成编码并写入缓冲区，调用返回时命令已经入队
+
+    """
+
+    try:
+
+        yielded = coro.send(None)
+
+    except StopIteration as stop:
+
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(stop.value)
+
+        return future
+
+    except Exception as err:
+
+        future = asyncio.get_event_loop().create_future()
+        future.set_exception(err)
+
+        return future
+
+    return asyncio.ensure_future(_EagerAwaitable(coro, yielded))
+
+
+class _CachePipelineMixin:
+
+    def __init__(self, client):
+
+        super().__init__(None, Utils.func_partial(PipelineCacheClient, client))
+
+        self._client = client
+
+    def __getattr__(self, name):
+
+        assert not self._done, r'Pipeline already executed. Create new one.'
+
+        attr = getattr(self._redis, name)
+
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def _wrapper(*args, **kwargs):
+
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as err:
+                future = asyncio.get_event_loop().create_future()
+                future.set_exception(err)
+            else:
+                future = _eager_future(result) if asyncio.iscoroutine(result) else asyncio.ensure_future(result)
+
+            self._results.append(future)
+
+            return future
+
+        return _wrapper
+
+    async def execute(self, *, return_exceptions=False):
+
+        client = self._client
+
+        await client._init_conn()
+
+        self._pool_or_conn = client._pool_or_conn
+
+        try:
+
+            return await super().execute(return_exceptions=return_exceptions)
+
+        except PipelineError as err:
+
+            client._record_error(err)
+
+            # 非命令错误说明连接异常，丢弃连接且不重放(pipeline中可能包含非幂等命令)，err.args为(描述, 错误列表)
+            if not all(isinstance(_err, ReplyError) for _err in err.args[-1]):
+                await client._close_conn(True)
+
+            raise err
+
+        except Exception as err:
+
+            client._record_error(err)
+
+            await client._close_conn(True)
+
+            raise err
+
+
+class CachePipeline(_CachePipelineMixin, Pipeline):
+    """编码pipeline
+
+    pipe = cache.pipeline()
+    fut = pipe.get(key)
+    pipe.hset(key, field, value)
+    await pipe.execute()
+
+    """
+
+
+class CacheMultiExec(_CachePipelineMixin, MultiExec):
+    """编码事务
+    """
+
+
+class ShardedCacheClient(AsyncContextManager):
+    """分片Redis客户端对象，使用with进行上下文管理
+
+    单键命令按第一个参数(或key参数)路由到对应节点的CacheClient，mget、mset、delete等多键命令按节点拆分后并发执行并合并结果
+
+    无法拆分的多键命令(msetnx、sinter、rename等)要求所有键位于同一节点，可以使用{hash tag}保证，否则抛出ValueError
+
+    pipeline和multi_exec没有路由依据，需要通过get_node_client(key)获取节点客户端后使用
+
+    脚本按第一个键路由，其他键在该节点上访问
+
+    """
+
+    def __init__(self, sharded_pool, read_primary=False):
+
+        self._sharded_pool = sharded_pool
+        self._read_primary = read_primary
+
+        self._clients = {}
+
+    def __getattr__(self, name):
+
+        # 只转发CacheClient的命令方法，属性和不存在的名称不能按键路由
+        if name[:2] == r'__' or not inspect.isfunction(getattr(CacheClient, name, None)):
+            raise AttributeError(name)
+
+        return Utils.func_partial(self._route_execute, name)
+
+    def _route_execute(self, name, *args, **kwargs):
+
+        global REDIS_SHARDED_MULTI_KEY_COMMANDS
+
+        key = args[0] if args else kwargs.get(r'key')
+
+        if key is None:
+            return getattr(self._all_clients()[0], name)(*args, **kwargs)
+
+        key_slice = REDIS_SHARDED_MULTI_KEY_COMMANDS.get(name.lstrip(r'_'))
+
+        if key_slice is not None:
+            # zunionstore等命令的带权重参数为(key, weight)
+            self._check_same_node(name, [_key[0] if isinstance(_key, tuple) else _key for _key in args[key_slice]])
+
+        return getattr(self.get_node_client(key), name)(*args, **kwargs)
+
+    def _check_same_node(self, name, keys):
+
+        if len(self._group_keys(keys)) > 1:
+            raise ValueError(f'Keys of {name.lstrip(r"_")} must be in the same node')
+
+    def _get_client(self, pool):
+
+        client = self._clients.get(pool)
+
+        if client is None:
+            client = self._clients[pool] = pool.get_client(read_primary=self._read_primary)
+
+        return client
+
+    def _all_clients(self):
+
+        return [self._get_client(pool) for pool in self._sharded_pool.nodes]
+
+    def _group_keys(self, keys):
+
+        groups = {}
+
+        for index, key in enumerate(keys):
+            groups.setdefault(self._sharded_pool.get_node(key), []).append((index, key))
+
+        return [(self._get_client(pool), items) for pool, items in groups.items()]
+
+    def get_node_client(self, key):
+        """获取键所在节点的CacheClient，用于pipeline和multi_exec等需要单节点执行的场景
+        """
+
+        return self._get_client(self._sharded_pool.get_node(key))
+
+    def _node_only(self, name):
+
+        raise ValueError(f'{name} is not supported by sharded client, use get_node_client(key).{name}()')
+
+    def pipeline(self):
+
+        self._node_only(r'pipeline')
+
+    def multi_exec(self):
+
+        self._node_only(r'multi_exec')
+
+    def raw_pipeline(self):
+
+        self._node_only(r'raw_pipeline')
+
+    def raw_multi_exec(self):
+
+        self._node_only(r'raw_multi_exec')
+
+    async def _context_release(self):
+
+        await self.release()
+
+    async def release(self):
+
+        for client in self._clients.values():
+            await client.release()
+
+        self._clients.clear()
+
+    def key(self, key, *args, **kwargs):
+
+        return self._all_clients()[0].key(key, *args, **kwargs)
+
+    @property
+    def lock_notifier(self):
+
+        return self._sharded_pool.nodes[0].lock_notifier
 
-    async def lrem(self, key, count, value):
+    @property
+    def value_codec(self):
 
-        _value = self._val_encode(value)
+        return self._sharded_pool.value_codec
 
-        result = await super().lrem(key, count, _value)
+    @property
+    def default_expire(self):
 
-        return result
+        return self._all_clients()[0].default_expire
 
-    def _lrem(self, key, count, value):
+    def allocate_lock(self, key, expire=60, *, fair=False, watchdog=False):
 
-        return super().lrem(key, count, value)
+        return MLock(self, key, expire, fair, watchdog=watchdog)
 
-    async def lset(self, key, index, value):
+    def chunked_value(self, key, *, chunk_size=None, batch_size=None, compress=True):
 
-        _value = self._val_encode(value)
+        return ChunkedValue(self, key, chunk_size=chunk_size, batch_size=batch_size, compress=compress)
 
-        result = await super().lset(key, index, _value)
+    def allocate_rwlock(self, key, expire=60, *, write=False, watchdog=False):
 
-        return result
+        return MRWLock(self, key, expire, write, watchdog=watchdog)
 
-    def _lset(self, key, index, value):
+    async def _multi_get(self, method, keys):
 
-        return super().lset(key, index, value)
+        result = [None] * len(keys)
 
-    async def rpop(self, key):
+        groups = self._group_keys(keys)
 
-        result = await super().rpop(key)
+        tasks = MultiTasks()
 
-        if result is not None:
-            result = self._val_decode(result)
+        for client, items in groups:
+            tasks.append(getattr(client, method)(*(key for _, key in items)))
+
+        for (_, items), values in zip(groups, await tasks):
+            for (index, _), val in zip(items, values):
+                result[index] = val
 
         return result
 
-    def _rpop(self, key, *, encoding=_NOTSET):
+    async def _multi_set(self, method, pairs):
 
-        return super().rpop(self, key, encoding=encoding)
+        keys = pairs[::2]
 
-    async def rpoplpush(self, sourcekey, destkey):
+        groups = self._group_keys(keys)
 
-        result = await super().rpoplpush(sourcekey, destkey)
+        tasks = MultiTasks()
 
-        if result is not None:
-            result = self._val_decode(result)
+        for client, items in groups:
+            tasks.append(getattr(client, method)(*(val for index, _ in items for val in pairs[index * 2:index * 2 + 2])))
 
-        return result
+        return all(await tasks)
 
-    def _rpoplpush(self, sourcekey, destkey, *, encoding=_NOTSET):
+    async def mget(self, key, *keys, lazy=False):
 
-        return super().rpoplpush(sourcekey, destkey, encoding=encoding)
+        if lazy:
+            return LazyList(await self._multi_get(r'_mget', (key,) + keys), self._sharded_pool.value_codec.decode)
+
+        return await self._multi_get(r'mget', (key,) + keys)
+
+    async def _mget(self, key, *keys):
+
+        return await self._multi_get(r'_mget', (key,) + keys)
+
+    async def mset(self, key, value, *pairs):
+
+        return await self._multi_set(r'mset', (key, value) + pairs)
+
+    async def _mset(self, key, value, *pairs):
+
+        return await self._multi_set(r'_mset', (key, value) + pairs)
+
+    async def msetnx(self, key, value, *pairs):
+
+        self._check_same_node(r'msetnx', (key,) + pairs[::2])
+
+        return await self.get_node_client(key).msetnx(key, value, *pairs)
+
+    async def delete(self, *keys):
+
+        _keys = []
+
+        tasks = MultiTasks()
+
+        for key in keys:
+
+            if key.find(r'*') < 0:
+                _keys.append(key)
+            else:
+                tasks.extend(client.delete_pattern(key) for client in self._all_clients())
+
+        for client, items in self._group_keys(_keys):
+            tasks.append(client.delete(*(key for _, key in items)))
+
+        return sum(await tasks)
+
+    async def unlink(self, key, *keys):
+
+        tasks = MultiTasks()
+
+        for client, items in self._group_keys((key,) + keys):
+            tasks.append(client.unlink(*(key for _, key in items)))
+
+        return sum(await tasks)
+
+    async def delete_pattern(self, pattern, *, batch_size=None, rate_limit=0):
+
+        clients = self._all_clients()
+
+        tasks = MultiTasks()
+
+        tasks.extend(
+            client.delete_pattern(pattern, batch_size=batch_size, rate_limit=rate_limit / len(clients))
+            for client in clients
+        )
+
+        return sum(await tasks)
+
+    async def exists(self, key, *keys):
+
+        tasks = MultiTasks()
+
+        for client, items in self._group_keys((key,) + keys):
+            tasks.append(client.exists(*(key for _, key in items)))
+
+        return sum(await tasks)
+
+    async def keys(self, pattern):
+
+        tasks = MultiTasks()
+
+        tasks.extend(client.keys(pattern) for client in self._all_clients())
+
+        return [key for keys in await tasks for key in keys]
+
+    async def scan(self, cursor=0, match=None, count=None):
+
+        # 游标低位为节点序号，高位为节点内游标
+        clients = self._all_clients()
+
+        node_index, node_cursor = cursor % len(clients), cursor // len(clients)
+
+        node_cursor, keys = await clients[node_index].scan(node_cursor, match, count)
+
+        if node_cursor != 0:
+            cursor = node_cursor * len(clients) + node_index
+        elif node_index + 1 < len(clients):
+            cursor = node_index + 1
+        else:
+            cursor = 0
+
+        return cursor, keys
+
+    async def iscan(self, *, match=None, count=None, batch=False):
+
+        for client in self._all_clients():
+            async for item in client.iscan(match=match, count=count, batch=batch):
+                yield item
+
+    async def eval(self, script, keys=[], args=[]):
+
+        client = self.get_node_client(keys[0]) if keys else self._all_clients()[0]
+
+        return await client.eval(script, keys, args)
+
+    async def evalsha(self, digest, keys=[], args=[]):
+
+        client = self.get_node_client(keys[0]) if keys else self._all_clients()[0]
+
+        return await client.evalsha(digest, keys, args)
+
+    async def run_script(self, script, keys=[], args=[]):
+
+        client = self.get_node_client(keys[0]) if keys else self._all_clients()[0]
+
+        return await client.run_script(script, keys, args)
+
+    async def flushdb(self):
+
+        tasks = MultiTasks()
+
+        tasks.extend(client.flushdb() for client in self._all_clients())
+
+        return all(await tasks)
+
+
+class MLock(AsyncContextManager):
+    """基于Redis实现的分布式锁，使用with进行上下文管理
+
+    等待者通过LockNotifier在锁释放时被唤醒，fair为True时按排队顺序(FIFO)获取锁
+
+    只有timeout大于0时才订阅释放通知并登记等待标记，释放时存在等待标记才广播通知，无竞争时不产生订阅和广播
+
+    获取成功时返回单调递增的fencing token，watchdog为True时在持有期间后台按expire/3周期续期
+
+    """
+
+    _lock_script = '''
+if redis.call("set",KEYS[1],ARGV[1],"NX","EX",ARGV[2]) then
+    return redis.call("incr",KEYS[2])
+else
+    return 0
+end
+'''
+
+    _fair_lock_script = '''
+redis.call("hset",KEYS[3],ARGV[1],ARGV[3])
+if not redis.call("zscore",KEYS[2],ARGV[1]) then
+    local last = redis.call("zrange",KEYS[2],-1,-1,"WITHSCORES")
+    redis.call("zadd",KEYS[2],last[2] and (tonumber(last[2]) + 1) or 0,ARGV[1])
+end
+while true do
+    local head = redis.call("zrange",KEYS[2],0,0)[1]
+    if not head then
+        break
+    end
+    local seen = tonumber(redis.call("hget",KEYS[3],head) or 0)
+    if seen >= tonumber(ARGV[3]) - tonumber(ARGV[4]) then
+        break
+    end
+    redis.call("zrem",KEYS[2],head)
+    redis.call("hdel",KEYS[3],head)
+end
+redis.call("pexpire",KEYS[2],ARGV[4])
+redis.call("pexpire",KEYS[3],ARGV[4])
+if redis.call("zrange",KEYS[2],0,0)[1] == ARGV[1] and redis.call("set",KEYS[1],ARGV[1],"NX","EX",ARGV[2]) then
+    redis.call("zrem",KEYS[2],ARGV[1])
+    redis.call("hdel",KEYS[3],ARGV[1])
+    return redis.call("incr",KEYS[4])
+else
+    return 0
+end
+'''
+
+    _renew_script = '''
+if redis.call("get",KEYS[1]) == ARGV[1] and redis.call("ttl",KEYS[1]) > 0 then
+    return redis.call("expire",KEYS[1],ARGV[2])
+else
+    return 0
+end
+'''
+
+    _unlock_script = '''
+if redis.call("get",KEYS[1]) == ARGV[1] then
+    return redis.call("del",KEYS[1])
+else
+    return 0
+end
+'''
+
+    _release_script = '''
+if redis.call("get",KEYS[1]) == ARGV[1] then
+    redis.call("del",KEYS[1])
+    return redis.call("exists",KEYS[2]) + 1
+else
+    return 0
+end
+'''
+
+    def __init__(self, cache, key, expire, fair=False, *, watchdog=False):
+
+        global MLOCK_FENCE_KEY
+
+        self._cache = cache
+        self._expire = expire
+
+        self._lock_tag = self._gen_lock_tag(key)
+        self._lock_val = Utils.uuid1().encode()
+
+        self._locked = False
+
+        self._fair = fair
+        self._queue_tag = self._gen_helper_tag(r'queue')
+        self._queue_seen_tag = self._gen_helper_tag(r'queue_seen')
+        self._waiting_tag = self._gen_helper_tag(r'waiting')
+
+        self._fence_tag = MLOCK_FENCE_KEY
+        self._fencing_token = 0
+
+        self._watchdog = watchdog
+        self._watchdog_task = None
+
+        self._notifier = cache.lock_notifier
+
+    @staticmethod
+    def _gen_lock_tag(key):
+
+        return f'process_lock_{key}'
+
+    def _gen_helper_tag(self, suffix):
+        """生成锁的辅助键，使用与锁相同的哈希标签，分片模式下与锁路由到同一节点
+        """
+
+        start = self._lock_tag.find(r'{')
+        end = self._lock_tag.find(r'}', start + 1)
+
+        if start >= 0 and end > start + 1:
+            return f'{self._lock_tag}_{suffix}'
+        else:
+            return f'{{{self._lock_tag}}}_{suffix}'
+
+    @property
+    def locked(self):
+
+        return self._locked
+
+    @property
+    def fencing_token(self):
+
+        return self._fencing_token
+
+    async def _context_release(self):
+
+        await self.release()
+
+    async def exists(self):
+
+        with read_from_primary():
+            result = await self._cache.exists(self._lock_tag)
+
+        return bool(result)
+
+    def _watch(self):
+
+        return None if self._notifier is None else self._notifier.watch(self._lock_tag)
+
+    def _unwatch(self, waiter):
+
+        if waiter is not None:
+            self._notifier.unwatch(self._lock_tag, waiter)
+
+    async def _mark_waiting(self):
+        """登记等待标记，释放锁时据此判断是否需要广播通知，等待者每次重试前续期
+        """
+
+        global MLOCK_NOTIFY_WAIT_INTERVAL
+
+        if self._notifier is not None:
+            await self._cache._set(self._waiting_tag, b'1', pexpire=MLOCK_NOTIFY_WAIT_INTERVAL * 3000)
+
+    async def _wait_release(self, waiter, expire_time):
+
+        global MLOCK_NOTIFY_WAIT_INTERVAL
+
+        if waiter is None:
+            await Utils.wait_frame(0xff)
+        elif expire_time > 0:
+            await self._notifier.wait(waiter, min(expire_time - Utils.loop_time(), MLOCK_NOTIFY_WAIT_INTERVAL))
+        else:
+            await self._notifier.wait(waiter, MLOCK_NOTIFY_WAIT_INTERVAL)
+
+    async def _try_acquire(self):
+        """尝试获取锁，成功时返回fencing token，失败时返回0
+        """
+
+        global MLOCK_NOTIFY_WAIT_INTERVAL
+
+        if self._fair:
+
+            result = await self._cache.run_script(
+                self._fair_lock_script,
+                [self._lock_tag, self._queue_tag, self._queue_seen_tag, self._fence_tag],
+                [self._lock_val, self._expire, Utils.timestamp(True), MLOCK_NOTIFY_WAIT_INTERVAL * 3000]
+            )
+
+        else:
+
+            result = await self._cache.run_script(
+                self._lock_script, [self._lock_tag, self._fence_tag], [self._lock_val, self._expire]
+            )
+
+        return int(result) if result else 0
+
+    async def _give_up(self):
+
+        if self._fair:
+            await self._leave_queue()
+
+    def _start_watchdog(self):
+
+        if self._watchdog and self._watchdog_task is None:
+            self._watchdog_task = Utils.create_task(self._watchdog_loop())
+
+    def _stop_watchdog(self):
+
+        if self._watchdog_task is not None:
+            self._watchdog_task.cancel()
+            self._watchdog_task = None
+
+    async def _watchdog_loop(self):
+
+        async for index in AsyncCirculatorForSecond(interval=self._expire / 3):
+
+            if index == 1:
+                continue
+
+            try:
+
+                if not await self.renew():
+                    Utils.log.warning(f'lock lease lost: {self._lock_tag}')
+                    break
+
+            except Exception as err:
+
+                Utils.log.exception(err)
+
+        self._watchdog_task = None
+
+    async def _leave_queue(self):
+
+        await self._cache.zrem(self._queue_tag, self._lock_val)
+        await self._cache._hdel(self._queue_seen_tag, self._lock_val)
+
+    async def acquire(self, timeout=0):
+        """获取锁，成功时返回fencing token(大于0)，失败时返回0
+        """
+
+        if self._locked:
+
+            await self.renew()
+
+        else:
+
+            expire_time = Utils.loop_time() + timeout
+
+            marked = False
+
+            while True:
+
+                # 非阻塞的尝试获取不订阅释放通知
+                waiter = self._watch() if timeout > 0 else None
+
+                try:
+
+                    if marked:
+                        await self._mark_waiting()
+
+                    token = await self._try_acquire()
+
+                    if token:
+                        self._locked = True
+                        self._fencing_token = token
+
+                    if self._locked or timeout == 0 or expire_time <= Utils.loop_time():
+                        break
+
+                    if marked:
+                        await self._wait_release(waiter, expire_time)
+                    else:
+                        # 首次失败后登记等待标记并立即重试，登记之前发生的释放不会被错过
+                        marked = True
+
+                finally:
+
+                    self._unwatch(waiter)
+
+            if self._locked:
+                self._start_watchdog()
+            else:
+                await self._give_up()
+
+        return self._fencing_token if self._locked else 0
+
+    async def wait(self, timeout=0):
+
+        expire_time = (Utils.loop_time() + timeout) if timeout > 0 else 0
+
+        while True:
+
+            waiter = self._watch()
+
+            try:
+
+                await self._mark_waiting()
+
+                if not await self.exists():
+                    return True
+
+                if 0 < expire_time <= Utils.loop_time():
+                    return False
+
+                await self._wait_release(waiter, expire_time)
+
+            finally:
+
+                self._unwatch(waiter)
+
+    async def renew(self):
+
+        if self._locked:
+
+            if await self._cache.run_script(self._renew_script, [self._lock_tag], [self._lock_val, self._expire]):
+                self._locked = True
+            else:
+                self._locked = False
 
-    async def rpush(self, key, value, *values):
+        return self._locked
 
-        _value = self._val_encode(value)
-        _values = [self._val_encode(val) for val in values]
+    async def _unlock(self):
+        """释放锁，返回是否存在等待者
+        """
 
-        result = await super().rpush(key, _value, *_values)
+        result = await self._cache.run_script(
+            self._release_script, [self._lock_tag, self._waiting_tag], [self._lock_val]
+        )
 
-        return result
+        return int(result or 0) > 1
 
-    def _rpush(self, key, value, *values):
+    async def release(self):
 
-        return super().rpush(key, value, *values)
+        self._stop_watchdog()
 
-    async def rpushx(self, key, value):
+        if self._locked:
 
-        _value = self._val_encode(value)
+            waiting = await self._unlock()
+            self._locked = False
 
-        result = await super().rpushx(key, _value)
+            if waiting and self._notifier is not None:
+                await self._notifier.notify(self._lock_tag)
 
-        return result
 
-    def _rpushx(self, key, value):
+class MRWLock(MLock):
+    """基于Redis实现的分布式读写锁，使用with进行上下文管理
 
-        return super().rpushx(key, value)
+    读锁之间共享，写锁独占；写锁等待时阻止新的读锁进入，避免写锁饥饿
 
+    读锁持有者记录在有序集合中(分值为租约到期毫秒时间戳)，进程崩溃后租约到期自动清理
 
-class MLock(AsyncContextManager):
-    """基于Redis实现的分布式锁，使用with进行上下文管理
     """
 
-    _renew_script = '''
-if redis.call("get",KEYS[1]) == ARGV[1] and redis.call("ttl",KEYS[1]) > 0 then
-    return redis.call("expire",KEYS[1],ARGV[2])
+    _read_lock_script = '''
+redis.call("zremrangebyscore",KEYS[2],"-inf",ARGV[3])
+if redis.call("exists",KEYS[1]) == 1 or redis.call("exists",KEYS[4]) == 1 then
+    return 0
+end
+redis.call("zadd",KEYS[2],tonumber(ARGV[3]) + tonumber(ARGV[2]) * 1000,ARGV[1])
+if redis.call("pttl",KEYS[2]) < tonumber(ARGV[2]) * 1000 then
+    redis.call("pexpire",KEYS[2],tonumber(ARGV[2]) * 1000)
+end
+return redis.call("incr",KEYS[3])
+'''
+
+    _write_lock_script = '''
+redis.call("zremrangebyscore",KEYS[2],"-inf",ARGV[3])
+local wait = redis.call("get",KEYS[4])
+if redis.call("exists",KEYS[1]) == 1 or redis.call("zcard",KEYS[2]) > 0 or (wait and wait ~= ARGV[1]) then
+    if not wait or wait == ARGV[1] then
+        redis.call("set",KEYS[4],ARGV[1],"PX",ARGV[4])
+    end
+    return 0
+end
+redis.call("del",KEYS[4])
+redis.call("set",KEYS[1],ARGV[1],"EX",ARGV[2])
+return redis.call("incr",KEYS[3])
+'''
+
+    _read_renew_script = '''
+if redis.call("zscore",KEYS[1],ARGV[1]) then
+    redis.call("zadd",KEYS[1],tonumber(ARGV[3]) + tonumber(ARGV[2]) * 1000,ARGV[1])
+    if redis.call("pttl",KEYS[1]) < tonumber(ARGV[2]) * 1000 then
+        redis.call("pexpire",KEYS[1],tonumber(ARGV[2]) * 1000)
+    end
+    return 1
 else
     return 0
 end
 '''
 
-    _unlock_script = '''
-if redis.call("get",KEYS[1]) == ARGV[1] then
-    return redis.call("del",KEYS[1])
+    _read_release_script = '''
+if redis.call("zrem",KEYS[1],ARGV[1]) == 1 then
+    return redis.call("exists",KEYS[2]) + 1
 else
     return 0
 end
 '''
 
-    def __init__(self, cache, key, expire):
+    def __init__(self, cache, key, expire, write=False, *, watchdog=False):
 
-        self._cache = cache
-        self._expire = expire
+        super().__init__(cache, key, expire, watchdog=watchdog)
 
-        self._lock_tag = f'process_lock_{key}'
-        self._lock_val = Utils.uuid1().encode()
+        self._write = write
 
-        self._locked = False
+        self._readers_tag = self._gen_helper_tag(r'readers')
+        self._writer_wait_tag = self._gen_helper_tag(r'writer_wait')
 
-    @property
-    def locked(self):
+    @staticmethod
+    def _gen_lock_tag(key):
 
-        return self._locked
+        return f'process_rwlock_{key}'
 
-    async def _context_release(self):
+    @property
+    def write(self):
 
-        await self.release()
+        return self._write
 
     async def exists(self):
 
-        if await self._cache.exists(self._lock_tag):
-            return True
-        else:
-            return False
-
-    async def acquire(self, timeout=0):
-
-        if self._locked:
+        with read_from_primary():
 
-            await self.renew()
+            if self._write:
+                result = await self._cache.exists(self._lock_tag, self._readers_tag)
+            else:
+                result = await self._cache.exists(self._lock_tag)
 
-        else:
+        return bool(result)
 
-            params = {
-                r'key': self._lock_tag,
-                r'value': self._lock_val,
-                r'expire': self._expire,
-                r'exist': StringCommandsMixin.SET_IF_NOT_EXIST,
-            }
+    async def _try_acquire(self):
 
-            async for _ in AsyncCirculator(timeout):
+        global MLOCK_NOTIFY_WAIT_INTERVAL
 
-                if await self._cache._set(**params):
-                    self._locked = True
+        if self._write:
 
-                if self._locked or timeout == 0:
-                    break
+            result = await self._cache.run_script(
+                self._write_lock_script,
+                [self._lock_tag, self._readers_tag, self._fence_tag, self._writer_wait_tag],
+                [self._lock_val, self._expire, Utils.timestamp(True), MLOCK_NOTIFY_WAIT_INTERVAL * 3000]
+            )
 
-        return self._locked
+        else:
 
-    async def wait(self, timeout=0):
+            result = await self._cache.run_script(
+                self._read_lock_script,
+                [self._lock_tag, self._readers_tag, self._fence_tag, self._writer_wait_tag],
+                [self._lock_val, self._expire, Utils.timestamp(True)]
+            )
 
-        async for _ in AsyncCirculator(timeout):
+        return int(result) if result else 0
 
-            if not await self.exists():
-                return True
-        else:
+    async def _give_up(self):
 
-            return False
+        if self._write:
+            await self._cache.run_script(self._unlock_script, [self._writer_wait_tag], [self._lock_val])
 
     async def renew(self):
 
         if self._locked:
 
-            if await self._cache.eval(self._renew_script, [self._lock_tag], [self._lock_val, self._expire]):
-                self._locked = True
+            if self._write:
+                result = await self._cache.run_script(
+                    self._renew_script, [self._lock_tag], [self._lock_val, self._expire]
+                )
             else:
-                self._locked = False
+                result = await self._cache.run_script(
+                    self._read_renew_script, [self._readers_tag], [self._lock_val, self._expire, Utils.timestamp(True)]
+                )
+
+            self._locked = bool(result)
 
         return self._locked
 
-    async def release(self):
+    async def _unlock(self):
 
-        if self._locked:
-            await self._cache.eval(self._unlock_script, [self._lock_tag], [self._lock_val])
-            self._locked = False
+        if self._write:
+            return await super()._unlock()
+
+        result = await self._cache.run_script(
+            self._read_release_script, [self._readers_tag, self._waiting_tag], [self._lock_val]
+        )
+
+        return int(result or 0) > 1
 
 
 class ShareCache(AsyncContextManager):
@@ -1013,15 +3638,24 @@ class ShareCache(AsyncContextManager):
 
     基于分布式锁实现的一个缓存共享逻辑，保证在分布式环境下，同一时刻业务逻辑只执行一次，其运行结果会通过缓存被共享
 
+    设置soft_ttl后，缓存值会附带软过期时间和上次计算耗时：软过期后(以及按XFetch算法提前概率性地)
+    由获得锁的调用方返回None并重新计算，其余调用方继续使用旧值，避免热点键过期时的请求堆积
+
     """
 
-    def __init__(self, cache, ckey):
+    _ENVELOPE_TAG = r'__share_cache__'
+
+    def __init__(self, cache, ckey, soft_ttl=0, beta=1.0):
 
         self._cache = cache
         self._ckey = ckey
 
+        self._soft_ttl = soft_ttl
+        self._beta = beta
+
         self._locker = None
         self._locked = False
+        self._compute_start = 0
 
         self.result = None
 
@@ -1029,23 +3663,64 @@ class ShareCache(AsyncContextManager):
 
         await self.release()
 
+    def _unpack(self, value):
+
+        if isinstance(value, dict) and value.get(self._ENVELOPE_TAG):
+            return value[r'value'], value[r'soft_expire'], value[r'delta']
+        else:
+            return value, None, 0
+
+    def _need_refresh(self, soft_expire, delta):
+
+        # XFetch：计算耗时越长、越接近软过期时间，提前刷新的概率越高
+        gap = -delta * self._beta * Utils.math.log(1 - Utils.random.random())
+
+        return Utils.timestamp(True) + gap >= soft_expire
+
+    async def _acquire(self):
+
+        self._locker = self._cache.allocate_lock(self._ckey)
+        self._locked = bool(await self._locker.acquire())
+
+        if self._locked:
+            self._compute_start = Utils.loop_time()
+
+        return self._locked
+
     async def get(self):
 
-        result = await self._cache.get(self._ckey)
+        result, soft_expire, delta = self._unpack(await self._cache.get(self._ckey))
 
         if result is None:
 
-            self._locker = self._cache.allocate_lock(self._ckey)
-            self._locked = await self._locker.acquire()
+            if not await self._acquire():
 
-            if not self._locked:
                 await self._locker.wait()
-                result = await self._cache.get(self._ckey)
+
+                with read_from_primary():
+                    result, _, _ = self._unpack(await self._cache.get(self._ckey))
+
+        elif soft_expire is not None and self._need_refresh(soft_expire, delta):
+
+            # 只有获得锁的调用方负责刷新，其余调用方继续使用旧值
+            if await self._acquire():
+                result = None
 
         return result
 
     async def set(self, value, expire=0):
 
+        if self._soft_ttl > 0:
+
+            delta = int((Utils.loop_time() - self._compute_start) * 1000) if self._compute_start > 0 else 0
+
+            value = {
+                self._ENVELOPE_TAG: 1,
+                r'value': value,
+                r'soft_expire': Utils.timestamp(True) + int(self._soft_ttl * 1000),
+                r'delta': delta,
+            }
+
         result = await self._cache.set(self._ckey, value, expire)
 
         return result
@@ -1060,3 +3735,378 @@ class ShareCache(AsyncContextManager):
                 await self._locker.release()
 
         self._cache = self._locker = None
+
+
+class ChunkedValue:
+    """大对象分块存储
+
+    序列化数据按chunk_size切分为多个数据块，每块单独压缩，通过pipeline批量读写，避免单个大值长时间阻塞Redis
+
+    清单(manifest)保存在键本身，数据块键名包含版本号；写入时先写数据块再原子替换清单，
+    读取方不会读到写了一半的数据，旧版本数据块保留REDIS_CHUNK_EXPIRE_GRACE秒供进行中的读取使用
+
+    """
+
+    _MANIFEST_TAG = r'__chunked_value__'
+
+    def __init__(self, cache, key, *, chunk_size=None, batch_size=None, compress=True):
+
+        global REDIS_CHUNK_SIZE, REDIS_CHUNK_BATCH_SIZE
+
+        # 分片模式下数据块与清单保存在同一节点
+        self._cache = cache.get_node_client(key) if isinstance(cache, ShardedCacheClient) else cache
+        self._key = key
+
+        self._chunk_size = chunk_size if chunk_size else REDIS_CHUNK_SIZE
+        self._batch_size = batch_size if batch_size else REDIS_CHUNK_BATCH_SIZE
+
+        self._compress = compress
+
+    def _chunk_key(self, version, index):
+
+        return f'{self._key}_chunk_{version}_{index}'
+
+    def _chunk_keys(self, manifest):
+
+        return [self._chunk_key(manifest[r'version'], index) for index in range(manifest[r'count'])]
+
+    async def get_manifest(self):
+
+        manifest = await self._cache.get(self._key)
+
+        if isinstance(manifest, dict) and manifest.get(self._MANIFEST_TAG):
+            return manifest
+        else:
+            return None
+
+    async def set(self, value, expire=0):
+
+        global REDIS_CHUNK_EXPIRE_GRACE
+
+        value_codec = self._cache.value_codec
+
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            codec = r'raw'
+            stream = memoryview(value)
+        else:
+            codec = value_codec.default
+            stream = memoryview(value_codec.get_codec(codec).encode(value))
+
+        _expire = expire if expire > 0 else self._cache.default_expire
+
+        version = Utils.uuid1()
+        count = max(1, -(-len(stream) // self._chunk_size))
+
+        for start in range(0, count, self._batch_size):
+
+            pipe = self._cache.pipeline()
+
+            for index in range(start, min(start + self._batch_size, count)):
+
+                chunk = stream[index * self._chunk_size:(index + 1) * self._chunk_size]
+                chunk = Utils.zlib_compress(chunk) if self._compress else bytes(chunk)
+
+                pipe._set(
+                    self._chunk_key(version, index), chunk,
+                    expire=(_expire + REDIS_CHUNK_EXPIRE_GRACE) if _expire > 0 else 0
+                )
+
+            await pipe.execute()
+
+        manifest = {
+            self._MANIFEST_TAG: 1,
+            r'version': version,
+            r'codec': codec,
+            r'size': len(stream),
+            r'count': count,
+            r'chunk_size': self._chunk_size,
+            r'compressed': self._compress,
+        }
+
+        # 原子替换清单并设置有效期，切换到新版本，避免替换后设置有效期前失败留下永不过期的清单
+        if _expire > 0:
+            tr = self._cache.multi_exec()
+            tr.getset(self._key, manifest)
+            tr.expire(self._key, _expire)
+            old_manifest, _ = await tr.execute()
+        else:
+            old_manifest = await self._cache.getset(self._key, manifest)
+
+        if isinstance(old_manifest, dict) and old_manifest.get(self._MANIFEST_TAG):
+            await self._expire_chunks(old_manifest, REDIS_CHUNK_EXPIRE_GRACE)
+
+        return manifest
+
+    async def _expire_chunks(self, manifest, seconds):
+
+        global REDIS_DELETE_BATCH_SIZE
+
+        keys = self._chunk_keys(manifest)
+
+        for start in range(0, len(keys), REDIS_DELETE_BATCH_SIZE):
+
+            pipe = self._cache.pipeline()
+
+            for key in keys[start:start + REDIS_DELETE_BATCH_SIZE]:
+                if seconds > 0:
+                    pipe.expire(key, seconds)
+                else:
+                    pipe.unlink(key)
+
+            await pipe.execute()
+
+    async def iter_chunks(self, manifest=None):
+        """按顺序返回解压后的数据块，数据块缺失时抛出RedisChunkMissing
+        """
+
+        if manifest is None:
+            manifest = await self.get_manifest()
+
+        if manifest is None:
+            return
+
+        keys = self._chunk_keys(manifest)
+
+        for start in range(0, len(keys), self._batch_size):
+
+            pipe = self._cache.pipeline()
+
+            for key in keys[start:start + self._batch_size]:
+                pipe._get(key)
+
+            for key, chunk in zip(keys[start:start + self._batch_size], await pipe.execute()):
+
+                if chunk is None:
+                    raise RedisChunkMissing(key)
+
+                yield Utils.zlib_decompress(chunk) if manifest[r'compressed'] else chunk
+
+    async def read_into(self, buffer, manifest=None):
+        """将数据读入预先分配的缓冲区，返回数据长度，不存在时返回None
+        """
+
+        if manifest is None:
+            manifest = await self.get_manifest()
+
+        if manifest is None:
+            return None
+
+        view = memoryview(buffer)
+
+        if len(view) < manifest[r'size']:
+            raise ValueError(f'Buffer too small: {len(view)} < {manifest[r"size"]}')
+
+        offset = 0
+
+        async for chunk in self.iter_chunks(manifest):
+            view[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+
+        return offset
+
+    async def get(self):
+
+        manifest = await self.get_manifest()
+
+        if manifest is None:
+            return None
+
+        buffer = bytearray(manifest[r'size'])
+
+        await self.read_into(buffer, manifest)
+
+        if manifest[r'codec'] == r'raw':
+            return bytes(buffer)
+        else:
+            return self._cache.value_codec.get_codec(manifest[r'codec']).decode(buffer)
+
+    async def delete(self):
+
+        manifest = await self.get_manifest()
+
+        result = await self._cache.delete(self._key)
+
+        if manifest is not None:
+            await self._expire_chunks(manifest, 0)
+
+        return result
+
+
+class LocalCounter:
+    """本地聚合计数器
+
+    计数增量先在进程内聚合，数量达到flush_size或者每隔flush_interval秒，通过pipeline批量写入Redis
+
+    field为None时使用INCRBY，否则使用HINCRBY
+
+    """
+
+    def __init__(self, redis_pool, *, flush_size=0x400, flush_interval=1, expire=0):
+
+        self._redis_pool = redis_pool
+
+        self._flush_size = flush_size
+        self._expire = expire
+
+        self._deltas = {}
+        self._flushing = {}
+
+        self._flush_task = None
+
+        self._task = Utils.create_task(self._run(flush_interval))
+
+    @property
+    def size(self):
+
+        return len(self._deltas)
+
+    async def _run(self, interval):
+
+        async for _ in AsyncCirculatorForSecond(interval=interval):
+            await self.flush()
+
+    def incr(self, key, val=1, field=None):
+
+        _key = (key, field)
+
+        res = self._deltas.get(_key, 0) + val
+
+        self._deltas[_key] = res
+
+        if len(self._deltas) >= self._flush_size and self._flush_task is None:
+            self._flush_task = Utils.create_task(self._flush())
+
+        return res
+
+    def decr(self, key, val=1, field=None):
+
+        return self.incr(key, -val, field)
+
+    def get_delta(self, key, field=None):
+        """获取尚未写入Redis的本地增量，包括正在写入中的增量
+        """
+
+        _key = (key, field)
+
+        return self._deltas.get(_key, 0) + self._flushing.get(_key, 0)
+
+    async def get(self, key, field=None, *, local=False):
+        """读取计数，local为True时包括本地尚未写入的增量
+        """
+
+        # 不使用上下文管理，读取异常需要抛出给调用方
+        cache = self._redis_pool.get_client()
+
+        try:
+            if field is None:
+                result = await cache._get(key)
+            else:
+                result = await cache._hget(key, field)
+        finally:
+            await cache.release()
+
+        result = int(result) if result else 0
+
+        if local:
+            result += self.get_delta(key, field)
+
+        return result
+
+    async def flush(self):
+
+        if self._flush_task is None and self._deltas:
+            self._flush_task = Utils.create_task(self._flush())
+
+        # 写入任务不随调用方取消，避免增量丢失
+        if self._flush_task is not None:
+            await asyncio.shield(self._flush_task)
+
+    async def _flush(self):
+
+        self._flushing, self._deltas = self._deltas, {}
+
+        # 不使用上下文管理，避免异常被吞掉导致增量丢失
+        cache = self._redis_pool.get_client()
+
+        try:
+
+            pipes = {}
+
+            for _key, val in self._flushing.items():
+
+                if val == 0:
+                    continue
+
+                key, field = _key
+
+                client = cache.get_node_client(key) if isinstance(cache, ShardedCacheClient) else cache
+
+                pipe, futures = pipes.get(client, (None, None))
+
+                if pipe is None:
+                    pipe, futures = pipes[client] = (client.pipeline(), [])
+
+                if field is None:
+                    futures.append((_key, pipe.incrby(key, val)))
+                else:
+                    futures.append((_key, pipe.hincrby(key, field, val)))
+
+                if self._expire > 0:
+                    pipe.expire(key, self._expire)
+
+            for pipe, futures in pipes.values():
+
+                try:
+
+                    await pipe.execute(return_exceptions=True)
+
+                except Exception as err:
+
+                    # 连接异常时整个pipeline的执行结果未知，全部合并回本地等待下次写入
+                    self._merge_back(_key for _key, _ in futures)
+
+                    Utils.log.exception(err)
+
+                else:
+
+                    # 只合并回执行失败的增量，避免已写入的增量被重复计数
+                    for _key, future in futures:
+
+                        err = future.exception()
+
+                        if err is None:
+                            self._flushing.pop(_key, None)
+                        else:
+                            self._merge_back((_key,))
+                            Utils.log.error(f'local counter flush failed: {_key} {err}')
+
+        except Exception as err:
+
+            self._merge_back(list(self._flushing))
+
+            Utils.log.exception(err)
+
+        finally:
+
+            await cache.release()
+
+            self._flushing = {}
+            self._flush_task = None
+
+    def _merge_back(self, keys):
+
+        for _key in keys:
+            self._deltas[_key] = self._deltas.get(_key, 0) + self._flushing.pop(_key, 0)
+
+    async def close(self):
+
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        # 第一次等待进行中的写入完成，第二次写入期间新产生的增量
+        await self.flush()
+        await self.flush()
+
+        if self._deltas:
+            Utils.log.warning(f'local counter closed with {len(self._deltas)} unflushed deltas')
@@ -0,0 +1,1872 @@
+import asyncio
+import fnmatch
+import hashlib
+import inspect
+import random
+import time
+
+from pynaja.cache.redis import MLock, MRWLock, NearCache
+from pynaja.common.async_base import Utils
+
+# 过期键的主动清理间隔(秒)
+RESP_SERVER_EXPIRE_SWEEP_INTERVAL = 1
+
+# 写缓冲区超过该字节数时等待发送，避免慢客户端占用过多内存
+RESP_SERVER_WRITE_BUFFER_LIMIT = 0x10000
+
+
+class RespError(Exception):
+    """RESP错误回复
+    """
+
+    def __init__(self, message):
+
+        super().__init__(message)
+
+        self.message = message
+
+
+class _Status(bytes):
+    """RESP简单字符串回复
+    """
+
+
+class _Multi(list):
+    """多条顶层回复，用于订阅类命令
+    """
+
+
+class _NullArray:
+    """RESP空数组回复，用于事务被WATCH中断
+    """
+
+
+RESP_OK = _Status(b'OK')
+RESP_QUEUED = _Status(b'QUEUED')
+RESP_PONG = _Status(b'PONG')
+
+_NO_REPLY = object()
+
+
+class ZSet(dict):
+    """有序集合，成员到分值的映射，排序在读取时进行
+    """
+
+    def ordered(self):
+
+        return sorted(self.items(), key=lambda item: (item[1], item[0]))
+
+
+class _Database:
+    """内存数据库，惰性检查过期时间，写操作更新键版本用于WATCH
+    """
+
+    def __init__(self):
+
+        self.data = {}
+        self.expires = {}
+        self.versions = {}
+        self.list_waiters = {}
+
+        self.epoch = 0
+
+    def touch(self, key):
+
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    def version(self, key):
+
+        return self.epoch, self.versions.get(key, 0)
+
+    def _expired(self, key):
+
+        expire_time = self.expires.get(key)
+
+        if expire_time is not None and expire_time <= _now_ms():
+            self.delete(key)
+            return True
+
+        return False
+
+    def exists(self, key):
+
+        return key in self.data and not self._expired(key)
+
+    def get(self, key, _type=None):
+
+        if key not in self.data or self._expired(key):
+            return None
+
+        value = self.data[key]
+
+        if _type is not None and type(value) is not _type:
+            raise RespError(r'WRONGTYPE Operation against a key holding the wrong kind of value')
+
+        return value
+
+    def get_or_create(self, key, _type):
+
+        value = self.get(key, _type)
+
+        if value is None:
+            value = self.data[key] = _type()
+
+        return value
+
+    def set(self, key, value, keep_ttl=False):
+
+        self.data[key] = value
+
+        if not keep_ttl:
+            self.expires.pop(key, None)
+
+        self.touch(key)
+
+    def delete(self, key):
+
+        if key in self.data:
+
+            del self.data[key]
+
+            self.expires.pop(key, None)
+            self.touch(key)
+
+            return True
+
+        return False
+
+    def drop_if_empty(self, key):
+
+        value = self.data.get(key)
+
+        if value is not None and len(value) == 0:
+            self.delete(key)
+
+    def flush(self):
+
+        self.data.clear()
+        self.expires.clear()
+        self.versions.clear()
+
+        self.epoch += 1
+
+    def sweep(self):
+
+        now_ms = _now_ms()
+
+        for key in [key for key, expire_time in self.expires.items() if expire_time <= now_ms]:
+            self.delete(key)
+
+
+class _Connection:
+
+    def __init__(self, writer):
+
+        self.writer = writer
+
+        self.db = 0
+
+        self.channels = set()
+        self.patterns = set()
+
+        self.multi = None
+        self.watches = {}
+
+    @property
+    def subscribed(self):
+
+        return len(self.channels) + len(self.patterns)
+
+
+def _now_ms():
+
+    return int(time.time() * 1000)
+
+
+def _int(val):
+
+    try:
+        return int(val)
+    except ValueError as _:
+        raise RespError(r'ERR value is not an integer or out of range')
+
+
+def _arity_error(name):
+
+    return RespError(f'ERR wrong number of arguments for `{name}` command')
+
+
+def _float(val):
+
+    try:
+        return float(val)
+    except ValueError as _:
+        raise RespError(r'ERR value is not a valid float')
+
+
+def _format_float(val):
+
+    return (str(int(val)) if float(val).is_integer() else repr(val)).encode()
+
+
+def _range(length, start, stop):
+
+    if start < 0:
+        start = max(0, start + length)
+
+    if stop < 0:
+        stop += length
+
+    stop = min(stop, length - 1)
+
+    return start, stop + 1
+
+
+def _score_bound(val):
+
+    val = val.lower()
+
+    if val in (b'-inf', b'+inf', b'inf'):
+        return float(val), False
+
+    if val.startswith(b'('):
+        return _float(val[1:]), True
+
+    return _float(val), False
+
+
+def _scan_hash(item):
+
+    return int.from_bytes(hashlib.blake2b(item, digest_size=8).digest(), r'little') >> 2
+
+
+def _scan(items, cursor, args):
+
+    match = None
+    count = 10
+
+    for index in range(0, len(args) - 1, 2):
+
+        option = args[index].upper()
+
+        if option == b'MATCH':
+            match = args[index + 1]
+        elif option == b'COUNT':
+            count = _int(args[index + 1])
+
+    cursor = _int(cursor)
+    count = max(count, 1)
+
+    # 按元素哈希值的顺序遍历，游标为下一个哈希值；遍历期间删除其他元素不会导致遗漏，与Redis的SCAN保证一致
+    ordered = sorted((_scan_hash(item), item) for item in items)
+    ordered = [(_hash, item) for _hash, item in ordered if _hash >= cursor]
+
+    end = min(count, len(ordered))
+
+    # 哈希值相同的元素在同一批次返回
+    while 0 < end < len(ordered) and ordered[end][0] == ordered[end - 1][0]:
+        end += 1
+
+    batch = [item for _, item in ordered[:end]]
+
+    cursor = (ordered[end - 1][0] + 1) if end < len(ordered) else 0
+
+    if match is not None:
+        batch = [item for item in batch if fnmatch.fnmatchcase(item, match)]
+
+    return cursor, batch
+
+
+def encode_reply(reply):
+    """将回复编码为RESP协议数据
+    """
+
+    if isinstance(reply, RespError):
+        return b'-' + reply.message.encode() + b'\r\n'
+
+    if isinstance(reply, _Status):
+        return b'+' + bytes(reply) + b'\r\n'
+
+    if reply is None:
+        return b'$-1\r\n'
+
+    if isinstance(reply, _NullArray):
+        return b'*-1\r\n'
+
+    if isinstance(reply, bool):
+        return b':1\r\n' if reply else b':0\r\n'
+
+    if isinstance(reply, int):
+        return b':%d\r\n' % reply
+
+    if isinstance(reply, float):
+        reply = _format_float(reply)
+    elif isinstance(reply, str):
+        reply = reply.encode()
+
+    if isinstance(reply, (bytes, bytearray)):
+        return b'$%d\r\n%s\r\n' % (len(reply), reply)
+
+    if isinstance(reply, _Multi):
+        return b''.join(encode_reply(item) for item in reply)
+
+    return b'*%d\r\n' % len(reply) + b''.join(encode_reply(item) for item in reply)
+
+
+class RespServer:
+    """进程内RESP协议服务
+
+    基于asyncio实现的轻量Redis替身，支持字符串、哈希、列表、集合、有序集合、过期时间、事务和发布订阅，
+    用于在没有Redis的环境中测试和压测Redis功能组件
+
+    EVAL/EVALSHA不包含Lua解释器，只支持通过register_script注册了Python实现的脚本(默认注册了内置的锁脚本和近端缓存脚本)
+
+    server = await RespServer().start()
+    await RedisDelegate().async_init_redis(server.address)
+
+    """
+
+    def __init__(self, host=r'127.0.0.1', port=0, *, databases=16, password=None):
+
+        self._host = host
+        self._port = port
+        self._password = password
+
+        self._databases = [_Database() for _ in range(databases)]
+
+        self._channels = {}
+        self._patterns = {}
+
+        self._scripts = {}
+        self._script_funcs = {}
+
+        self._server = None
+        self._sweep_task = None
+
+        self._connections = set()
+
+        self._commands = {
+            name[5:].upper().encode(): getattr(self, name)
+            for name in dir(self) if name.startswith(r'_cmd_')
+        }
+
+        # 分发前按命令签名校验参数数量，避免把命令内部的TypeError误报为参数数量错误
+        self._signatures = {name: inspect.signature(func) for name, func in self._commands.items()}
+
+        self._register_builtin_scripts()
+
+    @property
+    def address(self):
+
+        return self._host, self._port
+
+    async def start(self):
+
+        self._server = await asyncio.start_server(self._handle_connection, self._host, self._port)
+
+        self._port = self._server.sockets[0].getsockname()[1]
+
+        self._sweep_task = Utils.create_task(self._sweep())
+
+        Utils.log.info(f'resp server started: {self._host}:{self._port}')
+
+        return self
+
+    async def close(self):
+
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+
+        if self._server is not None:
+
+            self._server.close()
+
+            for writer in list(self._connections):
+                writer.close()
+
+            await self._server.wait_closed()
+
+            self._server = None
+
+    async def _sweep(self):
+
+        global RESP_SERVER_EXPIRE_SWEEP_INTERVAL
+
+        while True:
+
+            await Utils.sleep(RESP_SERVER_EXPIRE_SWEEP_INTERVAL)
+
+            for database in self._databases:
+                database.sweep()
+
+    def register_script(self, source, func):
+        """注册脚本的Python实现，func(call, keys, args)，call的用法与redis.call相同
+        """
+
+        digest = hashlib.sha1(Utils.utf8(source)).hexdigest()
+
+        self._script_funcs[digest] = func
+
+        return digest
+
+    # CONNECTION
+
+    async def _read_command(self, reader):
+
+        line = await reader.readline()
+
+        if not line:
+            return None
+
+        if line[:1] != b'*':
+            return line.split()
+
+        args = []
+
+        for _ in range(int(line[1:-2])):
+            header = await reader.readline()
+            args.append((await reader.readexactly(int(header[1:-2]) + 2))[:-2])
+
+        return args
+
+    async def _handle_connection(self, reader, writer):
+
+        global RESP_SERVER_WRITE_BUFFER_LIMIT
+
+        conn = _Connection(writer)
+
+        self._connections.add(writer)
+
+        try:
+
+            while True:
+
+                args = await self._read_command(reader)
+
+                if args is None:
+                    break
+
+                if not args:
+                    continue
+
+                reply = await self._execute(conn, args)
+
+                if reply is _NO_REPLY:
+                    continue
+
+                writer.write(encode_reply(reply))
+
+                if writer.transport.get_write_buffer_size() > RESP_SERVER_WRITE_BUFFER_LIMIT:
+                    await writer.drain()
+
+                if args[0].upper() == b'QUIT':
+                    break
+
+        except (ConnectionError, asyncio.IncompleteReadError) as _:
+
+            pass
+
+        finally:
+
+            self._remove_subscriber(conn)
+            self._connections.discard(writer)
+
+            writer.close()
+
+    async def _execute(self, conn, args):
+
+        name = args[0].upper()
+
+        if conn.multi is not None and name not in (b'EXEC', b'DISCARD', b'MULTI', b'WATCH'):
+
+            if name not in self._commands:
+                return RespError(f'ERR unknown command `{Utils.basestring(args[0])}`')
+
+            conn.multi.append(args)
+
+            return RESP_QUEUED
+
+        return await self._call(conn, name, args[1:])
+
+    async def _call(self, conn, name, args):
+
+        func = self._commands.get(name)
+
+        if func is None:
+            return RespError(f'ERR unknown command `{Utils.basestring(name)}`')
+
+        try:
+
+            self._check_arity(name, args)
+
+            result = func(conn, *args)
+
+            if asyncio.iscoroutine(result):
+                result = await result
+
+            return result
+
+        except RespError as err:
+
+            return err
+
+        except Exception as err:
+
+            Utils.log.exception(err)
+
+            return RespError(f'ERR {err}')
+
+    def _check_arity(self, name, args):
+
+        try:
+            self._signatures[name].bind(None, *args)
+        except TypeError as _:
+            raise _arity_error(Utils.basestring(name).lower())
+
+    def _db(self, conn):
+
+        return self._databases[conn.db]
+
+    def _cmd_ping(self, conn, message=None):
+
+        if conn.subscribed:
+            return [b'pong', message or b'']
+
+        return RESP_PONG if message is None else message
+
+    def _cmd_echo(self, conn, message):
+
+        return message
+
+    def _cmd_select(self, conn, index):
+
+        index = _int(index)
+
+        if not (0 <= index < len(self._databases)):
+            raise RespError(r'ERR DB index is out of range')
+
+        conn.db = index
+
+        return RESP_OK
+
+    def _cmd_auth(self, conn, *args):
+
+        if self._password is None:
+            raise RespError(r'ERR Client sent AUTH, but no password is set')
+
+        if Utils.utf8(args[-1]) != Utils.utf8(self._password):
+            raise RespError(r'ERR invalid password')
+
+        return RESP_OK
+
+    def _cmd_quit(self, conn):
+
+        return RESP_OK
+
+    def _cmd_client(self, conn, *args):
+
+        return RESP_OK
+
+    def _cmd_time(self, conn):
+
+        now = time.time()
+
+        return [str(int(now)).encode(), str(int(now % 1 * 1000000)).encode()]
+
+    def _cmd_info(self, conn, *args):
+
+        return f'# Server\r\nredis_version:5.0.0\r\nredis_mode:standalone\r\n' \
+               f'# Keyspace\r\ndb{conn.db}:keys={len(self._db(conn).data)}\r\n'
+
+    def _cmd_dbsize(self, conn):
+
+        return len(self._db(conn).data)
+
+    def _cmd_flushdb(self, conn, *args):
+
+        self._db(conn).flush()
+
+        return RESP_OK
+
+    def _cmd_flushall(self, conn, *args):
+
+        for database in self._databases:
+            database.flush()
+
+        return RESP_OK
+
+    # GENERIC
+
+    def _cmd_del(self, conn, key, *keys):
+
+        db = self._db(conn)
+
+        return sum(1 for _key in (key,) + keys if db.exists(_key) and db.delete(_key))
+
+    _cmd_unlink = _cmd_del
+
+    def _cmd_exists(self, conn, key, *keys):
+
+        db = self._db(conn)
+
+        return sum(1 for _key in (key,) + keys if db.exists(_key))
+
+    def _cmd_type(self, conn, key):
+
+        value = self._db(conn).get(key)
+
+        if value is None:
+            return _Status(b'none')
+
+        return _Status({bytes: b'string', dict: b'hash', list: b'list', set: b'set', ZSet: b'zset'}[type(value)])
+
+    def _cmd_expire(self, conn, key, seconds):
+
+        return self._cmd_pexpire(conn, key, _int(seconds) * 1000)
+
+    def _cmd_pexpire(self, conn, key, milliseconds):
+
+        db = self._db(conn)
+
+        if not db.exists(key):
+            return 0
+
+        db.expires[key] = _now_ms() + _int(milliseconds)
+        db.touch(key)
+
+        return 1
+
+    def _cmd_persist(self, conn, key):
+
+        db = self._db(conn)
+
+        if db.exists(key) and db.expires.pop(key, None) is not None:
+            return 1
+
+        return 0
+
+    def _cmd_pttl(self, conn, key):
+
+        db = self._db(conn)
+
+        if not db.exists(key):
+            return -2
+
+        expire_time = db.expires.get(key)
+
+        return -1 if expire_time is None else max(0, expire_time - _now_ms())
+
+    def _cmd_ttl(self, conn, key):
+
+        result = self._cmd_pttl(conn, key)
+
+        return result if result < 0 else (result + 500) // 1000
+
+    def _cmd_keys(self, conn, pattern):
+
+        db = self._db(conn)
+
+        return [key for key in list(db.data) if fnmatch.fnmatchcase(key, pattern) and db.exists(key)]
+
+    def _cmd_scan(self, conn, cursor, *args):
+
+        db = self._db(conn)
+
+        cursor, keys = _scan(list(db.data), cursor, args)
+
+        return [str(cursor).encode(), [key for key in keys if db.exists(key)]]
+
+    def _cmd_randomkey(self, conn):
+
+        db = self._db(conn)
+
+        keys = [key for key in list(db.data) if db.exists(key)]
+
+        return random.choice(keys) if keys else None
+
+    def _cmd_rename(self, conn, key, newkey):
+
+        db = self._db(conn)
+
+        value = db.get(key)
+
+        if value is None:
+            raise RespError(r'ERR no such key')
+
+        expire_time = db.expires.get(key)
+
+        db.delete(key)
+        db.set(newkey, value)
+
+        if expire_time is not None:
+            db.expires[newkey] = expire_time
+
+        return RESP_OK
+
+    def _cmd_memory(self, conn, subcommand, key=None, *args):
+
+        if subcommand.upper() != b'USAGE':
+            raise RespError(r'ERR unsupported MEMORY subcommand')
+
+        value = self._db(conn).get(key)
+
+        if value is None:
+            return None
+
+        if isinstance(value, bytes):
+            size = len(value)
+        elif isinstance(value, dict):
+            size = sum(len(field) + (len(val) if isinstance(val, bytes) else 8) for field, val in value.items())
+        else:
+            size = sum(len(item) for item in value)
+
+        return size + len(key) + 0x30
+
+    def _cmd_object(self, conn, subcommand, key=None):
+
+        if subcommand.upper() != b'ENCODING':
+            raise RespError(r'ERR unsupported OBJECT subcommand')
+
+        value = self._db(conn).get(key)
+
+        if value is None:
+            return None
+
+        if isinstance(value, bytes):
+            return b'int' if value.lstrip(b'-').isdigit() else b'raw'
+
+        return {dict: b'hashtable', list: b'quicklist', set: b'hashtable', ZSet: b'skiplist'}[type(value)]
+
+    # STRING
+
+    def _cmd_get(self, conn, key):
+
+        return self._db(conn).get(key, bytes)
+
+    def _cmd_set(self, conn, key, value, *args):
+
+        db = self._db(conn)
+
+        expire_ms = None
+        exist = None
+        keep_ttl = False
+
+        index = 0
+
+        while index < len(args):
+
+            option = args[index].upper()
+
+            if option in (b'EX', b'PX'):
+                expire_ms = _int(args[index + 1]) * (1000 if option == b'EX' else 1)
+                index += 1
+            elif option in (b'NX', b'XX'):
+                exist = option
+            elif option == b'KEEPTTL':
+                keep_ttl = True
+            else:
+                raise RespError(r'ERR syntax error')
+
+            index += 1
+
+        if exist == b'NX' and db.exists(key):
+            return None
+
+        if exist == b'XX' and not db.exists(key):
+            return None
+
+        db.set(key, value, keep_ttl)
+
+        if expire_ms is not None:
+            db.expires[key] = _now_ms() + expire_ms
+
+        return RESP_OK
+
+    def _cmd_setex(self, conn, key, seconds, value):
+
+        return self._cmd_set(conn, key, value, b'EX', seconds)
+
+    def _cmd_psetex(self, conn, key, milliseconds, value):
+
+        return self._cmd_set(conn, key, value, b'PX', milliseconds)
+
+    def _cmd_setnx(self, conn, key, value):
+
+        return 1 if self._cmd_set(conn, key, value, b'NX') else 0
+
+    def _cmd_getset(self, conn, key, value):
+
+        result = self._db(conn).get(key, bytes)
+
+        self._db(conn).set(key, value)
+
+        return result
+
+    def _cmd_mget(self, conn, key, *keys):
+
+        db = self._db(conn)
+
+        result = []
+
+        for _key in (key,) + keys:
+            value = db.get(_key)
+            result.append(value if isinstance(value, bytes) else None)
+
+        return result
+
+    def _cmd_mset(self, conn, *pairs):
+
+        if not pairs or len(pairs) % 2:
+            raise _arity_error(r'mset')
+
+        db = self._db(conn)
+
+        for index in range(0, len(pairs), 2):
+            db.set(pairs[index], pairs[index + 1])
+
+        return RESP_OK
+
+    def _cmd_msetnx(self, conn, *pairs):
+
+        if not pairs or len(pairs) % 2:
+            raise _arity_error(r'msetnx')
+
+        db = self._db(conn)
+
+        if any(db.exists(pairs[index]) for index in range(0, len(pairs), 2)):
+            return 0
+
+        self._cmd_mset(conn, *pairs)
+
+        return 1
+
+    def _cmd_incrby(self, conn, key, increment):
+
+        db = self._db(conn)
+
+        value = db.get(key, bytes)
+
+        result = (_int(value) if value is not None else 0) + _int(increment)
+
+        db.set(key, str(result).encode(), True)
+
+        return result
+
+    def _cmd_incr(self, conn, key):
+
+        return self._cmd_incrby(conn, key, 1)
+
+    def _cmd_decrby(self, conn, key, decrement):
+
+        return self._cmd_incrby(conn, key, -_int(decrement))
+
+    def _cmd_decr(self, conn, key):
+
+        return self._cmd_incrby(conn, key, -1)
+
+    def _cmd_incrbyfloat(self, conn, key, increment):
+
+        db = self._db(conn)
+
+        value = db.get(key, bytes)
+
+        result = _format_float((_float(value) if value is not None else 0) + _float(increment))
+
+        db.set(key, result, True)
+
+        return result
+
+    def _cmd_append(self, conn, key, value):
+
+        db = self._db(conn)
+
+        result = (db.get(key, bytes) or b'') + value
+
+        db.set(key, result, True)
+
+        return len(result)
+
+    def _cmd_strlen(self, conn, key):
+
+        return len(self._db(conn).get(key, bytes) or b'')
+
+    def _cmd_getrange(self, conn, key, start, end):
+
+        value = self._db(conn).get(key, bytes) or b''
+
+        start, stop = _range(len(value), _int(start), _int(end))
+
+        return value[start:stop]
+
+    # HASH
+
+    def _cmd_hset(self, conn, key, *pairs):
+
+        if not pairs or len(pairs) % 2:
+            raise _arity_error(r'hset')
+
+        db = self._db(conn)
+
+        value = db.get_or_create(key, dict)
+
+        result = 0
+
+        for index in range(0, len(pairs), 2):
+
+            if pairs[index] not in value:
+                result += 1
+
+            value[pairs[index]] = pairs[index + 1]
+
+        db.touch(key)
+
+        return result
+
+    def _cmd_hmset(self, conn, key, *pairs):
+
+        if not pairs or len(pairs) % 2:
+            raise _arity_error(r'hmset')
+
+        self._cmd_hset(conn, key, *pairs)
+
+        return RESP_OK
+
+    def _cmd_hsetnx(self, conn, key, field, value):
+
+        if field in (self._db(conn).get(key, dict) or {}):
+            return 0
+
+        return self._cmd_hset(conn, key, field, value)
+
+    def _cmd_hget(self, conn, key, field):
+
+        return (self._db(conn).get(key, dict) or {}).get(field)
+
+    def _cmd_hmget(self, conn, key, field, *fields):
+
+        value = self._db(conn).get(key, dict) or {}
+
+        return [value.get(_field) for _field in (field,) + fields]
+
+    def _cmd_hgetall(self, conn, key):
+
+        return [item for pair in (self._db(conn).get(key, dict) or {}).items() for item in pair]
+
+    def _cmd_hkeys(self, conn, key):
+
+        return list(self._db(conn).get(key, dict) or {})
+
+    def _cmd_hvals(self, conn, key):
+
+        return list((self._db(conn).get(key, dict) or {}).values())
+
+    def _cmd_hlen(self, conn, key):
+
+        return len(self._db(conn).get(key, dict) or {})
+
+    def _cmd_hexists(self, conn, key, field):
+
+        return 1 if field in (self._db(conn).get(key, dict) or {}) else 0
+
+    def _cmd_hstrlen(self, conn, key, field):
+
+        return len((self._db(conn).get(key, dict) or {}).get(field, b''))
+
+    def _cmd_hdel(self, conn, key, field, *fields):
+
+        db = self._db(conn)
+
+        value = db.get(key, dict)
+
+        if value is None:
+            return 0
+
+        result = sum(1 for _field in (field,) + fields if value.pop(_field, None) is not None)
+
+        if result:
+            db.touch(key)
+            db.drop_if_empty(key)
+
+        return result
+
+    def _cmd_hincrby(self, conn, key, field, increment):
+
+        db = self._db(conn)
+
+        value = db.get_or_create(key, dict)
+
+        result = _int(value.get(field, 0)) + _int(increment)
+
+        value[field] = str(result).encode()
+
+        db.touch(key)
+
+        return result
+
+    def _cmd_hscan(self, conn, key, cursor, *args):
+
+        value = self._db(conn).get(key, dict) or {}
+
+        cursor, fields = _scan(list(value), cursor, args)
+
+        return [str(cursor).encode(), [item for field in fields for item in (field, value[field])]]
+
+    # LIST
+
+    def _push(self, conn, key, values, left, exist=False):
+
+        db = self._db(conn)
+
+        if exist and not db.exists(key):
+            return 0
+
+        value = db.get_or_create(key, list)
+
+        for item in values:
+            if left:
+                value.insert(0, item)
+            else:
+                value.append(item)
+
+        db.touch(key)
+
+        self._wakeup_list(db, key)
+
+        return len(value)
+
+    def _wakeup_list(self, db, key):
+
+        waiters = db.list_waiters.get(key)
+
+        while waiters:
+
+            waiter = waiters.pop(0)
+
+            if not waiter.done():
+                waiter.set_result(True)
+                break
+
+    def _cmd_lpush(self, conn, key, value, *values):
+
+        return self._push(conn, key, (value,) + values, True)
+
+    def _cmd_rpush(self, conn, key, value, *values):
+
+        return self._push(conn, key, (value,) + values, False)
+
+    def _cmd_lpushx(self, conn, key, value):
+
+        return self._push(conn, key, (value,), True, True)
+
+    def _cmd_rpushx(self, conn, key, value):
+
+        return self._push(conn, key, (value,), False, True)
+
+    def _pop(self, conn, key, left):
+
+        db = self._db(conn)
+
+        value = db.get(key, list)
+
+        if not value:
+            return None
+
+        result = value.pop(0 if left else -1)
+
+        db.touch(key)
+        db.drop_if_empty(key)
+
+        return result
+
+    def _cmd_lpop(self, conn, key):
+
+        return self._pop(conn, key, True)
+
+    def _cmd_rpop(self, conn, key):
+
+        return self._pop(conn, key, False)
+
+    def _cmd_rpoplpush(self, conn, source, destination):
+
+        result = self._pop(conn, source, False)
+
+        if result is not None:
+            self._push(conn, destination, (result,), True)
+
+        return result
+
+    async def _blocking_pop(self, conn, args, left):
+
+        if len(args) < 2:
+            raise _arity_error(r'blpop' if left else r'brpop')
+
+        keys, timeout = args[:-1], _float(args[-1])
+
+        db = self._db(conn)
+
+        expire_time = (Utils.loop_time() + timeout) if timeout > 0 else 0
+
+        while True:
+
+            for key in keys:
+
+                result = self._pop(conn, key, left)
+
+                if result is not None:
+                    return [key, result]
+
+            if 0 < expire_time <= Utils.loop_time():
+                return None
+
+            waiter = asyncio.get_event_loop().create_future()
+
+            for key in keys:
+                db.list_waiters.setdefault(key, []).append(waiter)
+
+            try:
+                await asyncio.wait({waiter}, timeout=(expire_time - Utils.loop_time()) if expire_time else None)
+            finally:
+                for key in keys:
+                    waiters = db.list_waiters.get(key)
+                    if waiters and waiter in waiters:
+                        waiters.remove(waiter)
+
+    def _cmd_blpop(self, conn, *args):
+
+        return self._blocking_pop(conn, args, True)
+
+    def _cmd_brpop(self, conn, *args):
+
+        return self._blocking_pop(conn, args, False)
+
+    def _cmd_lrange(self, conn, key, start, stop):
+
+        value = self._db(conn).get(key, list) or []
+
+        start, stop = _range(len(value), _int(start), _int(stop))
+
+        return value[start:stop]
+
+    def _cmd_lindex(self, conn, key, index):
+
+        value = self._db(conn).get(key, list) or []
+
+        index = _int(index)
+
+        return value[index] if -len(value) <= index < len(value) else None
+
+    def _cmd_llen(self, conn, key):
+
+        return len(self._db(conn).get(key, list) or [])
+
+    def _cmd_lset(self, conn, key, index, value):
+
+        db = self._db(conn)
+
+        _value = db.get(key, list)
+
+        if _value is None:
+            raise RespError(r'ERR no such key')
+
+        index = _int(index)
+
+        if not (-len(_value) <= index < len(_value)):
+            raise RespError(r'ERR index out of range')
+
+        _value[index] = value
+
+        db.touch(key)
+
+        return RESP_OK
+
+    def _cmd_lrem(self, conn, key, count, value):
+
+        db = self._db(conn)
+
+        _value = db.get(key, list)
+
+        if not _value:
+            return 0
+
+        count = _int(count)
+
+        indexes = [index for index, item in enumerate(_value) if item == value]
+
+        if count > 0:
+            indexes = indexes[:count]
+        elif count < 0:
+            indexes = indexes[count:]
+
+        for index in reversed(indexes):
+            del _value[index]
+
+        if indexes:
+            db.touch(key)
+            db.drop_if_empty(key)
+
+        return len(indexes)
+
+    def _cmd_linsert(self, conn, key, where, pivot, value):
+
+        db = self._db(conn)
+
+        _value = db.get(key, list)
+
+        if not _value:
+            return 0
+
+        if pivot not in _value:
+            return -1
+
+        index = _value.index(pivot)
+
+        _value.insert(index if where.upper() == b'BEFORE' else index + 1, value)
+
+        db.touch(key)
+
+        return len(_value)
+
+    def _cmd_ltrim(self, conn, key, start, stop):
+
+        db = self._db(conn)
+
+        value = db.get(key, list)
+
+        if value is not None:
+
+            start, stop = _range(len(value), _int(start), _int(stop))
+
+            value[:] = value[start:stop]
+
+            db.touch(key)
+            db.drop_if_empty(key)
+
+        return RESP_OK
+
+    # SET
+
+    def _cmd_sadd(self, conn, key, member, *members):
+
+        db = self._db(conn)
+
+        value = db.get_or_create(key, set)
+
+        size = len(value)
+
+        value.update((member,) + members)
+
+        db.touch(key)
+
+        return len(value) - size
+
+    def _cmd_srem(self, conn, key, member, *members):
+
+        db = self._db(conn)
+
+        value = db.get(key, set)
+
+        if value is None:
+            return 0
+
+        size = len(value)
+
+        value.difference_update((member,) + members)
+
+        db.touch(key)
+        db.drop_if_empty(key)
+
+        return size - len(value)
+
+    def _cmd_smembers(self, conn, key):
+
+        return list(self._db(conn).get(key, set) or ())
+
+    def _cmd_sismember(self, conn, key, member):
+
+        return 1 if member in (self._db(conn).get(key, set) or ()) else 0
+
+    def _cmd_scard(self, conn, key):
+
+        return len(self._db(conn).get(key, set) or ())
+
+    def _cmd_spop(self, conn, key):
+
+        db = self._db(conn)
+
+        value = db.get(key, set)
+
+        if not value:
+            return None
+
+        result = value.pop()
+
+        db.touch(key)
+        db.drop_if_empty(key)
+
+        return result
+
+    def _cmd_srandmember(self, conn, key, count=None):
+
+        value = list(self._db(conn).get(key, set) or ())
+
+        if count is None:
+            return random.choice(value) if value else None
+
+        count = _int(count)
+
+        if count >= 0:
+            return random.sample(value, min(count, len(value)))
+        else:
+            return [random.choice(value) for _ in range(-count)] if value else []
+
+    def _sets(self, conn, keys):
+
+        return [self._db(conn).get(key, set) or set() for key in keys]
+
+    def _cmd_sdiff(self, conn, key, *keys):
+
+        first, *others = self._sets(conn, (key,) + keys)
+
+        return list(first.difference(*others))
+
+    def _cmd_sinter(self, conn, key, *keys):
+
+        first, *others = self._sets(conn, (key,) + keys)
+
+        return list(first.intersection(*others))
+
+    def _cmd_sunion(self, conn, key, *keys):
+
+        first, *others = self._sets(conn, (key,) + keys)
+
+        return list(first.union(*others))
+
+    def _cmd_sscan(self, conn, key, cursor, *args):
+
+        cursor, members = _scan(list(self._db(conn).get(key, set) or ()), cursor, args)
+
+        return [str(cursor).encode(), members]
+
+    # SORTED SET
+
+    def _cmd_zadd(self, conn, key, *args):
+
+        db = self._db(conn)
+
+        options = set()
+
+        while args and args[0].upper() in (b'NX', b'XX', b'CH'):
+            options.add(args[0].upper())
+            args = args[1:]
+
+        if not args or len(args) % 2:
+            raise _arity_error(r'zadd')
+
+        value = db.get_or_create(key, ZSet)
+
+        result = 0
+
+        for index in range(0, len(args), 2):
+
+            score, member = _float(args[index]), args[index + 1]
+
+            if (b'NX' in options and member in value) or (b'XX' in options and member not in value):
+                continue
+
+            if member not in value or (b'CH' in options and value[member] != score):
+                result += 1
+
+            value[member] = score
+
+        db.touch(key)
+        db.drop_if_empty(key)
+
+        return result
+
+    def _cmd_zincrby(self, conn, key, increment, member):
+
+        db = self._db(conn)
+
+        value = db.get_or_create(key, ZSet)
+
+        value[member] = value.get(member, 0) + _float(increment)
+
+        db.touch(key)
+
+        return _format_float(value[member])
+
+    def _cmd_zrem(self, conn, key, member, *members):
+
+        db = self._db(conn)
+
+        value = db.get(key, ZSet)
+
+        if value is None:
+            return 0
+
+        result = sum(1 for _member in (member,) + members if value.pop(_member, None) is not None)
+
+        if result:
+            db.touch(key)
+            db.drop_if_empty(key)
+
+        return result
+
+    def _cmd_zscore(self, conn, key, member):
+
+        score = (self._db(conn).get(key, ZSet) or {}).get(member)
+
+        return None if score is None else _format_float(score)
+
+    def _cmd_zcard(self, conn, key):
+
+        return len(self._db(conn).get(key, ZSet) or {})
+
+    def _zrange(self, conn, key, start, stop, args, reverse):
+
+        items = (self._db(conn).get(key, ZSet) or ZSet()).ordered()
+
+        if reverse:
+            items.reverse()
+
+        start, stop = _range(len(items), _int(start), _int(stop))
+
+        items = items[start:stop]
+
+        if args and args[0].upper() == b'WITHSCORES':
+            return [item for member, score in items for item in (member, _format_float(score))]
+
+        return [member for member, _ in items]
+
+    def _cmd_zrange(self, conn, key, start, stop, *args):
+
+        return self._zrange(conn, key, start, stop, args, False)
+
+    def _cmd_zrevrange(self, conn, key, start, stop, *args):
+
+        return self._zrange(conn, key, start, stop, args, True)
+
+    def _in_score_range(self, score, _min, _max):
+
+        (min_val, min_exclusive), (max_val, max_exclusive) = _min, _max
+
+        if score < min_val or (min_exclusive and score == min_val):
+            return False
+
+        if score > max_val or (max_exclusive and score == max_val):
+            return False
+
+        return True
+
+    def _cmd_zrangebyscore(self, conn, key, _min, _max, *args):
+
+        _min, _max = _score_bound(_min), _score_bound(_max)
+
+        items = [
+            (member, score) for member, score in (self._db(conn).get(key, ZSet) or ZSet()).ordered()
+            if self._in_score_range(score, _min, _max)
+        ]
+
+        if any(arg.upper() == b'WITHSCORES' for arg in args):
+            return [item for member, score in items for item in (member, _format_float(score))]
+
+        return [member for member, _ in items]
+
+    def _cmd_zcount(self, conn, key, _min, _max):
+
+        return len(self._cmd_zrangebyscore(conn, key, _min, _max))
+
+    def _cmd_zremrangebyscore(self, conn, key, _min, _max):
+
+        db = self._db(conn)
+
+        members = self._cmd_zrangebyscore(conn, key, _min, _max)
+
+        if members:
+
+            value = db.get(key, ZSet)
+
+            for member in members:
+                del value[member]
+
+            db.touch(key)
+            db.drop_if_empty(key)
+
+        return len(members)
+
+    def _cmd_zrank(self, conn, key, member):
+
+        members = [_member for _member, _ in (self._db(conn).get(key, ZSet) or ZSet()).ordered()]
+
+        return members.index(member) if member in members else None
+
+    # TRANSACTION
+
+    def _cmd_multi(self, conn):
+
+        if conn.multi is not None:
+            raise RespError(r'ERR MULTI calls can not be nested')
+
+        conn.multi = []
+
+        return RESP_OK
+
+    def _cmd_discard(self, conn):
+
+        if conn.multi is None:
+            raise RespError(r'ERR DISCARD without MULTI')
+
+        conn.multi = None
+        conn.watches.clear()
+
+        return RESP_OK
+
+    def _cmd_watch(self, conn, key, *keys):
+
+        if conn.multi is not None:
+            raise RespError(r'ERR WATCH inside MULTI is not allowed')
+
+        db = self._db(conn)
+
+        for _key in (key,) + keys:
+            conn.watches[(conn.db, _key)] = db.version(_key)
+
+        return RESP_OK
+
+    def _cmd_unwatch(self, conn):
+
+        conn.watches.clear()
+
+        return RESP_OK
+
+    async def _cmd_exec(self, conn):
+
+        if conn.multi is None:
+            raise RespError(r'ERR EXEC without MULTI')
+
+        commands, conn.multi = conn.multi, None
+
+        watches, conn.watches = conn.watches, {}
+
+        for (index, key), version in watches.items():
+            if self._databases[index].version(key) != version:
+                return _NullArray()
+
+        return [await self._call(conn, args[0].upper(), args[1:]) for args in commands]
+
+    # PUB/SUB
+
+    def _subscribe(self, conn, names, registry, subscriptions, kind):
+
+        result = _Multi()
+
+        for name in names:
+
+            registry.setdefault(name, set()).add(conn)
+            subscriptions.add(name)
+
+            result.append([kind, name, conn.subscribed])
+
+        return result
+
+    def _unsubscribe(self, conn, names, registry, subscriptions, kind):
+
+        result = _Multi()
+
+        for name in (names or list(subscriptions)):
+
+            subscribers = registry.get(name)
+
+            if subscribers is not None:
+
+                subscribers.discard(conn)
+
+                if not subscribers:
+                    del registry[name]
+
+            subscriptions.discard(name)
+
+            result.append([kind, name, conn.subscribed])
+
+        if not result:
+            result.append([kind, None, conn.subscribed])
+
+        return result
+
+    def _remove_subscriber(self, conn):
+
+        self._unsubscribe(conn, None, self._channels, conn.channels, b'unsubscribe')
+        self._unsubscribe(conn, None, self._patterns, conn.patterns, b'punsubscribe')
+
+    def _cmd_subscribe(self, conn, channel, *channels):
+
+        return self._subscribe(conn, (channel,) + channels, self._channels, conn.channels, b'subscribe')
+
+    def _cmd_psubscribe(self, conn, pattern, *patterns):
+
+        return self._subscribe(conn, (pattern,) + patterns, self._patterns, conn.patterns, b'psubscribe')
+
+    def _cmd_unsubscribe(self, conn, *channels):
+
+        return self._unsubscribe(conn, channels, self._channels, conn.channels, b'unsubscribe')
+
+    def _cmd_punsubscribe(self, conn, *patterns):
+
+        return self._unsubscribe(conn, patterns, self._patterns, conn.patterns, b'punsubscribe')
+
+    def _cmd_publish(self, conn, channel, message):
+
+        result = 0
+
+        for subscriber in self._channels.get(channel, ()):
+            subscriber.writer.write(encode_reply([b'message', channel, message]))
+            result += 1
+
+        for pattern, subscribers in self._patterns.items():
+            if fnmatch.fnmatchcase(channel, pattern):
+                for subscriber in subscribers:
+                    subscriber.writer.write(encode_reply([b'pmessage', pattern, channel, message]))
+                    result += 1
+
+        return result
+
+    # SCRIPTING
+
+    def _script_call(self, conn):
+
+        def _call(command, *args):
+
+            func = self._commands.get(Utils.utf8(command).upper())
+
+            if func is None:
+                raise RespError(f'ERR unknown command `{command}` called from script')
+
+            args = [arg if isinstance(arg, bytes) else Utils.utf8(str(arg)) for arg in args]
+
+            self._check_arity(Utils.utf8(command).upper(), args)
+
+            return func(conn, *args)
+
+        return _call
+
+    def _run_script(self, conn, digest, numkeys, args):
+
+        func = self._script_funcs.get(digest)
+
+        if func is None:
+            raise RespError(r'ERR script not supported by resp server')
+
+        numkeys = _int(numkeys)
+
+        result = func(self._script_call(conn), list(args[:numkeys]), list(args[numkeys:]))
+
+        if result is None or result is False:
+            return None
+
+        if result is True:
+            return 1
+
+        return result
+
+    def _cmd_eval(self, conn, script, numkeys, *args):
+
+        digest = hashlib.sha1(script).hexdigest()
+
+        self._scripts[digest] = script
+
+        return self._run_script(conn, digest, numkeys, args)
+
+    def _cmd_evalsha(self, conn, digest, numkeys, *args):
+
+        digest = Utils.basestring(digest).lower()
+
+        if digest not in self._scripts:
+            raise RespError(r'NOSCRIPT No matching script. Please use EVAL.')
+
+        return self._run_script(conn, digest, numkeys, args)
+
+    def _cmd_script(self, conn, subcommand, *args):
+
+        subcommand = subcommand.upper()
+
+        if subcommand == b'LOAD':
+
+            digest = hashlib.sha1(args[0]).hexdigest()
+
+            self._scripts[digest] = args[0]
+
+            return digest.encode()
+
+        elif subcommand == b'EXISTS':
+
+            return [1 if Utils.basestring(digest).lower() in self._scripts else 0 for digest in args]
+
+        elif subcommand == b'FLUSH':
+
+            self._scripts.clear()
+
+            return RESP_OK
+
+        raise RespError(r'ERR unsupported SCRIPT subcommand')
+
+    def _register_builtin_scripts(self):
+
+        self.register_script(MLock._lock_script, _lock_script)
+        self.register_script(MLock._fair_lock_script, _fair_lock_script)
+        self.register_script(MLock._renew_script, _renew_script)
+        self.register_script(MLock._unlock_script, _unlock_script)
+        self.register_script(MLock._release_script, _release_script)
+        self.register_script(MRWLock._read_lock_script, _read_lock_script)
+        self.register_script(MRWLock._write_lock_script, _write_lock_script)
+        self.register_script(MRWLock._read_renew_script, _read_renew_script)
+        self.register_script(MRWLock._read_release_script, _read_release_script)
+        self.register_script(NearCache._get_script, _near_get_script)
+        self.register_script(NearCache._hget_script, _near_hget_script)
+
+
+# 内置脚本的Python实现，与pynaja.cache.redis中的Lua脚本逐行对应
+
+def _lock_script(call, keys, args):
+
+    if call(r'SET', keys[0], args[0], r'NX', r'EX', args[1]):
+        return call(r'INCR', keys[1])
+    else:
+        return 0
+
+
+def _fair_lock_script(call, keys, args):
+
+    call(r'HSET', keys[2], args[0], args[2])
+
+    if call(r'ZSCORE', keys[1], args[0]) is None:
+        last = call(r'ZRANGE', keys[1], -1, -1, r'WITHSCORES')
+        call(r'ZADD', keys[1], (float(last[1]) + 1) if last else 0, args[0])
+
+    while True:
+
+        head = call(r'ZRANGE', keys[1], 0, 0)
+
+        if not head:
+            break
+
+        seen = int(call(r'HGET', keys[2], head[0]) or 0)
+
+        if seen >= int(args[2]) - int(args[3]):
+            break
+
+        call(r'ZREM', keys[1], head[0])
+        call(r'HDEL', keys[2], head[0])
+
+    call(r'PEXPIRE', keys[1], args[3])
+    call(r'PEXPIRE', keys[2], args[3])
+
+    if call(r'ZRANGE', keys[1], 0, 0)[:1] == [args[0]] and call(r'SET', keys[0], args[0], r'NX', r'EX', args[1]):
+        call(r'ZREM', keys[1], args[0])
+        call(r'HDEL', keys[2], args[0])
+        return call(r'INCR', keys[3])
+    else:
+        return 0
+
+
+def _renew_script(call, keys, args):
+
+    if call(r'GET', keys[0]) == args[0] and call(r'TTL', keys[0]) > 0:
+        return call(r'EXPIRE', keys[0], args[1])
+    else:
+        return 0
+
+
+def _unlock_script(call, keys, args):
+
+    if call(r'GET', keys[0]) == args[0]:
+        return call(r'DEL', keys[0])
+    else:
+        return 0
+
+
+def _release_script(call, keys, args):
+
+    if call(r'GET', keys[0]) == args[0]:
+        call(r'DEL', keys[0])
+        return call(r'EXISTS', keys[1]) + 1
+    else:
+        return 0
+
+
+def _read_lock_script(call, keys, args):
+
+    call(r'ZREMRANGEBYSCORE', keys[1], r'-inf', args[2])
+
+    if call(r'EXISTS', keys[0]) == 1 or call(r'EXISTS', keys[3]) == 1:
+        return 0
+
+    call(r'ZADD', keys[1], int(args[2]) + int(args[1]) * 1000, args[0])
+
+    if call(r'PTTL', keys[1]) < int(args[1]) * 1000:
+        call(r'PEXPIRE', keys[1], int(args[1]) * 1000)
+
+    return call(r'INCR', keys[2])
+
+
+def _write_lock_script(call, keys, args):
+
+    call(r'ZREMRANGEBYSCORE', keys[1], r'-inf', args[2])
+
+    wait = call(r'GET', keys[3])
+
+    if call(r'EXISTS', keys[0]) == 1 or call(r'ZCARD', keys[1]) > 0 or (wait and wait != args[0]):
+
+        if not wait or wait == args[0]:
+            call(r'SET', keys[3], args[0], r'PX', args[3])
+
+        return 0
+
+    call(r'DEL', keys[3])
+    call(r'SET', keys[0], args[0], r'EX', args[1])
+
+    return call(r'INCR', keys[2])
+
+
+def _read_renew_script(call, keys, args):
+
+    if call(r'ZSCORE', keys[0], args[0]) is not None:
+
+        call(r'ZADD', keys[0], int(args[2]) + int(args[1]) * 1000, args[0])
+
+        if call(r'PTTL', keys[0]) < int(args[1]) * 1000:
+            call(r'PEXPIRE', keys[0], int(args[1]) * 1000)
+
+        return 1
+
+    else:
+
+        return 0
+
+
+def _read_release_script(call, keys, args):
+
+    if call(r'ZREM', keys[0], args[0]) == 1:
+        return call(r'EXISTS', keys[1]) + 1
+    else:
+        return 0
+
+
+def _near_get_script(call, keys, args):
+
+    val = call(r'GET', keys[0])
+
+    if val is not None:
+        return [val, call(r'PTTL', keys[0])]
+    else:
+        return False
+
+
+def _near_hget_script(call, keys, args):
+
+    val = call(r'HGET', keys[0], args[0])
+
+    if val is not None:
+        return [val, call(r'PTTL', keys[0])]
+    else:
+        return False
@@ -0,0 +1,508 @@
+import fcntl
+import hashlib
+import os
+import struct
+import tempfile
+import time
+
+from multiprocessing import resource_tracker
+
+from pynaja.cache.codec import ValueCodec
+from pynaja.common.async_base import Utils
+from pynaja.common.base import ContextManager
+from pynaja.common.process import SharedByteArray
+
+# 共享内存头部结构：魔数、版本、槽位数量、槽位大小、探测长度
+SHARED_CACHE_MAGIC = 0x4e4a5343
+SHARED_CACHE_VERSION = 0x01
+SHARED_CACHE_HEADER = struct.Struct(r'=IIIII')
+SHARED_CACHE_HEADER_SIZE = 0x40
+
+# 槽位头部结构：序列号、状态、键哈希、过期时间、键长度、值长度
+SHARED_CACHE_SLOT_HEADER = struct.Struct(r'=IB3xQdII')
+SHARED_CACHE_SEQ = struct.Struct(r'=I')
+
+# 槽位状态
+SHARED_CACHE_SLOT_EMPTY = 0x00
+SHARED_CACHE_SLOT_USED = 0x01
+SHARED_CACHE_SLOT_DELETED = 0x02
+
+# 读取时遇到并发写入的重试次数
+SHARED_CACHE_READ_RETRIES = 0x04
+
+# 连接时等待创建者完成初始化的超时时间和重试间隔(秒)
+SHARED_CACHE_INIT_TIMEOUT = 5
+SHARED_CACHE_INIT_INTERVAL = 0.001
+
+# 进程内共享的锁文件描述符：(进程号, 路径) -> [描述符, 引用计数]
+_LOCK_FILES = {}
+
+
+def _open_lock_file(path):
+    """打开锁文件，同一进程内的所有实例共用一个描述符
+
+    fcntl记录锁属于进程，进程关闭指向同一文件的任意描述符都会释放该进程在这个文件上的全部锁，
+    因此每个进程只保留一个描述符，最后一个实例释放时才关闭；fork出的子进程不继承锁，使用新的描述符
+
+    """
+
+    global _LOCK_FILES
+
+    item = _LOCK_FILES.get((os.getpid(), path))
+
+    if item is None:
+        item = _LOCK_FILES[(os.getpid(), path)] = [os.open(path, os.O_RDWR | os.O_CREAT, 0o600), 0]
+
+    item[1] += 1
+
+    return item[0]
+
+
+def _close_lock_file(path):
+
+    global _LOCK_FILES
+
+    key = (os.getpid(), path)
+
+    item = _LOCK_FILES.get(key)
+
+    if item is not None:
+
+        item[1] -= 1
+
+        if item[1] <= 0:
+            del _LOCK_FILES[key]
+            os.close(item[0])
+
+
+class SharedMemoryCache(ContextManager):
+    """跨进程共享内存缓存
+
+    基于SharedByteArray的固定槽位哈希表，同一主机上的多个工作进程共享一份缓存数据，每个槽位存放一条数据(键和编码后的值)，
+    键哈希定位到槽位后在max_probe个相邻槽位内线性探测
+
+    读取无锁：槽位使用序列号(seqlock)标记写入状态，读取期间发生写入时重试；写入使用文件区域锁(fcntl)互斥探测区间，
+    fcntl锁只在进程之间互斥，同一进程内的实例共用锁文件描述符，多线程写入需要调用方自行加锁
+
+    数据只在get时解码，get_raw返回编码后的字节数据；编码后超过槽位容量的数据不会被缓存
+
+    共享内存由创建者负责销毁(destroy)，在gunicorn中建议由主进程创建(例如on_starting钩子)，工作进程使用相同的name连接，
+    release只断开连接，创建者在上下文退出时销毁共享内存
+
+    """
+
+    def __init__(
+            self, name, slot_count=0x4000, slot_size=0x400,
+            *, max_probe=0x08, ttl=0, value_codec=None
+    ):
+
+        global SHARED_CACHE_HEADER_SIZE, SHARED_CACHE_SLOT_HEADER
+
+        if slot_size <= SHARED_CACHE_SLOT_HEADER.size:
+            raise ValueError(f'Slot size too small: {slot_size}')
+
+        self._name = f'shared_cache_{name}'
+
+        self._ttl = ttl
+        # 共享内存缓存没有旧版本数据，默认使用头字节格式(未超过阈值的数据不压缩)
+        self._value_codec = ValueCodec(header=True) if value_codec is None else value_codec
+
+        self._byte_array = None
+
+        # 记录创建者进程，fork出的子进程继承对象后不会被视为创建者
+        self._owner_pid = None
+
+        try:
+
+            self._byte_array = SharedByteArray(
+                self._name, True, SHARED_CACHE_HEADER_SIZE + slot_count * slot_size
+            )
+
+            self._init_header(slot_count, slot_size, min(max_probe, slot_count))
+
+            self._owner_pid = os.getpid()
+
+        except FileExistsError as _:
+
+            self._byte_array = self._attach()
+
+        self._buffer = self._byte_array.buf
+
+        self._slot_count, self._slot_size, self._max_probe = self._read_header()
+
+        self._home_count = self._slot_count - self._max_probe + 1
+
+        self._lock_path = os.path.join(tempfile.gettempdir(), f'{self._name}.lock')
+        self._lock_file = _open_lock_file(self._lock_path)
+
+    def _context_release(self):
+
+        if self.owner:
+            self.destroy()
+        else:
+            self.release()
+
+    @property
+    def slot_count(self):
+
+        return self._slot_count
+
+    @property
+    def slot_size(self):
+
+        return self._slot_size
+
+    @property
+    def owner(self):
+
+        return self._owner_pid == os.getpid()
+
+    @property
+    def capacity(self):
+        """单条数据的最大字节数(键与编码后的值)
+        """
+
+        global SHARED_CACHE_SLOT_HEADER
+
+        return self._slot_size - SHARED_CACHE_SLOT_HEADER.size
+
+    def _init_header(self, slot_count, slot_size, max_probe):
+
+        global SHARED_CACHE_MAGIC, SHARED_CACHE_VERSION, SHARED_CACHE_HEADER
+
+        # 先写入其他字段再写入魔数，连接方读到魔数时头部已经完整
+        SHARED_CACHE_HEADER.pack_into(
+            self._byte_array.buf, 0, 0, SHARED_CACHE_VERSION, slot_count, slot_size, max_probe
+        )
+
+        SHARED_CACHE_HEADER.pack_into(
+            self._byte_array.buf, 0, SHARED_CACHE_MAGIC, SHARED_CACHE_VERSION, slot_count, slot_size, max_probe
+        )
+
+    def _attach(self):
+        """连接已存在的共享内存，创建者尚未完成初始化(未设置大小或未写入头部)时等待重试
+        """
+
+        global SHARED_CACHE_HEADER, SHARED_CACHE_HEADER_SIZE, SHARED_CACHE_INIT_TIMEOUT, SHARED_CACHE_INIT_INTERVAL
+
+        deadline = time.monotonic() + SHARED_CACHE_INIT_TIMEOUT
+
+        while True:
+
+            byte_array = None
+
+            try:
+
+                byte_array = SharedByteArray(self._name)
+
+                # 连接时共享内存也会被登记到资源跟踪进程，跟踪进程退出时会删除共享内存，只由创建者负责销毁
+                resource_tracker.unregister(byte_array._name, r'shared_memory')
+
+                if byte_array.size >= SHARED_CACHE_HEADER_SIZE and SHARED_CACHE_HEADER.unpack_from(byte_array.buf, 0)[0]:
+                    return byte_array
+
+            except ValueError as _:
+
+                # 创建者尚未设置共享内存大小，无法映射
+                pass
+
+            if byte_array is not None:
+                byte_array.release()
+
+            if time.monotonic() >= deadline:
+                raise TimeoutError(f'Shared memory {self._name} is not initialized')
+
+            time.sleep(SHARED_CACHE_INIT_INTERVAL)
+
+    def _read_header(self):
+
+        global SHARED_CACHE_MAGIC, SHARED_CACHE_VERSION, SHARED_CACHE_HEADER
+
+        magic, version, slot_count, slot_size, max_probe = SHARED_CACHE_HEADER.unpack_from(self._buffer, 0)
+
+        if magic != SHARED_CACHE_MAGIC or version != SHARED_CACHE_VERSION:
+            raise ValueError(f'Shared memory {self._name} is not a shared cache')
+
+        return slot_count, slot_size, max_probe
+
+    def release(self):
+        """断开共享内存连接，不会销毁共享内存
+        """
+
+        if self._byte_array is not None:
+
+            self._buffer.release()
+            self._buffer = None
+
+            self._byte_array.close()
+            self._byte_array = None
+
+            _close_lock_file(self._lock_path)
+
+    def destroy(self):
+        """销毁共享内存和锁文件，只能由创建者调用，需要在所有进程停止使用后调用
+        """
+
+        if not self.owner:
+            raise ValueError(f'Shared memory {self._name} is not created by this instance')
+
+        byte_array = self._byte_array
+
+        self.release()
+
+        if byte_array is not None:
+
+            byte_array.unlink()
+
+            try:
+                os.unlink(self._lock_path)
+            except FileNotFoundError as _:
+                pass
+
+    @staticmethod
+    def _hash(key):
+
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), r'little') or 1
+
+    def _offset(self, index):
+
+        global SHARED_CACHE_HEADER_SIZE
+
+        return SHARED_CACHE_HEADER_SIZE + index * self._slot_size
+
+    def _read_slot(self, index, key, key_hash):
+        """无锁读取槽位，返回(状态, 值)，值为None表示未命中
+        """
+
+        global SHARED_CACHE_SLOT_HEADER, SHARED_CACHE_SEQ, SHARED_CACHE_SLOT_USED, SHARED_CACHE_READ_RETRIES
+
+        buffer = self._buffer
+
+        offset = self._offset(index)
+
+        for _ in range(SHARED_CACHE_READ_RETRIES):
+
+            seq, state, _hash, expire_time, key_len, val_len = SHARED_CACHE_SLOT_HEADER.unpack_from(buffer, offset)
+
+            if seq & 1:
+                continue
+
+            value = None
+
+            if state == SHARED_CACHE_SLOT_USED and _hash == key_hash and key_len == len(key):
+
+                data_offset = offset + SHARED_CACHE_SLOT_HEADER.size
+
+                if buffer[data_offset:data_offset + key_len] == key:
+
+                    if expire_time == 0 or expire_time > time.time():
+                        value = bytes(buffer[data_offset + key_len:data_offset + key_len + val_len])
+
+            # 序列号未变化说明读取期间没有发生写入
+            if SHARED_CACHE_SEQ.unpack_from(buffer, offset)[0] == seq:
+                return state, value
+
+        return SHARED_CACHE_SLOT_USED, None
+
+    def _write_slot(self, index, state, key_hash, expire_time, key, value):
+
+        global SHARED_CACHE_SLOT_HEADER, SHARED_CACHE_SEQ
+
+        buffer = self._buffer
+
+        offset = self._offset(index)
+
+        seq = SHARED_CACHE_SEQ.unpack_from(buffer, offset)[0]
+
+        # 奇数序列号表示写入中
+        SHARED_CACHE_SEQ.pack_into(buffer, offset, (seq + 1) & 0xffffffff)
+
+        data_offset = offset + SHARED_CACHE_SLOT_HEADER.size
+
+        buffer[data_offset:data_offset + len(key)] = key
+        buffer[data_offset + len(key):data_offset + len(key) + len(value)] = value
+
+        SHARED_CACHE_SLOT_HEADER.pack_into(
+            buffer, offset, (seq + 1) & 0xffffffff, state, key_hash, expire_time, len(key), len(value)
+        )
+
+        SHARED_CACHE_SEQ.pack_into(buffer, offset, (seq + 2) & 0xffffffff)
+
+    def _lock(self, home):
+
+        fcntl.lockf(self._lock_file, fcntl.LOCK_EX, self._max_probe, home)
+
+    def _unlock(self, home):
+
+        fcntl.lockf(self._lock_file, fcntl.LOCK_UN, self._max_probe, home)
+
+    def get_raw(self, key):
+
+        global SHARED_CACHE_SLOT_EMPTY
+
+        key = Utils.utf8(key)
+        key_hash = self._hash(key)
+
+        home = key_hash % self._home_count
+
+        for index in range(home, home + self._max_probe):
+
+            state, value = self._read_slot(index, key, key_hash)
+
+            if value is not None:
+                return value
+
+            if state == SHARED_CACHE_SLOT_EMPTY:
+                break
+
+        return None
+
+    def get(self, key, default=None):
+
+        value = self.get_raw(key)
+
+        if value is None:
+            return default
+
+        return self._value_codec.decode(value)
+
+    def has(self, key):
+
+        return self.get_raw(key) is not None
+
+    def set_raw(self, key, value, ttl=None):
+        """写入编码后的数据，返回是否写入成功
+        """
+
+        global SHARED_CACHE_SLOT_HEADER, SHARED_CACHE_SLOT_EMPTY, SHARED_CACHE_SLOT_USED, SHARED_CACHE_SLOT_DELETED
+
+        key = Utils.utf8(key)
+
+        if len(key) + len(value) > self.capacity:
+            return False
+
+        key_hash = self._hash(key)
+
+        if ttl is None:
+            ttl = self._ttl
+
+        expire_time = (time.time() + ttl) if ttl > 0 else 0
+
+        home = key_hash % self._home_count
+
+        self._lock(home)
+
+        try:
+
+            buffer = self._buffer
+
+            now_time = time.time()
+
+            target = None
+            victim, victim_expire_time = home, None
+
+            for index in range(home, home + self._max_probe):
+
+                offset = self._offset(index)
+
+                _, state, _hash, _expire_time, key_len, _ = SHARED_CACHE_SLOT_HEADER.unpack_from(buffer, offset)
+
+                if state == SHARED_CACHE_SLOT_USED and _hash == key_hash and key_len == len(key):
+                    data_offset = offset + SHARED_CACHE_SLOT_HEADER.size
+                    if buffer[data_offset:data_offset + key_len] == key:
+                        target = index
+                        break
+
+                if state == SHARED_CACHE_SLOT_EMPTY:
+                    if target is None:
+                        target = index
+                    break
+
+                if target is None and (state == SHARED_CACHE_SLOT_DELETED or 0 < _expire_time <= now_time):
+                    target = index
+
+                # 探测区间已满时淘汰最早过期的数据，永不过期的数据最后淘汰
+                if state == SHARED_CACHE_SLOT_USED:
+                    _expire_time = _expire_time or float(r'inf')
+                    if victim_expire_time is None or _expire_time < victim_expire_time:
+                        victim, victim_expire_time = index, _expire_time
+
+            if target is None:
+                target = victim
+
+            self._write_slot(target, SHARED_CACHE_SLOT_USED, key_hash, expire_time, key, value)
+
+        finally:
+
+            self._unlock(home)
+
+        return True
+
+    def set(self, key, val, ttl=None):
+
+        return self.set_raw(key, self._value_codec.encode(val), ttl)
+
+    def delete(self, key):
+
+        global SHARED_CACHE_SLOT_HEADER, SHARED_CACHE_SLOT_EMPTY, SHARED_CACHE_SLOT_USED, SHARED_CACHE_SLOT_DELETED
+
+        key = Utils.utf8(key)
+        key_hash = self._hash(key)
+
+        home = key_hash % self._home_count
+
+        self._lock(home)
+
+        try:
+
+            buffer = self._buffer
+
+            for index in range(home, home + self._max_probe):
+
+                offset = self._offset(index)
+
+                _, state, _hash, _, key_len, _ = SHARED_CACHE_SLOT_HEADER.unpack_from(buffer, offset)
+
+                if state == SHARED_CACHE_SLOT_EMPTY:
+                    break
+
+                if state == SHARED_CACHE_SLOT_USED and _hash == key_hash and key_len == len(key):
+                    data_offset = offset + SHARED_CACHE_SLOT_HEADER.size
+                    if buffer[data_offset:data_offset + key_len] == key:
+                        self._write_slot(index, SHARED_CACHE_SLOT_DELETED, 0, 0, b'', b'')
+                        return True
+
+        finally:
+
+            self._unlock(home)
+
+        return False
+
+    def size(self):
+
+        global SHARED_CACHE_SLOT_HEADER, SHARED_CACHE_SLOT_USED
+
+        now_time = time.time()
+
+        count = 0
+
+        for index in range(self._slot_count):
+
+            _, state, _, expire_time, _, _ = SHARED_CACHE_SLOT_HEADER.unpack_from(self._buffer, self._offset(index))
+
+            if state == SHARED_CACHE_SLOT_USED and (expire_time == 0 or expire_time > now_time):
+                count += 1
+
+        return count
+
+    def clear(self):
+
+        global SHARED_CACHE_SLOT_EMPTY
+
+        fcntl.lockf(self._lock_file, fcntl.LOCK_EX)
+
+        try:
+            for index in range(self._slot_count):
+                self._write_slot(index, SHARED_CACHE_SLOT_EMPTY, 0, 0, b'', b'')
+        finally:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_UN)
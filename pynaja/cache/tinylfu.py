@@ -0,0 +1,435 @@
+import sys
+import time
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+# 频率计数器上限(4位计数器)
+FREQUENCY_COUNTER_MAX = 0x0f
+
+# 计数器衰减表，将所有计数减半
+FREQUENCY_HALVE_TABLE = bytes(val >> 1 for val in range(0x100))
+
+# 窗口区和受保护区占总容量的比例
+TINYLFU_WINDOW_RATIO = 0.01
+TINYLFU_PROTECTED_RATIO = 0.8
+
+# 缓存分段：窗口区、试用区、受保护区
+TINYLFU_WINDOW = 0
+TINYLFU_PROBATION = 1
+TINYLFU_PROTECTED = 2
+
+# 对象占用估算的最大递归深度
+OBJECT_WEIGHER_MAX_DEPTH = 0x04
+
+
+def object_weigher(key, val):
+    """对象内存占用估算
+
+    递归累加容器元素的sys.getsizeof，超过最大深度的对象只计算自身
+
+    """
+
+    global OBJECT_WEIGHER_MAX_DEPTH
+
+    def _sizeof(obj, depth):
+
+        size = sys.getsizeof(obj)
+
+        if depth >= OBJECT_WEIGHER_MAX_DEPTH:
+            return size
+
+        if isinstance(obj, dict):
+            size += sum(_sizeof(_key, depth + 1) + _sizeof(_val, depth + 1) for _key, _val in obj.items())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            size += sum(_sizeof(item, depth + 1) for item in obj)
+        elif hasattr(obj, r'__dict__'):
+            size += _sizeof(obj.__dict__, depth + 1)
+
+        return size
+
+    return _sizeof(key, 0) + _sizeof(val, 0)
+
+
+class FrequencySketch:
+    """访问频率估算(Count-Min Sketch)
+
+    每个键映射到depth行中的一个4位计数器，估值取最小值；累计记录次数达到样本上限后全部计数减半，使频率随时间衰减
+
+    """
+
+    __slots__ = [r'_width', r'_mask', r'_depth', r'_seeds', r'_table', r'_additions', r'_sample_size']
+
+    def __init__(self, capacity, depth=4):
+
+        width = 1
+
+        while width < max(capacity, 0x10):
+            width <<= 1
+
+        self._width = width
+        self._mask = width - 1
+        self._depth = depth
+
+        self._seeds = (0x9e3779b1, 0x85ebca77, 0xc2b2ae3d, 0x27d4eb2f, 0x165667b1, 0xd3a2646c)[:depth]
+
+        self._table = bytearray(width * depth)
+
+        self._additions = 0
+        self._sample_size = width * 10
+
+    def _indexes(self, key):
+
+        _hash = hash(key)
+
+        return [
+            row * self._width + (((_hash ^ (_hash >> 0x10)) * seed >> 0x08) & self._mask)
+            for row, seed in enumerate(self._seeds)
+        ]
+
+    def frequency(self, key):
+
+        table = self._table
+
+        return min(table[index] for index in self._indexes(key))
+
+    def increment(self, key):
+
+        global FREQUENCY_COUNTER_MAX
+
+        table = self._table
+
+        added = False
+
+        for index in self._indexes(key):
+            if table[index] < FREQUENCY_COUNTER_MAX:
+                table[index] += 1
+                added = True
+
+        if added:
+
+            self._additions += 1
+
+            if self._additions >= self._sample_size:
+                self.reset()
+
+    def reset(self):
+
+        global FREQUENCY_HALVE_TABLE
+
+        self._table = bytearray(self._table.translate(FREQUENCY_HALVE_TABLE))
+
+        self._additions >>= 1
+
+    def clear(self):
+
+        self._table = bytearray(len(self._table))
+
+        self._additions = 0
+
+
+class _Entry:
+
+    __slots__ = [r'value', r'weight', r'expire_time', r'segment']
+
+    def __init__(self, value, weight, expire_time, segment):
+
+        self.value = value
+        self.weight = weight
+        self.expire_time = expire_time
+        self.segment = segment
+
+
+class TinyLFUCache(MutableMapping):
+    """按权重计量的W-TinyLFU缓存
+
+    新数据先进入窗口区(LRU)，被窗口淘汰的数据与主区(分段LRU)的淘汰候选比较访问频率，频率更高者保留，
+    可以抵御扫描式访问对热点数据的冲刷
+
+    权重由weigher(key, val)计算，默认每个数据权重为1(与cachetools按数量计算一致)，使用object_weigher可以按内存占用计量，
+    单个数据权重超过maxsize时不会被缓存
+
+    支持数据独立的过期时间，并统计命中、未命中、淘汰、拒绝写入和过期次数
+
+    """
+
+    def __init__(self, maxsize, ttl=None, *, weigher=None, timer=time.monotonic):
+
+        global TINYLFU_WINDOW, TINYLFU_WINDOW_RATIO, TINYLFU_PROTECTED_RATIO
+
+        self._maxsize = maxsize
+        self._ttl = ttl
+
+        self._weigher = weigher
+        self._timer = timer
+
+        self._window_maxsize = max(1, int(maxsize * TINYLFU_WINDOW_RATIO))
+        self._protected_maxsize = int((maxsize - self._window_maxsize) * TINYLFU_PROTECTED_RATIO)
+
+        self._entries = {}
+
+        # 分段顺序为：窗口区、试用区、受保护区
+        self._segments = (OrderedDict(), OrderedDict(), OrderedDict())
+        self._weights = [0, 0, 0]
+
+        self._window, self._probation, self._protected = self._segments
+
+        self._sketch = FrequencySketch(maxsize if weigher is None else min(maxsize, 0x100000))
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._rejections = 0
+        self._expirations = 0
+
+    @property
+    def maxsize(self):
+
+        return self._maxsize
+
+    @property
+    def currsize(self):
+
+        return sum(self._weights)
+
+    @property
+    def ttl(self):
+
+        return self._ttl
+
+    def __len__(self):
+
+        return len(self._entries)
+
+    def __iter__(self):
+
+        return iter(list(self._entries))
+
+    def __contains__(self, key):
+
+        entry = self._entries.get(key)
+
+        return entry is not None and not self._expired(key, entry)
+
+    def __getitem__(self, key):
+
+        entry = self._entries.get(key)
+
+        self._sketch.increment(key)
+
+        if entry is None or self._expired(key, entry):
+            self._misses += 1
+            raise KeyError(key)
+
+        self._hits += 1
+
+        self._on_access(key, entry)
+
+        return entry.value
+
+    def __setitem__(self, key, val):
+
+        self.set(key, val)
+
+    def __delitem__(self, key):
+
+        entry = self._entries.pop(key)
+
+        self._unlink(key, entry)
+
+    def get(self, key, default=None):
+
+        try:
+            return self[key]
+        except KeyError as _:
+            return default
+
+    def set(self, key, val, ttl=None):
+        """写入数据，ttl为None时使用默认过期时间，返回是否被缓存
+        """
+
+        global TINYLFU_WINDOW
+
+        weight = 1 if self._weigher is None else self._weigher(key, val)
+
+        if ttl is None:
+            ttl = self._ttl
+
+        expire_time = (self._timer() + ttl) if ttl else None
+
+        self._sketch.increment(key)
+
+        entry = self._entries.get(key)
+
+        if entry is not None:
+
+            self._weights[entry.segment] += weight - entry.weight
+
+            entry.value = val
+            entry.weight = weight
+            entry.expire_time = expire_time
+
+            self._on_access(key, entry)
+
+        elif weight > self._maxsize:
+
+            self._rejections += 1
+
+            return False
+
+        else:
+
+            self._entries[key] = _Entry(val, weight, expire_time, TINYLFU_WINDOW)
+
+            self._window[key] = None
+            self._weights[TINYLFU_WINDOW] += weight
+
+        self._evict()
+
+        return key in self._entries
+
+    def clear(self):
+
+        self._entries.clear()
+
+        for segment in self._segments:
+            segment.clear()
+
+        self._weights = [0, 0, 0]
+
+    def expire(self):
+        """清理全部过期数据
+        """
+
+        now = self._timer()
+
+        for key, entry in list(self._entries.items()):
+            if entry.expire_time is not None and entry.expire_time <= now:
+                self._remove(key, entry)
+                self._expirations += 1
+
+    def stats(self):
+
+        total = self._hits + self._misses
+
+        return {
+            r'hits': self._hits,
+            r'misses': self._misses,
+            r'hit_rate': (self._hits / total) if total > 0 else 0,
+            r'evictions': self._evictions,
+            r'rejections': self._rejections,
+            r'expirations': self._expirations,
+            r'count': len(self._entries),
+            r'weight': self.currsize,
+            r'maxsize': self._maxsize,
+        }
+
+    def reset_stats(self):
+
+        self._hits = self._misses = self._evictions = self._rejections = self._expirations = 0
+
+    def _expired(self, key, entry):
+
+        if entry.expire_time is not None and entry.expire_time <= self._timer():
+            self._remove(key, entry)
+            self._expirations += 1
+            return True
+
+        return False
+
+    def _unlink(self, key, entry):
+
+        del self._segments[entry.segment][key]
+
+        self._weights[entry.segment] -= entry.weight
+
+    def _remove(self, key, entry):
+
+        del self._entries[key]
+
+        self._unlink(key, entry)
+
+    def _move(self, key, entry, segment):
+
+        self._unlink(key, entry)
+
+        entry.segment = segment
+
+        self._segments[segment][key] = None
+        self._weights[segment] += entry.weight
+
+    def _on_access(self, key, entry):
+
+        global TINYLFU_PROBATION, TINYLFU_PROTECTED
+
+        if entry.segment == TINYLFU_PROBATION:
+
+            self._move(key, entry, TINYLFU_PROTECTED)
+
+            # 受保护区溢出的数据降级回试用区
+            while self._weights[TINYLFU_PROTECTED] > self._protected_maxsize and len(self._protected) > 1:
+                _key = next(iter(self._protected))
+                self._move(_key, self._entries[_key], TINYLFU_PROBATION)
+
+        else:
+
+            self._segments[entry.segment].move_to_end(key)
+
+    def _evict(self):
+
+        global TINYLFU_WINDOW, TINYLFU_PROBATION
+
+        # 窗口区溢出的数据作为候选进入主区
+        while self._weights[TINYLFU_WINDOW] > self._window_maxsize and len(self._window) > 1:
+
+            key = next(iter(self._window))
+            entry = self._entries[key]
+
+            self._move(key, entry, TINYLFU_PROBATION)
+
+            self._admit(key, entry)
+
+        # 窗口区中单个超大数据仍可能导致超出总容量
+        while self.currsize > self._maxsize:
+
+            key, entry = self._probation_victim(None)
+
+            if key is None:
+                key = next(iter(self._window))
+                entry = self._entries[key]
+
+            self._remove(key, entry)
+            self._evictions += 1
+
+    def _admit(self, key, entry):
+
+        sketch = self._sketch
+
+        while self.currsize > self._maxsize:
+
+            victim_key, victim = self._probation_victim(key)
+
+            if victim_key is None:
+                break
+
+            if victim.expire_time is not None and victim.expire_time <= self._timer():
+                self._remove(victim_key, victim)
+                self._expirations += 1
+                continue
+
+            # 候选者频率不高于淘汰对象时放弃写入，避免一次性访问的数据冲刷热点数据
+            if sketch.frequency(key) > sketch.frequency(victim_key):
+                self._remove(victim_key, victim)
+                self._evictions += 1
+            else:
+                self._remove(key, entry)
+                self._rejections += 1
+                break
+
+    def _probation_victim(self, candidate):
+
+        for segment in (self._probation, self._protected):
+            for key in segment:
+                if key != candidate:
+                    return key, self._entries[key]
+
+        return None, None
@@ -336,6 +336,19 @@ class FuncWrapper(_FuncWrapper):
             Utils.call_soon(func, *args, **kwargs)
 
 
+class SequenceFuncWrapper(_FuncWrapper):
+    """顺序异步函数包装器
+
+    依次等待所有同步或异步函数执行完成，函数异常时直接抛出
+
+    """
+
+    async def __call__(self, *args, **kwargs):
+
+        for func in list(self._callables):
+            await Utils.awaitable_wrapper(func(*args, **kwargs))
+
+
 class MultiTasks:
     """多任务并发管理器
 
@@ -474,18 +474,38 @@ class _Utils(Singleton):
         return jwt.decode(val, key, algorithms)
 
     @classmethod
-    def pickle_dumps(cls, val):
+    def zlib_compress(cls, val, level=-1, zdict=None):
+
+        if zdict is None:
+            return zlib.compress(val, level)
+
+        compressor = zlib.compressobj(level, zdict=zdict)
+
+        return compressor.compress(val) + compressor.flush()
+
+    @classmethod
+    def zlib_decompress(cls, val, zdict=None):
+
+        if zdict is None:
+            return zlib.decompress(val)
+
+        decompressor = zlib.decompressobj(zdict=zdict)
+
+        return decompressor.decompress(val) + decompressor.flush()
+
+    @classmethod
+    def pickle_dumps(cls, val, zdict=None):
 
         stream = pickle.dumps(val)
 
-        result = zlib.compress(stream)
+        result = cls.zlib_compress(stream, zdict=zdict)
 
         return result
 
     @classmethod
-    def pickle_loads(cls, val):
+    def pickle_loads(cls, val, zdict=None):
 
-        stream = zlib.decompress(val)
+        stream = cls.zlib_decompress(val, zdict)
 
         result = pickle.loads(stream)
 
@@ -30,6 +30,16 @@ class MySQLClientDestroyed(BaseError):
     pass
 
 
+# Redis连接池过载，等待连接超过阈值时快速失败
+class RedisPoolOverload(BaseError):
+    pass
+
+
+# 分块存储的大对象数据块缺失(已过期或被删除)
+class RedisChunkMissing(BaseError):
+    pass
+
+
 # 常量设置异常
 class ConstError(BaseError):
     pass
@@ -1,3 +1,4 @@
+import bisect
 import struct
 from collections import OrderedDict
 from configparser import RawConfigParser
@@ -276,6 +277,164 @@ class ByteArrayAbstract:
         self.write(struct.pack(f'{self._endian}{len(val)}P', val))
 
 
+class ConsistentHash:
+    """一致性哈希环
+
+    每个节点在环上分布多个虚拟节点，节点增减时只影响相邻区间的键
+
+    """
+
+    def __init__(self, nodes=None, vnodes=0xa0):
+
+        self._vnodes = vnodes
+
+        self._ring = []
+        self._ring_nodes = []
+
+        self._nodes = []
+
+        if nodes:
+            for node in nodes:
+                self.add_node(node)
+
+    @property
+    def nodes(self):
+
+        return self._nodes
+
+    @staticmethod
+    def hash(val):
+
+        return Utils.md5_u32(val)
+
+    def _rebuild(self):
+
+        points = sorted(
+            (self.hash(f'{node}#{index}'), node)
+            for node in self._nodes for index in range(self._vnodes)
+        )
+
+        self._ring = [point for point, _ in points]
+        self._ring_nodes = [node for _, node in points]
+
+    def add_node(self, node):
+
+        if node not in self._nodes:
+            self._nodes.append(node)
+            self._rebuild()
+
+    def remove_node(self, node):
+
+        if node in self._nodes:
+            self._nodes.remove(node)
+            self._rebuild()
+
+    def get_node(self, key):
+
+        if not self._ring:
+            return None
+
+        index = bisect.bisect(self._ring, self.hash(key))
+
+        if index == len(self._ring):
+            index = 0
+
+        return self._ring_nodes[index]
+
+
+class Histogram:
+    """直方图统计
+
+    使用固定的桶边界记录样本分布，可以低成本地估算分位数
+
+    """
+
+    DEFAULT_BUCKETS = (
+        0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+    )
+
+    def __init__(self, buckets=None):
+
+        self._buckets = tuple(sorted(buckets)) if buckets else self.DEFAULT_BUCKETS
+
+        self._counts = [0] * (len(self._buckets) + 1)
+
+        self._count = 0
+        self._sum = 0
+        self._max = 0
+
+    @property
+    def count(self):
+
+        return self._count
+
+    @property
+    def sum(self):
+
+        return self._sum
+
+    @property
+    def max(self):
+
+        return self._max
+
+    @property
+    def mean(self):
+
+        return (self._sum / self._count) if self._count > 0 else 0
+
+    def observe(self, val):
+
+        self._counts[bisect.bisect_left(self._buckets, val)] += 1
+
+        self._count += 1
+        self._sum += val
+
+        if val > self._max:
+            self._max = val
+
+    def percentile(self, percent):
+        """估算分位数，返回样本所在桶的上边界
+        """
+
+        if self._count == 0:
+            return 0
+
+        threshold = self._count * percent / 100
+
+        total = 0
+
+        for index, count in enumerate(self._counts):
+
+            total += count
+
+            if total >= threshold:
+                return self._buckets[index] if index < len(self._buckets) else self._max
+
+        return self._max
+
+    def reset(self):
+
+        self._counts = [0] * (len(self._buckets) + 1)
+
+        self._count = 0
+        self._sum = 0
+        self._max = 0
+
+    def snapshot(self):
+
+        return {
+            r'count': self._count,
+            r'sum': self._sum,
+            r'mean': self.mean,
+            r'max': self._max,
+            r'p50': self.percentile(50),
+            r'p95': self.percentile(95),
+            r'p99': self.percentile(99),
+            r'buckets': dict(zip(self._buckets + (r'+inf',), self._counts)),
+        }
+
+
 class ConfigParser(RawConfigParser):
     """配置解析类
     """
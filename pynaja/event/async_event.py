@@ -1,4 +1,9 @@
-from pynaja.common.async_base import Utils, AsyncCirculatorForSecond, FutureWithTimeout, FuncWrapper
+import os
+import socket
+
+from aioredis.errors import RedisError, ReplyError
+
+from pynaja.common.async_base import Utils, AsyncCirculatorForSecond, FutureWithTimeout, FuncWrapper, SequenceFuncWrapper
 from pynaja.event.event import EventDispatcher as _EventDispatcher
 
 
@@ -13,6 +18,9 @@ class EventDispatcher(_EventDispatcher):
 
 class DistributedEvent(EventDispatcher):
     """Redis实现的消息广播总线
+
+    订阅复用连接池的专用订阅连接(redis_pool.get_pubsub)，不占用请求连接
+
     """
 
     def __init__(self, redis_pool, channel_name, channel_count):
@@ -24,20 +32,29 @@ class DistributedEvent(EventDispatcher):
         self._channels = [f'event_bus_{Utils.md5_u32(channel_name)}_{index}' for index in range(channel_count)]
 
         for channel in self._channels:
-            Utils.create_task(self._event_listener(channel))
+            self._redis_pool.get_pubsub(channel).subscribe(channel, self._event_assigner)
 
-    async def _event_listener(self, channel):
+    def close(self):
 
-        async for _ in AsyncCirculatorForSecond():
+        for channel in self._channels:
+            self._redis_pool.get_pubsub(channel).unsubscribe(channel, self._event_assigner)
 
-            async with self._redis_pool.get_client() as cache:
+    @property
+    def connected(self):
 
-                receiver, = await cache.subscribe(channel)
+        return all(self._redis_pool.get_pubsub(channel).connected for channel in self._channels)
 
-                Utils.log.info(f'event bus channel({channel}) receiver created')
+    def add_connection_callback(self, callback):
+        """订阅连接建立(恢复)和断开时调用callback(connected)，断线期间的消息会丢失
+        """
 
-                async for message in receiver.iter():
-                    await self._event_assigner(message)
+        for channel in self._channels:
+            self._redis_pool.get_pubsub(channel).add_connection_callback(callback)
+
+    def remove_connection_callback(self, callback):
+
+        for channel in self._channels:
+            self._redis_pool.get_pubsub(channel).remove_connection_callback(callback)
 
     async def _event_assigner(self, message):
 
@@ -64,8 +81,204 @@ class DistributedEvent(EventDispatcher):
             r'kwargs': kwargs,
         }
 
-        async with self._redis_pool.get_client() as cache:
-            await cache.publish(channel, Utils.pickle_dumps(message))
+        # 上下文管理器会吞掉异常，发布失败需要让调用方感知，这里显式释放连接
+        cache = self._redis_pool.get_client()
+
+        try:
+            return await cache.publish(channel, Utils.pickle_dumps(message))
+        finally:
+            await cache.release()
+
+    def gen_event_waiter(self, event_type, delay_time):
+
+        return EventWaiter(self, event_type, delay_time)
+
+
+class StreamEvent(EventDispatcher):
+    """Redis Streams实现的消息总线
+
+    使用消费组消费，同一消费组内每条消息只被一个消费者处理，处理完成后确认(XACK)
+
+    消费者异常退出遗留的未确认消息，空闲超过claim_idle_time(毫秒)后由其他消费者认领重新处理
+
+    """
+
+    def __init__(
+            self, redis_pool, stream_name, group_name, stream_count=1,
+            *, consumer_name=None, max_len=0x10000, batch_size=0x40, block_time=1000,
+            claim_idle_time=60000, claim_interval=30, max_deliveries=0x10
+    ):
+
+        super().__init__()
+
+        self._redis_pool = redis_pool
+
+        self._streams = [f'event_stream_{Utils.md5_u32(stream_name)}_{index}' for index in range(stream_count)]
+
+        self._group_name = group_name
+        self._consumer_name = consumer_name if consumer_name else f'{socket.gethostname()}_{os.getpid()}'
+
+        self._max_len = max_len
+        self._batch_size = batch_size
+        self._block_time = block_time
+
+        self._claim_idle_time = claim_idle_time
+        self._claim_interval = claim_interval
+        self._max_deliveries = max_deliveries
+
+        self._closed = False
+
+        for stream in self._streams:
+            Utils.create_task(self._event_listener(stream))
+
+    @property
+    def streams(self):
+
+        return self._streams
+
+    def _gen_observer(self):
+
+        return SequenceFuncWrapper()
+
+    async def _create_group(self, conn, stream):
+
+        try:
+            await conn.xgroup_create(stream, self._group_name, latest_id=r'$', mkstream=True)
+        except ReplyError as err:
+            if not str(err).startswith(r'BUSYGROUP'):
+                raise
+
+    async def _event_listener(self, stream):
+
+        async for _ in AsyncCirculatorForSecond():
+
+            if self._closed:
+                break
+
+            conn = None
+
+            try:
+
+                conn = await self._redis_pool.create_connection(stream)
+
+                await self._create_group(conn, stream)
+
+                Utils.log.info(f'event stream({stream}) consumer({self._consumer_name}) created')
+
+                claim_time = 0
+
+                while not self._closed:
+
+                    if claim_time <= Utils.loop_time():
+                        await self._reclaim_pending(conn, stream)
+                        claim_time = Utils.loop_time() + self._claim_interval
+
+                    messages = await conn.xread_group(
+                        self._group_name, self._consumer_name, [stream],
+                        timeout=self._block_time, count=self._batch_size, latest_ids=[r'>']
+                    )
+
+                    if messages:
+                        await self._event_assigner(conn, stream, [(_id, fields) for _, _id, fields in messages])
+
+            except (RedisError, OSError) as err:
+
+                Utils.log.error(f'event stream({stream}) error: {err}')
+
+            finally:
+
+                if conn is not None:
+                    conn.close()
+                    await conn.wait_closed()
+
+    async def _reclaim_pending(self, conn, stream):
+        """认领其他消费者空闲超时的未确认消息，超过最大投递次数的消息直接确认丢弃
+        """
+
+        pending = await conn.xpending(
+            stream, self._group_name, r'-', r'+', self._batch_size
+        )
+
+        claim_ids = []
+        drop_ids = []
+
+        for _id, _, idle_time, deliveries in pending:
+
+            if idle_time < self._claim_idle_time:
+                continue
+
+            if 0 < self._max_deliveries <= deliveries:
+                drop_ids.append(_id)
+            else:
+                claim_ids.append(_id)
+
+        if drop_ids:
+            Utils.log.warning(f'event stream({stream}) drop messages: {drop_ids}')
+            await conn.xack(stream, self._group_name, *drop_ids)
+
+        if claim_ids:
+
+            messages = await conn.xclaim(
+                stream, self._group_name, self._consumer_name, self._claim_idle_time, *claim_ids
+            )
+
+            if messages:
+                await self._event_assigner(conn, stream, messages)
+
+    async def _event_assigner(self, conn, stream, messages):
+
+        ack_ids = []
+
+        for _id, fields in messages:
+
+            try:
+
+                if fields:
+
+                    message = Utils.pickle_loads(fields[b'data'])
+
+                    _type = message.get(r'type', r'')
+                    args = message.get(r'args', [])
+                    kwargs = message.get(r'kwargs', {})
+
+                    if _type in self._observers:
+                        await self._observers[_type](*args, **kwargs)
+
+            except Exception as err:
+
+                # 不确认处理失败的消息，空闲超时后重新投递
+                Utils.log.error(f'event stream({stream}) message({_id}) error: {err}')
+
+            else:
+
+                ack_ids.append(_id)
+
+        if ack_ids:
+            await conn.xack(stream, self._group_name, *ack_ids)
+
+    async def dispatch(self, _type, *args, **kwargs):
+        """发布事件，返回消息ID，写入失败时抛出异常
+        """
+
+        stream = self._streams[Utils.md5_u32(_type) % len(self._streams)]
+
+        message = {
+            r'type': _type,
+            r'args': args,
+            r'kwargs': kwargs,
+        }
+
+        # 上下文管理器会吞掉异常，发布失败需要让调用方感知，这里显式释放连接
+        cache = self._redis_pool.get_client()
+
+        try:
+            return await cache.xadd(stream, {r'data': Utils.pickle_dumps(message)}, max_len=self._max_len)
+        finally:
+            await cache.release()
+
+    def close(self):
+
+        self._closed = True
 
     def gen_event_waiter(self, event_type, delay_time):
 
@@ -14,7 +14,7 @@ setup(name=r'pynaja',
       long_description=long_description,
       long_description_content_type=r'text/markdown',
       url=r'https://github.com/xiaoxiamiya/naja.git',
-      packages=find_packages(),
+      packages=find_packages(exclude=[r'tests', r'tests.*']),
       package_data={r'najapy': [r'static/*.*', r'scaffold/fastapi_example_project/fastapi_example/conf/*.*']},
       python_requires=r'>= 3.8',
       platforms=[r"all"],
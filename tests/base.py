@@ -0,0 +1,83 @@
+import asyncio
+
+from unittest import IsolatedAsyncioTestCase
+
+from pynaja.cache.redis import RedisPool, ShardedRedisPool
+from pynaja.cache.resp_server import RespServer
+
+
+class RespServerTestCase(IsolatedAsyncioTestCase):
+    """使用进程内RespServer的异步测试基类
+    """
+
+    pool_settings = {}
+
+    async def asyncSetUp(self):
+
+        self.server = await RespServer().start()
+        self.pool = await self.create_pool()
+
+    async def asyncTearDown(self):
+
+        await self.pool.close()
+        await self.server.close()
+
+    async def create_pool(self, **settings):
+
+        return await RedisPool(self.server.address, minsize=1, maxsize=8, **dict(self.pool_settings, **settings))
+
+    @staticmethod
+    async def wait_until(predicate, timeout=1, interval=0.01):
+        """等待异步条件成立，用于等待跨连接的广播消息
+        """
+
+        loop = asyncio.get_event_loop()
+
+        expire_time = loop.time() + timeout
+
+        while not await predicate():
+
+            if loop.time() >= expire_time:
+                return False
+
+            await asyncio.sleep(interval)
+
+        return True
+
+
+class ShardedRespServerTestCase(IsolatedAsyncioTestCase):
+    """使用多个进程内RespServer的分片测试基类
+    """
+
+    node_count = 3
+
+    async def asyncSetUp(self):
+
+        self.servers = [await RespServer().start() for _ in range(self.node_count)]
+
+        self.pool = await ShardedRedisPool([server.address for server in self.servers], minsize=1, maxsize=4)
+
+    async def asyncTearDown(self):
+
+        await self.pool.close()
+
+        for server in self.servers:
+            await server.close()
+
+    def server_of(self, key):
+
+        return self.servers[self.pool.nodes.index(self.pool.get_node(key))]
+
+    def spread_keys(self, prefix, count=None):
+        """生成分布在不同节点上的键
+        """
+
+        keys = {}
+
+        index = 0
+
+        while len(keys) < (count or self.node_count):
+            keys.setdefault(self.pool.get_node(f'{prefix}_{index}'), f'{prefix}_{index}')
+            index += 1
+
+        return list(keys.values())
@@ -0,0 +1,6 @@
+import collections
+import collections.abc
+
+# 兼容Python3.10及以上版本
+if not hasattr(collections, r'Iterable'):
+    collections.Iterable = collections.abc.Iterable
@@ -0,0 +1,80 @@
+from pynaja.cache.analyzer import KeyspaceAnalyzer
+
+from tests.base import RespServerTestCase, ShardedRespServerTestCase
+
+
+class KeyspaceAnalyzerTest(RespServerTestCase):
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.cache = self.pool.get_client()
+
+        for index in range(0x10):
+            await self.cache.set(f'user:{index}:profile', {r'index': index}, expire=60)
+
+        for index in range(4):
+            await self.cache.hmset_dict(f'order_{index}', {r'field': r'value'})
+
+        await self.cache._set(r'big_value', b'x' * 0x4000)
+
+    async def asyncTearDown(self):
+
+        await self.cache.release()
+
+        await super().asyncTearDown()
+
+    def test_key_pattern(self):
+
+        analyzer = KeyspaceAnalyzer(self.cache)
+
+        # 数字和长十六进制片段视为变量
+        self.assertEqual(analyzer.key_pattern(r'user:1024:profile'), r'user:*:*')
+        self.assertEqual(analyzer.key_pattern(r'order_15'), r'order_*')
+        self.assertEqual(analyzer.key_pattern(r'session_' + r'a' * 0x20), r'session_*')
+        self.assertEqual(analyzer.key_pattern(r'config'), r'config')
+
+    async def test_analyze(self):
+
+        report = await KeyspaceAnalyzer(self.cache, self.cache.value_codec, top_count=4).analyze()
+
+        self.assertEqual(report.scanned, 0x10 + 4 + 1)
+
+        self.assertEqual(report.prefixes[r'user:*:*'][r'count'], 0x10)
+        self.assertEqual(report.prefixes[r'user:*:*'][r'no_ttl'], 0)
+        self.assertEqual(report.prefixes[r'order_*'][r'types'], {r'hash': 4})
+
+        # 最大的键排在最前，没有过期时间的键单独统计
+        self.assertEqual(len(report.largest), 4)
+        self.assertEqual(report.largest[0][r'key'], r'big_value')
+        self.assertEqual(report.no_ttl[r'count'], 4 + 1)
+
+        self.assertEqual(sum(stat[r'count'] for stat in report.codecs.values()), 0x10 + 1)
+
+    async def test_sample_limit(self):
+
+        report = await KeyspaceAnalyzer(self.cache).analyze(match=r'user:*', sample_count=5, scan_count=2)
+
+        self.assertEqual(report.scanned, 5)
+        self.assertEqual(report.codecs, {})
+
+
+class ShardedKeyspaceAnalyzerTest(ShardedRespServerTestCase):
+
+    async def test_analyze(self):
+
+        cache = self.pool.get_client()
+
+        keys = self.spread_keys(r'sharded')
+
+        for key in keys:
+            await cache.set(key, 1)
+
+        report = await KeyspaceAnalyzer(cache).analyze()
+
+        # 按节点分组检查，覆盖所有节点上的键
+        self.assertEqual(report.scanned, len(keys))
+        self.assertEqual(sorted(item[r'key'] for item in report.largest), sorted(keys))
+
+        await cache.release()
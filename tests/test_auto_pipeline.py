@@ -0,0 +1,98 @@
+import asyncio
+
+from unittest import mock
+
+from aioredis.errors import ReplyError
+
+from tests.base import RespServerTestCase
+
+
+class AutoPipelineTest(RespServerTestCase):
+
+    pool_settings = {r'auto_pipeline': True}
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.buffer = self.pool._pipeline_buffer
+
+    async def test_batching(self):
+
+        cache = self.pool.get_client()
+
+        with mock.patch.object(self.buffer, r'_send_commands', wraps=self.buffer._send_commands) as send_commands:
+
+            await asyncio.gather(*(cache.set(f'batch_{index}', index) for index in range(0x20)))
+
+            # 同一事件循环帧内的命令合并为一次管道写入
+            self.assertEqual(send_commands.call_count, 1)
+            self.assertEqual(len(send_commands.call_args[0][0]), 0x20)
+
+            result = await asyncio.gather(*(cache.get(f'batch_{index}') for index in range(0x20)))
+
+            self.assertEqual(send_commands.call_count, 2)
+
+        self.assertEqual(result, list(range(0x20)))
+
+        await cache.release()
+
+    async def test_error_per_future(self):
+
+        cache = self.pool.get_client()
+
+        await cache._set(r'batch_text', b'text')
+
+        result = await asyncio.gather(
+            cache.incr(r'batch_counter'),
+            cache.incr(r'batch_text'),
+            cache.incr(r'batch_counter'),
+            return_exceptions=True
+        )
+
+        # 单个命令的错误只传递给对应的调用方
+        self.assertEqual(result[0], 1)
+        self.assertIsInstance(result[1], ReplyError)
+        self.assertEqual(result[2], 2)
+
+        await cache.release()
+
+    async def test_connection_error(self):
+
+        futures = [self.buffer.execute(b'SET', r'batch_lost', b'1'), self.buffer.execute(b'GET', r'batch_lost')]
+
+        with mock.patch.object(self.pool._pool, r'acquire', side_effect=ConnectionError(r'connection lost')):
+            await self.buffer.flush()
+
+        for future in futures:
+            self.assertIsInstance(future.exception(), ConnectionError)
+
+    async def test_flush_on_close(self):
+
+        futures = [self.buffer.execute(b'SET', f'batch_close_{index}', b'1') for index in range(4)]
+
+        # 关闭连接池时发送尚未写入的命令
+        await self.pool.close()
+
+        self.assertTrue(all(future.done() and future.result() for future in futures))
+
+        self.assertEqual(
+            sum(f'batch_close_{index}'.encode() in self.server._databases[0].data for index in range(4)), 4
+        )
+
+    async def test_excluded_commands(self):
+
+        cache = self.pool.get_client()
+        other_cache = self.pool.get_client()
+
+        # 阻塞命令使用独占连接，不会阻塞同一帧内的其他命令
+        task = asyncio.ensure_future(cache.blpop(r'batch_list', timeout=1))
+
+        await asyncio.sleep(0.05)
+
+        await asyncio.wait_for(other_cache.rpush(r'batch_list', r'value'), 0.5)
+
+        self.assertEqual(await asyncio.wait_for(task, 1), r'value')
+
+        await cache.release()
+        await other_cache.release()
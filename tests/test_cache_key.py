@@ -0,0 +1,72 @@
+from unittest import TestCase
+
+from pynaja.cache.base import CacheKeyBuilder
+
+
+def _func(a, b=None, *args, **kwargs):
+
+    return a, b
+
+
+class _Unhashable:
+
+    __hash__ = None
+
+    def __init__(self, value):
+
+        self.value = value
+
+
+class CacheKeyBuilderTest(TestCase):
+
+    def test_scalar_types(self):
+
+        builder = CacheKeyBuilder(_func)
+
+        # 值相等但类型不同的标量生成不同的键
+        keys = {builder(1), builder(1.0), builder(True), builder(r'1'), builder(b'1')}
+
+        self.assertEqual(len(keys), 5)
+        self.assertEqual(builder(1, r'a'), builder(1, r'a'))
+
+    def test_containers(self):
+
+        builder = CacheKeyBuilder(_func)
+
+        self.assertEqual(builder([1, {r'a': [2]}]), builder([1, {r'a': [2]}]))
+        self.assertEqual(builder({r'a': 1, r'b': 2}), builder({r'b': 2, r'a': 1}))
+
+        self.assertNotEqual(builder([1, 2]), builder((1, 2)))
+        self.assertNotEqual(builder([1]), builder([True]))
+
+        hash(builder({1, 2}, [{r'a'}]))
+
+    def test_digest(self):
+
+        builder = CacheKeyBuilder(_func)
+
+        # 不可哈希的对象使用序列化摘要
+        self.assertEqual(builder(_Unhashable(1)), builder(_Unhashable(1)))
+        self.assertNotEqual(builder(_Unhashable(1)), builder(_Unhashable(2)))
+
+    def test_kwargs(self):
+
+        builder = CacheKeyBuilder(_func)
+
+        self.assertEqual(builder(1, x=1, y=2), builder(1, y=2, x=1))
+
+        # 位置参数与关键字参数之间有分隔标记
+        self.assertNotEqual(builder(1, r'x', 1), builder(1, x=1))
+
+    def test_key_funcs(self):
+
+        builder = CacheKeyBuilder(_func, {r'a': None, r'b': str.lower})
+
+        # 参数名同时作用于位置参数和关键字参数
+        self.assertEqual(builder(1, r'KEY'), builder(2, r'key'))
+        self.assertEqual(builder(1, b=r'KEY'), builder(a=2, b=r'key'))
+
+        builder = CacheKeyBuilder(_func, {0: len})
+
+        self.assertEqual(builder(r'abc'), builder(r'xyz'))
+        self.assertNotEqual(builder(r'abc'), builder(r'ab'))
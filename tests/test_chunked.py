@@ -0,0 +1,69 @@
+from unittest import mock
+
+from pynaja.cache.redis import CacheMultiExec
+
+from tests.base import RespServerTestCase
+
+
+class ChunkedValueTest(RespServerTestCase):
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.cache = self.pool.get_client()
+
+    async def asyncTearDown(self):
+
+        await self.cache.release()
+
+        await super().asyncTearDown()
+
+    async def test_round_trip(self):
+
+        chunked = self.cache.chunked_value(r'chunked', chunk_size=0x10, batch_size=2)
+
+        value = {r'items': list(range(0x40))}
+
+        manifest = await chunked.set(value)
+
+        self.assertGreater(manifest[r'count'], 2)
+        self.assertEqual(await chunked.get(), value)
+
+        await chunked.set(b'raw' * 0x10)
+
+        self.assertEqual(await chunked.get(), b'raw' * 0x10)
+
+    async def test_manifest_expire(self):
+
+        chunked = self.cache.chunked_value(r'chunked_expire', chunk_size=0x10)
+
+        await chunked.set(b'x' * 0x40, expire=60)
+
+        self.assertGreater(await self.cache.ttl(r'chunked_expire'), 0)
+
+    async def test_replace_atomic(self):
+
+        chunked = self.cache.chunked_value(r'chunked_atomic', chunk_size=0x10)
+
+        old_manifest = await chunked.set(b'old', expire=60)
+
+        # 替换清单与设置有效期在同一事务中，事务失败时旧清单和有效期都保持不变
+        with mock.patch.object(CacheMultiExec, r'execute', side_effect=ConnectionError(r'connection lost')):
+            with self.assertRaises(ConnectionError):
+                await chunked.set(b'new', expire=60)
+
+        self.assertEqual(await chunked.get_manifest(), old_manifest)
+        self.assertGreater(await self.cache.ttl(r'chunked_atomic'), 0)
+        self.assertEqual(await chunked.get(), b'old')
+
+    async def test_delete(self):
+
+        chunked = self.cache.chunked_value(r'chunked_delete', chunk_size=0x10)
+
+        manifest = await chunked.set(b'x' * 0x40)
+
+        await chunked.delete()
+
+        self.assertIsNone(await chunked.get())
+        self.assertEqual(await self.cache.exists(*chunked._chunk_keys(manifest)), 0)
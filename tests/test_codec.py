@@ -0,0 +1,130 @@
+import pickle
+
+from unittest import TestCase
+
+from pynaja.cache.codec import LazyDict, LazyList, ValueCodec, ZDictTrainer
+from pynaja.common.async_base import Utils
+
+SAMPLES = [
+    0,
+    10086,
+    -1.5,
+    r'',
+    r'naja',
+    r'中文' * 0x200,
+    b'\x00\x78\x9c',
+    [1, r'two', 3.0, None],
+    {r'id': 10086, r'tags': [r'a', r'b'], r'nested': {r'flag': True}},
+    {r'payload': r'x' * 0x1000},
+]
+
+
+class ValueCodecTest(TestCase):
+
+    def test_legacy_default(self):
+
+        codec = ValueCodec()
+
+        self.assertFalse(codec.header)
+
+        # 默认写入旧版本格式，未升级的进程可以直接读取
+        for val in SAMPLES:
+            stream = codec.encode(val)
+            self.assertEqual(stream, Utils.pickle_dumps(val))
+            self.assertEqual(Utils.pickle_loads(stream), val)
+            self.assertEqual(codec.decode(stream), val)
+
+    def test_header_round_trip(self):
+
+        codec = ValueCodec(header=True)
+
+        for val in SAMPLES:
+            self.assertEqual(codec.decode(codec.encode(val)), val)
+
+        for name in (r'pickle', r'json'):
+            self.assertEqual(codec.decode(codec.encode(SAMPLES[-2], name)), SAMPLES[-2])
+
+        self.assertEqual(codec.decode(codec.encode(b'raw bytes', r'raw')), b'raw bytes')
+
+    def test_compress_threshold(self):
+
+        codec = ValueCodec(header=True, compress_threshold=0x100)
+
+        small = codec.encode(10086)
+        large = codec.encode(r'x' * 0x1000)
+
+        self.assertEqual(small[1:], pickle.dumps(10086, pickle.HIGHEST_PROTOCOL))
+        self.assertLess(len(large), 0x100)
+
+    def test_mixed_formats(self):
+
+        legacy = ValueCodec()
+        header = ValueCodec(header=True)
+
+        # 滚动升级期间两种格式的数据同时存在，任一模式都可以读取
+        for val in SAMPLES:
+            self.assertEqual(header.decode(legacy.encode(val)), val)
+            self.assertEqual(legacy.decode(header.encode(val)), val)
+
+        codec, _ = header.unpack(Utils.pickle_dumps(SAMPLES[-1]))
+
+        self.assertIsNone(codec)
+
+    def test_empty_value(self):
+
+        codec = ValueCodec(header=True)
+
+        self.assertIsNone(codec.decode(None))
+        self.assertEqual(codec.decode(b''), b'')
+
+    def test_header_required(self):
+
+        with self.assertRaises(ValueError):
+            ValueCodec(r'json')
+
+        with self.assertRaises(ValueError):
+            ValueCodec(zdicts={1: b'zdict' * 0x10}, zdict_id=1)
+
+        self.assertEqual(ValueCodec(r'json', header=True).default, r'json')
+
+    def test_zdict(self):
+
+        samples = [{r'user_id': index, r'nickname': f'user_{index}', r'level': index % 10} for index in range(0x100)]
+
+        trainer = ZDictTrainer(0x400)
+
+        for val in samples:
+            trainer.add_sample(pickle.dumps(val, pickle.HIGHEST_PROTOCOL))
+
+        zdict = trainer.train()
+
+        self.assertTrue(zdict)
+
+        codec = ValueCodec(header=True, zdicts={1: zdict}, zdict_id=1)
+
+        for val in samples:
+            self.assertEqual(codec.decode(codec.encode(val)), val)
+
+        stream = codec.encode(samples[0])
+
+        # 写入方轮换字典后，读取方仍需注册旧字典才能解码
+        with self.assertRaises(ValueError):
+            ValueCodec(header=True).decode(stream)
+
+    def test_lazy_containers(self):
+
+        codec = ValueCodec()
+
+        raw = [codec.encode(val) for val in SAMPLES] + [None]
+
+        items = LazyList(raw, codec.decode)
+
+        self.assertEqual(len(items), len(raw))
+        self.assertEqual(items[1], SAMPLES[1])
+        self.assertEqual(items[-1], None)
+        self.assertEqual(list(items), SAMPLES + [None])
+
+        fields = LazyDict({r'a': codec.encode(1), r'b': codec.encode([2])}, codec.decode)
+
+        self.assertEqual(dict(fields), {r'a': 1, r'b': [2]})
+        self.assertEqual(fields.raw(r'a'), codec.encode(1))
@@ -0,0 +1,102 @@
+from unittest import mock
+
+from pynaja.cache.redis import CacheClient, CachePipeline, LocalCounter
+
+from tests.base import RespServerTestCase
+
+
+class LocalCounterTest(RespServerTestCase):
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.counter = LocalCounter(self.pool, flush_interval=3600)
+
+    async def asyncTearDown(self):
+
+        await self.counter.close()
+
+        await super().asyncTearDown()
+
+    async def test_flush(self):
+
+        self.counter.incr(r'counter_a', 3)
+        self.counter.incr(r'counter_a', 2)
+        self.counter.decr(r'counter_b')
+        self.counter.incr(r'counter_h', 4, r'field')
+
+        self.assertEqual(await self.counter.get(r'counter_a', local=True), 5)
+        self.assertEqual(await self.counter.get(r'counter_a'), 0)
+
+        await self.counter.flush()
+
+        self.assertEqual(self.counter.size, 0)
+
+        self.assertEqual(await self.counter.get(r'counter_a'), 5)
+        self.assertEqual(await self.counter.get(r'counter_b'), -1)
+        self.assertEqual(await self.counter.get(r'counter_h', r'field'), 4)
+
+    async def test_flush_command_failure(self):
+
+        cache = self.pool.get_client()
+
+        await cache._set(r'counter_bad', b'not a number')
+
+        self.counter.incr(r'counter_bad', 2)
+        self.counter.incr(r'counter_good', 3)
+
+        await self.counter.flush()
+
+        # 只有执行失败的增量合并回本地，成功的增量不会重复写入
+        self.assertEqual(self.counter.get_delta(r'counter_bad'), 2)
+        self.assertEqual(self.counter.get_delta(r'counter_good'), 0)
+
+        self.assertEqual(await self.counter.get(r'counter_good'), 3)
+
+        await cache._set(r'counter_bad', b'10')
+
+        await self.counter.flush()
+
+        self.assertEqual(self.counter.size, 0)
+        self.assertEqual(await self.counter.get(r'counter_bad'), 12)
+        self.assertEqual(await self.counter.get(r'counter_good'), 3)
+
+        await cache.release()
+
+    async def test_flush_connection_failure(self):
+
+        self.counter.incr(r'counter_a', 2)
+        self.counter.incr(r'counter_b', 3)
+
+        with mock.patch.object(CachePipeline, r'execute', side_effect=ConnectionError(r'connection lost')):
+            await self.counter.flush()
+
+        # 执行结果未知时全部增量合并回本地，下次与新的增量一起写入
+        self.assertEqual(self.counter.get_delta(r'counter_a'), 2)
+        self.assertEqual(self.counter.get_delta(r'counter_b'), 3)
+
+        self.counter.incr(r'counter_a', 1)
+
+        await self.counter.flush()
+
+        self.assertEqual(await self.counter.get(r'counter_a'), 3)
+        self.assertEqual(await self.counter.get(r'counter_b'), 3)
+
+    async def test_flush_prepare_failure(self):
+
+        self.counter.incr(r'counter_a', 2)
+        self.counter.incr(r'counter_b', 3, r'field')
+
+        with mock.patch.object(CacheClient, r'pipeline', side_effect=RuntimeError(r'pipeline unavailable')):
+            await self.counter.flush()
+
+        # 构建pipeline阶段失败时全部增量合并回本地
+        self.assertEqual(self.counter.size, 2)
+        self.assertEqual(self.counter.get_delta(r'counter_a'), 2)
+        self.assertEqual(self.counter.get_delta(r'counter_b', r'field'), 3)
+
+        await self.counter.flush()
+
+        self.assertEqual(await self.counter.get(r'counter_a'), 2)
+        self.assertEqual(await self.counter.get(r'counter_b', r'field'), 3)
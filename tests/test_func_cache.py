@@ -0,0 +1,101 @@
+import asyncio
+
+from unittest import IsolatedAsyncioTestCase
+
+from pynaja.cache.base import FuncCache, StackCache
+from pynaja.cache.tinylfu import object_weigher
+
+
+class FuncCacheTest(IsolatedAsyncioTestCase):
+
+    async def test_cache_hit(self):
+
+        calls = []
+
+        @FuncCache(ttl=10)
+        async def _load(key):
+            calls.append(key)
+            return {r'key': key}
+
+        self.assertEqual(await _load(1), {r'key': 1})
+        self.assertEqual(await _load(1), {r'key': 1})
+        self.assertEqual(await _load(2), {r'key': 2})
+
+        self.assertEqual(calls, [1, 2])
+
+    async def test_weigher_measures_result(self):
+
+        cache = FuncCache(0x2710, ttl=10, weigher=object_weigher)
+
+        calls = []
+
+        @cache
+        async def _load(size):
+            calls.append(size)
+            return b'x' * size
+
+        # 超过权重上限的结果不会被缓存，与直接使用StackCache保存相同数据一致
+        await _load(0x19000)
+        await _load(0x19000)
+
+        self.assertEqual(calls, [0x19000, 0x19000])
+        self.assertEqual(cache.cache.size(), 0)
+
+        stack_cache = StackCache(0x2710, 10, weigher=object_weigher)
+        stack_cache.set(r'large', b'x' * 0x19000)
+
+        self.assertFalse(stack_cache.has(r'large'))
+
+        await _load(0x10)
+        await _load(0x10)
+
+        self.assertEqual(calls.count(0x10), 1)
+
+    async def test_weigher_evicts_by_result_size(self):
+
+        cache = FuncCache(0x1000, ttl=10, weigher=lambda key, val: len(val))
+
+        @cache
+        async def _load(index):
+            return b'x' * 0x400
+
+        for index in range(0x10):
+            await _load(index)
+
+        self.assertLessEqual(cache.cache.stats()[r'weight'], 0x1000)
+        self.assertLessEqual(cache.cache.size(), 4)
+
+    async def test_negative_ttl(self):
+
+        calls = []
+
+        @FuncCache(ttl=10, negative_ttl=10)
+        async def _load(key):
+            calls.append(key)
+            return None
+
+        self.assertIsNone(await _load(1))
+        self.assertIsNone(await _load(1))
+
+        self.assertEqual(calls, [1])
+
+    async def test_refresh_ahead(self):
+
+        calls = []
+
+        @FuncCache(ttl=0.2, refresh_ahead=0.5)
+        async def _load(key):
+            calls.append(key)
+            return len(calls)
+
+        self.assertEqual(await _load(1), 1)
+
+        await asyncio.sleep(0.15)
+
+        # 超过刷新时间后仍返回当前结果，由后台任务提前重新计算
+        self.assertEqual(await _load(1), 1)
+
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(await _load(1), 2)
+        self.assertEqual(len(calls), 2)
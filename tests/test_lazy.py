@@ -0,0 +1,81 @@
+from unittest import mock
+
+from pynaja.cache.codec import LazyDict, LazyList
+
+from tests.base import RespServerTestCase, ShardedRespServerTestCase
+
+
+class LazyReadTest(RespServerTestCase):
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.cache = self.pool.get_client()
+
+    async def asyncTearDown(self):
+
+        await self.cache.release()
+
+        await super().asyncTearDown()
+
+    async def test_mget(self):
+
+        await self.cache.mset(r'lazy_1', {r'index': 1}, r'lazy_2', [2])
+
+        with mock.patch.object(self.cache.value_codec, r'decode', wraps=self.cache.value_codec.decode) as decode:
+
+            result = await self.cache.mget(r'lazy_1', r'lazy_2', r'lazy_none', lazy=True)
+
+            self.assertIsInstance(result, LazyList)
+
+            # 元素在首次访问时才解码，解码结果会被缓存
+            self.assertEqual(decode.call_count, 0)
+
+            self.assertEqual(result[1], [2])
+            self.assertEqual(result[1], [2])
+
+            self.assertEqual(decode.call_count, 1)
+
+        self.assertEqual(result, [{r'index': 1}, [2], None])
+
+    async def test_hash(self):
+
+        await self.cache.hmset_dict(r'lazy_hash', {r'a': 1, r'b': [2]})
+
+        result = await self.cache.hgetall(r'lazy_hash', lazy=True)
+
+        self.assertIsInstance(result, LazyDict)
+        self.assertEqual(result, {r'a': 1, r'b': [2]})
+
+        self.assertEqual(sorted(await self.cache.hvals(r'lazy_hash', lazy=True), key=str), [1, [2]])
+
+    async def test_lrange(self):
+
+        await self.cache.rpush(r'lazy_list', {r'index': 0}, {r'index': 1})
+
+        result = await self.cache.lrange(r'lazy_list', 0, -1, lazy=True)
+
+        self.assertIsInstance(result, LazyList)
+        self.assertEqual(result[-1], {r'index': 1})
+        self.assertEqual(result[:], [{r'index': 0}, {r'index': 1}])
+
+
+class ShardedLazyReadTest(ShardedRespServerTestCase):
+
+    async def test_mget(self):
+
+        cache = self.pool.get_client()
+
+        keys = self.spread_keys(r'lazy')
+
+        for index, key in enumerate(keys):
+            await cache.set(key, {r'index': index})
+
+        result = await cache.mget(*keys, lazy=True)
+
+        # 跨节点拆分后按原顺序合并
+        self.assertIsInstance(result, LazyList)
+        self.assertEqual(result, [{r'index': index} for index in range(len(keys))])
+
+        await cache.release()
@@ -0,0 +1,248 @@
+import asyncio
+
+from unittest import mock
+
+from pynaja.cache.redis import CacheClient, LockNotifier
+
+from tests.base import RespServerTestCase, ShardedRespServerTestCase
+
+
+class MLockTest(RespServerTestCase):
+
+    async def test_exclusive(self):
+
+        cache = self.pool.get_client()
+
+        lock1 = cache.allocate_lock(r'exclusive', 5)
+        lock2 = cache.allocate_lock(r'exclusive', 5)
+
+        self.assertGreater(await lock1.acquire(), 0)
+        self.assertEqual(await lock2.acquire(), 0)
+        self.assertFalse(lock2.locked)
+
+        await lock1.release()
+
+        self.assertGreater(await lock2.acquire(), 0)
+
+        await lock2.release()
+        await cache.release()
+
+    async def test_fencing_token(self):
+
+        cache = self.pool.get_client()
+
+        tokens = []
+
+        for key in (r'fence_a', r'fence_b', r'fence_a'):
+
+            lock = cache.allocate_lock(key, 5)
+
+            tokens.append(await lock.acquire())
+
+            self.assertEqual(lock.fencing_token, tokens[-1])
+
+            await lock.release()
+
+        # 所有锁共享同一个计数器，后获取的锁得到更大的token
+        self.assertEqual(tokens, sorted(tokens))
+        self.assertEqual(len(set(tokens)), len(tokens))
+
+        await cache.release()
+
+    async def test_wait_notify(self):
+
+        cache = self.pool.get_client()
+
+        holder = cache.allocate_lock(r'notify', 30)
+
+        await holder.acquire()
+
+        waiter = cache.allocate_lock(r'notify', 30)
+
+        task = asyncio.ensure_future(waiter.acquire(5))
+
+        await asyncio.sleep(0.05)
+
+        self.assertFalse(task.done())
+
+        await holder.release()
+
+        # 释放通知唤醒等待者，不需要等到轮询间隔
+        self.assertGreater(await asyncio.wait_for(task, 1), 0)
+
+        await waiter.release()
+        await cache.release()
+
+    async def test_try_lock_without_notify(self):
+
+        cache = self.pool.get_client()
+
+        holder = cache.allocate_lock(r'try_lock', 5)
+
+        with mock.patch.object(LockNotifier, r'watch') as watch, \
+                mock.patch.object(CacheClient, r'publish') as publish:
+
+            self.assertGreater(await holder.acquire(), 0)
+            self.assertEqual(await cache.allocate_lock(r'try_lock', 5).acquire(), 0)
+
+            await holder.release()
+
+            reader = cache.allocate_rwlock(r'try_rwlock', 5)
+
+            self.assertGreater(await reader.acquire(), 0)
+
+            await reader.release()
+
+        # 非阻塞获取不订阅释放通知，没有等待者时释放不广播
+        self.assertEqual(watch.call_count, 0)
+        self.assertEqual(publish.call_count, 0)
+
+        await cache.release()
+
+    async def test_notify_waiting_only(self):
+
+        cache = self.pool.get_client()
+
+        holder = cache.allocate_lock(r'notify_waiting', 30)
+
+        await holder.acquire()
+
+        waiter = cache.allocate_lock(r'notify_waiting', 30)
+
+        task = asyncio.ensure_future(waiter.acquire(5))
+
+        await asyncio.sleep(0.05)
+
+        with mock.patch.object(LockNotifier, r'notify', wraps=cache.lock_notifier.notify) as notify:
+
+            await holder.release()
+
+            self.assertGreater(await asyncio.wait_for(task, 1), 0)
+
+            # 阻塞等待者登记了等待标记，释放时广播通知
+            self.assertEqual(notify.call_count, 1)
+
+        await waiter.release()
+        await cache.release()
+
+    async def test_fair_order(self):
+
+        cache = self.pool.get_client()
+
+        holder = cache.allocate_lock(r'fair', 30, fair=True)
+
+        await holder.acquire()
+
+        order = []
+
+        async def _acquire(index):
+
+            lock = cache.allocate_lock(r'fair', 30, fair=True)
+
+            if await lock.acquire(5):
+                order.append(index)
+                await asyncio.sleep(0.01)
+                await lock.release()
+
+        tasks = []
+
+        for index in range(4):
+            tasks.append(asyncio.ensure_future(_acquire(index)))
+            await asyncio.sleep(0.02)
+
+        await holder.release()
+
+        await asyncio.wait_for(asyncio.gather(*tasks), 5)
+
+        self.assertEqual(order, [0, 1, 2, 3])
+
+        await cache.release()
+
+
+class MRWLockTest(RespServerTestCase):
+
+    async def test_shared_readers(self):
+
+        cache = self.pool.get_client()
+
+        reader1 = cache.allocate_rwlock(r'rw', 5)
+        reader2 = cache.allocate_rwlock(r'rw', 5)
+        writer = cache.allocate_rwlock(r'rw', 5, write=True)
+
+        self.assertGreater(await reader1.acquire(), 0)
+        self.assertGreater(await reader2.acquire(), 0)
+
+        self.assertEqual(await writer.acquire(), 0)
+
+        await reader1.release()
+        await reader2.release()
+
+        self.assertGreater(await writer.acquire(), 0)
+
+        self.assertEqual(await cache.allocate_rwlock(r'rw', 5).acquire(), 0)
+
+        await writer.release()
+        await cache.release()
+
+    async def test_waiting_writer_blocks_readers(self):
+
+        cache = self.pool.get_client()
+
+        reader = cache.allocate_rwlock(r'rw_wait', 5)
+
+        await reader.acquire()
+
+        writer = cache.allocate_rwlock(r'rw_wait', 5, write=True)
+
+        task = asyncio.ensure_future(writer.acquire(5))
+
+        await asyncio.sleep(0.05)
+
+        # 写锁等待期间新的读锁不能进入，避免写锁饥饿
+        self.assertEqual(await cache.allocate_rwlock(r'rw_wait', 5).acquire(), 0)
+
+        await reader.release()
+
+        self.assertGreater(await asyncio.wait_for(task, 1), 0)
+
+        await writer.release()
+        await cache.release()
+
+
+class ShardedLockTest(ShardedRespServerTestCase):
+
+    async def test_helper_keys_routing(self):
+
+        cache = self.pool.get_client()
+
+        for key in (r'order_1', r'order_2', r'{user_1}_profile', r'{user_2}_profile'):
+
+            lock = cache.allocate_rwlock(key, 5)
+
+            # 辅助键与锁使用相同的哈希标签，分片模式下脚本涉及的键都在同一节点
+            for tag in (
+                    lock._readers_tag, lock._writer_wait_tag, lock._queue_tag, lock._queue_seen_tag, lock._waiting_tag
+            ):
+                self.assertIs(self.pool.get_node(tag), self.pool.get_node(lock._lock_tag))
+
+        await cache.release()
+
+    async def test_lock_routing(self):
+
+        cache = self.pool.get_client()
+
+        for index in range(8):
+
+            lock = cache.allocate_lock(f'shard_{index}', 5, fair=True)
+
+            self.assertGreater(await lock.acquire(), 0)
+
+            data = self.server_of(lock._lock_tag)._databases[0].data
+
+            self.assertIn(lock._lock_tag.encode(), data)
+
+            await lock.release()
+
+            self.assertNotIn(lock._lock_tag.encode(), data)
+
+        await cache.release()
@@ -0,0 +1,201 @@
+import asyncio
+
+from unittest import mock
+
+from aioredis.util import _NOTSET
+
+from pynaja.cache.base import ShareFuture
+from pynaja.cache.redis import CacheClient
+from pynaja.common.async_base import Utils
+
+from tests.base import RespServerTestCase
+
+
+class NearCacheTest(RespServerTestCase):
+    """两个连接池模拟两个工作进程，验证写操作广播的失效消息
+    """
+
+    pool_settings = {r'near_cache_size': 0x100, r'near_cache_ttl': 60}
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.other_pool = await self.create_pool()
+
+        self.cache = self.pool.get_client()
+        self.other_cache = self.other_pool.get_client()
+
+    async def asyncTearDown(self):
+
+        await self.cache.release()
+        await self.other_cache.release()
+
+        await self.other_pool.close()
+
+        await super().asyncTearDown()
+
+    async def _wait_value(self, key, value):
+
+        async def _predicate():
+            return await self.cache.get(key) == value
+
+        return await self.wait_until(_predicate)
+
+    async def _cached(self, key):
+
+        # 等待本节点写入产生的失效消息回显，之后的读取结果才会保留在本地
+        await asyncio.sleep(0.05)
+
+        await self.cache.get(key)
+
+        return self.pool._near_cache.get_value(key)
+
+    async def test_set_invalidation(self):
+
+        await self.cache.set(r'near_set', {r'version': 1})
+
+        self.assertEqual(await self._cached(r'near_set'), {r'version': 1})
+
+        await self.other_cache.set(r'near_set', {r'version': 2})
+
+        self.assertTrue(await self._wait_value(r'near_set', {r'version': 2}))
+
+    async def test_delete_invalidation(self):
+
+        await self.cache.set(r'near_delete', 1)
+
+        self.assertEqual(await self._cached(r'near_delete'), 1)
+
+        await self.other_cache.delete(r'near_delete')
+
+        self.assertTrue(await self._wait_value(r'near_delete', None))
+
+    async def test_raw_command_invalidation(self):
+
+        await self.cache.set(r'near_raw', r'value')
+
+        self.assertEqual(await self._cached(r'near_raw'), r'value')
+
+        # 绕过编码方法的原始命令同样会广播失效消息
+        await self.other_cache.execute(r'EXPIRE', r'near_raw', 0)
+
+        self.assertTrue(await self._wait_value(r'near_raw', None))
+
+    async def test_field_invalidation(self):
+
+        await self.cache.hset(r'near_hash', r'field', [1])
+
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(await self.cache.hget(r'near_hash', r'field'), [1])
+
+        await self.other_cache.hset(r'near_hash', r'field', [2])
+
+        async def _predicate():
+            return await self.cache.hget(r'near_hash', r'field') == [2]
+
+        self.assertTrue(await self.wait_until(_predicate))
+
+    async def test_flush_invalidation(self):
+
+        await self.cache.set(r'near_flush', 1)
+
+        self.assertEqual(await self._cached(r'near_flush'), 1)
+
+        await self.other_cache.execute(r'FLUSHDB')
+
+        self.assertTrue(await self._wait_value(r'near_flush', None))
+
+    async def test_redis_ttl(self):
+
+        await self.other_cache.set(r'near_ttl', 1, expire=1)
+
+        self.assertEqual(await self._cached(r'near_ttl'), 1)
+
+        # 本地数据的有效期不超过Redis中数据的有效期
+        expire_time, _ = self.pool._near_cache._values.get(r'near_ttl')
+
+        self.assertGreater(expire_time, 0)
+
+        await asyncio.sleep(1.1)
+
+        self.assertIsNone(await self.cache.get(r'near_ttl'))
+
+    async def test_reconnect_clear(self):
+
+        near_cache = self.pool._near_cache
+
+        await self.cache.set(r'near_reconnect', 1)
+
+        self.assertEqual(await self._cached(r'near_reconnect'), 1)
+
+        # 模拟订阅连接断开，断线期间的失效消息会丢失
+        self.pool.pubsub._receiver.stop()
+
+        async def _disconnected():
+            return not self.pool.pubsub.connected
+
+        self.assertTrue(await self.wait_until(_disconnected))
+
+        self.assertIs(near_cache.get_value(r'near_reconnect'), _NOTSET)
+
+        # 断开期间读取的结果不写入本地缓存
+        self.assertEqual(await self.cache.get(r'near_reconnect'), 1)
+        self.assertIs(near_cache.get_value(r'near_reconnect'), _NOTSET)
+
+        async def _connected():
+            return self.pool.pubsub.connected
+
+        # 重新订阅后恢复本地缓存
+        self.assertTrue(await self.wait_until(_connected, 2))
+
+        self.assertEqual(await self._cached(r'near_reconnect'), 1)
+
+    async def test_publish_error(self):
+
+        near_cache = self.pool._near_cache
+
+        await self.cache.set(r'near_publish', 1)
+
+        self.assertEqual(await self._cached(r'near_publish'), 1)
+
+        with mock.patch.object(CacheClient, r'publish', side_effect=ConnectionError(r'connection lost')):
+            with mock.patch.object(Utils.log, r'error') as log_error:
+                await near_cache.invalidate(r'near_publish')
+
+        self.assertEqual(log_error.call_count, 1)
+
+        # 广播失败时本地数据仍然被丢弃
+        self.assertIs(near_cache.get_value(r'near_publish'), _NOTSET)
+
+    async def test_deepcopy(self):
+
+        await self.cache.set(r'near_copy', {r'items': [1]})
+
+        value = await self.cache.get(r'near_copy')
+        value[r'items'].append(2)
+
+        self.assertEqual(await self.cache.get(r'near_copy'), {r'items': [1]})
+
+
+class FrozenNearCacheTest(RespServerTestCase):
+
+    pool_settings = {r'near_cache_size': 0x100, r'near_cache_copy': ShareFuture.COPY_FROZEN}
+
+    async def test_frozen(self):
+
+        cache = self.pool.get_client()
+
+        await cache.set(r'near_frozen', {r'items': [1]})
+
+        await asyncio.sleep(0.05)
+
+        value = await cache.get(r'near_frozen')
+
+        with self.assertRaises(TypeError):
+            value[r'items'] = None
+
+        self.assertIs(await cache.get(r'near_frozen'), value)
+
+        await cache.release()
@@ -0,0 +1,100 @@
+from unittest import mock
+
+from aioredis.commands.transaction import Pipeline
+from aioredis.errors import MultiExecError, PipelineError, ReplyError, WatchVariableError
+
+from tests.base import RespServerTestCase
+
+
+class CachePipelineTest(RespServerTestCase):
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.cache = self.pool.get_client()
+
+    async def asyncTearDown(self):
+
+        await self.cache.release()
+
+        await super().asyncTearDown()
+
+    async def test_codec(self):
+
+        pipe = self.cache.pipeline()
+
+        pipe.set(r'pipe_value', {r'items': [1]})
+        future = pipe.get(r'pipe_value')
+        pipe.hset(r'pipe_hash', r'field', [1, 2])
+        pipe.hget(r'pipe_hash', r'field')
+
+        # 命令参数和返回结果与客户端方法一致，数据自动编解码
+        self.assertEqual(await pipe.execute(), [True, {r'items': [1]}, 1, [1, 2]])
+        self.assertEqual(future.result(), {r'items': [1]})
+
+        self.assertEqual(await self.cache.hget(r'pipe_hash', r'field'), [1, 2])
+
+    async def test_reply_error(self):
+
+        await self.cache.set(r'pipe_text', r'text')
+
+        pipe = self.cache.pipeline()
+
+        pipe.incr(r'pipe_counter')
+        pipe.incr(r'pipe_text')
+
+        result = await pipe.execute(return_exceptions=True)
+
+        self.assertEqual(result[0], 1)
+        self.assertIsInstance(result[1], ReplyError)
+
+        pipe = self.cache.pipeline()
+        pipe.incr(r'pipe_text')
+
+        with self.assertRaises(PipelineError):
+            await pipe.execute()
+
+        # 命令错误不丢弃连接
+        self.assertIsNotNone(self.cache._pool_or_conn)
+
+    async def test_connection_error_not_replayed(self):
+
+        pipe = self.cache.pipeline()
+        pipe.incr(r'pipe_replay')
+
+        with mock.patch.object(Pipeline, r'execute', side_effect=ConnectionError(r'connection lost')):
+            with self.assertRaises(ConnectionError):
+                await pipe.execute()
+
+        # 连接异常时丢弃连接，不重放可能包含非幂等命令的批次
+        self.assertIsNone(self.cache._pool_or_conn)
+        self.assertIsNone(await self.cache.get(r'pipe_replay'))
+
+    async def test_multi_exec(self):
+
+        tr = self.cache.multi_exec()
+
+        tr.set(r'tr_value', {r'version': 1})
+        tr.get(r'tr_value')
+
+        self.assertEqual(await tr.execute(), [True, {r'version': 1}])
+
+    async def test_watch(self):
+
+        other_cache = self.pool.get_client()
+
+        await self.cache.watch(r'tr_watch')
+
+        # WATCH之后的事务使用同一连接，被其他连接修改时事务失败
+        await other_cache.set(r'tr_watch', 1)
+
+        tr = self.cache.multi_exec()
+        tr.set(r'tr_watch', 2)
+
+        with self.assertRaises((WatchVariableError, MultiExecError)):
+            await tr.execute()
+
+        self.assertEqual(await self.cache.get(r'tr_watch'), 1)
+
+        await other_cache.release()
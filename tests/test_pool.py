@@ -0,0 +1,98 @@
+import asyncio
+
+from aioredis.abc import AbcPool
+
+from pynaja.cache.redis import AdaptivePool
+
+from tests.base import RespServerTestCase
+
+
+class RedisPoolMetricsTest(RespServerTestCase):
+
+    async def test_stats(self):
+
+        cache = self.pool.get_client()
+
+        await cache.set(r'metrics', 1)
+        await cache.get(r'metrics')
+
+        await cache.release()
+
+        stats = self.pool.stats()
+
+        self.assertEqual(stats[r'maxsize'], 8)
+        self.assertGreater(stats[r'acquire_wait'][r'count'], 0)
+        self.assertIn(r'SET', stats[r'commands'])
+
+
+class AdaptivePoolTest(RespServerTestCase):
+
+    pool_settings = {r'adaptive_maxsize': 0x10}
+
+    async def test_abc_pool(self):
+
+        pool = self.pool._pool
+
+        self.assertIsInstance(pool, AdaptivePool)
+        self.assertIsInstance(pool, AbcPool)
+
+        self.assertEqual(pool.maxsize, 8)
+
+    async def test_resize(self):
+
+        pool = self.pool._pool
+
+        pool.resize(0xc)
+
+        self.assertEqual(pool.maxsize, 0xc)
+
+        # 不能超过底层连接池的上限，也不会缩小
+        pool.resize(0x20)
+        self.assertEqual(pool.maxsize, 0x10)
+
+        pool.resize(4)
+        self.assertEqual(pool.maxsize, 0x10)
+
+    async def test_acquire_limit(self):
+
+        pool = self.pool._pool
+
+        conns = [await pool.acquire() for _ in range(pool.maxsize)]
+
+        # 达到当前上限后等待其他连接释放
+        task = asyncio.ensure_future(pool.acquire())
+
+        await asyncio.sleep(0.05)
+
+        self.assertFalse(task.done())
+
+        pool.release(conns.pop())
+
+        conns.append(await asyncio.wait_for(task, 1))
+
+        for conn in conns:
+            pool.release(conn)
+
+    async def test_raw_pipeline(self):
+
+        cache = self.pool.get_client()
+
+        pipe = cache.raw_pipeline()
+        pipe.set(r'raw_pipeline', b'1')
+        pipe.incr(r'raw_pipeline')
+
+        self.assertEqual(await pipe.execute(), [True, 2])
+
+        await cache.release()
+
+    async def test_raw_multi_exec(self):
+
+        cache = self.pool.get_client()
+
+        tr = cache.raw_multi_exec()
+        tr.set(r'raw_multi_exec', b'1')
+        tr.get(r'raw_multi_exec')
+
+        self.assertEqual(await tr.execute(), [True, b'1'])
+
+        await cache.release()
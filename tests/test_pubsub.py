@@ -0,0 +1,126 @@
+from pynaja.event.async_event import DistributedEvent
+
+from tests.base import RespServerTestCase
+
+
+class PubSubMultiplexerTest(RespServerTestCase):
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.pubsub = self.pool.pubsub
+        self.cache = self.pool.get_client()
+
+    async def asyncTearDown(self):
+
+        await self.cache.release()
+
+        await super().asyncTearDown()
+
+    async def _connected(self):
+
+        return self.pubsub.connected
+
+    async def _publish_until(self, channel, messages, count=1):
+        """订阅是异步建立的，重复发布直到收到消息
+        """
+
+        async def _predicate():
+
+            if len(messages) < count:
+                await self.cache.publish(channel, r'message')
+
+            return len(messages) >= count
+
+        return await self.wait_until(_predicate, interval=0.02)
+
+    async def test_shared_connection(self):
+
+        messages = []
+
+        for index in range(4):
+            self.pubsub.subscribe(f'pubsub_{index}', messages.append)
+
+        self.assertTrue(await self._publish_until(r'pubsub_3', messages))
+
+        # 所有频道复用同一条订阅连接
+        subscribers = set()
+
+        for index in range(4):
+            subscribers.update(self.server._channels[f'pubsub_{index}'.encode()])
+
+        self.assertEqual(len(subscribers), 1)
+
+    async def test_unsubscribe(self):
+
+        messages = []
+        other_messages = []
+
+        self.pubsub.subscribe(r'pubsub_channel', messages.append)
+        self.pubsub.subscribe(r'pubsub_channel', other_messages.append)
+
+        self.assertTrue(await self._publish_until(r'pubsub_channel', other_messages))
+
+        self.pubsub.unsubscribe(r'pubsub_channel', messages.append)
+
+        self.assertIn(b'pubsub_channel', self.pubsub.channels)
+
+        self.pubsub.unsubscribe(r'pubsub_channel', other_messages.append)
+
+        self.assertNotIn(b'pubsub_channel', self.pubsub.channels)
+
+        async def _unsubscribed():
+            return not self.server._channels.get(b'pubsub_channel')
+
+        # 最后一个回调取消后在服务端取消订阅，连接保持
+        self.assertTrue(await self.wait_until(_unsubscribed))
+        self.assertTrue(self.pubsub.connected)
+
+    async def test_pattern(self):
+
+        messages = []
+
+        self.pubsub.psubscribe(r'pubsub_pattern_*', messages.append)
+
+        self.assertTrue(await self._publish_until(r'pubsub_pattern_1', messages))
+        self.assertEqual(messages[0], b'message')
+
+    async def test_resubscribe(self):
+
+        messages = []
+
+        self.pubsub.subscribe(r'pubsub_reconnect', messages.append)
+
+        self.assertTrue(await self._publish_until(r'pubsub_reconnect', messages))
+
+        self.pubsub._receiver.stop()
+
+        async def _disconnected():
+            return not self.pubsub.connected
+
+        self.assertTrue(await self.wait_until(_disconnected))
+
+        # 重连后按当前订阅状态恢复订阅
+        self.assertTrue(await self.wait_until(self._connected, 2))
+        self.assertTrue(await self._publish_until(r'pubsub_reconnect', messages, len(messages) + 1))
+
+    async def test_distributed_event(self):
+
+        event = DistributedEvent(self.pool, r'pubsub_event', 2)
+
+        received = []
+
+        event.add_listener(r'ping', lambda *args: received.append(args))
+
+        self.assertTrue(await self.wait_until(self._connected))
+
+        await event.dispatch(r'ping', 1, 2)
+
+        async def _received():
+            return len(received) > 0
+
+        self.assertTrue(await self.wait_until(_received))
+        self.assertEqual(received[0], (1, 2))
+
+        event.close()
@@ -0,0 +1,76 @@
+from pynaja.cache.redis import RedisPool
+from pynaja.cache.resp_server import RespServer
+
+from tests.base import RespServerTestCase
+
+
+class ReplicaReadTest(RespServerTestCase):
+    """使用独立的RespServer模拟未同步的从库，读取结果可以区分命令在哪个节点执行
+    """
+
+    pool_settings = {r'auto_pipeline': True}
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.replica_server = await RespServer().start()
+        self.replica_pool = await RedisPool(self.replica_server.address, minsize=1, maxsize=4)
+
+        self.pool.add_replica(self.replica_pool)
+
+    async def asyncTearDown(self):
+
+        await super().asyncTearDown()
+
+        await self.replica_server.close()
+
+    async def _set_replica(self, key, value):
+
+        cache = self.replica_pool.get_client()
+
+        await cache.set(key, value)
+        await cache.release()
+
+    async def test_replica_read(self):
+
+        await self._set_replica(r'replica_key', r'replica')
+
+        cache = self.pool.get_client()
+
+        self.assertEqual(await cache.get(r'replica_key'), r'replica')
+
+        await cache.release()
+
+    async def test_read_your_writes(self):
+
+        await self._set_replica(r'replica_ryw', r'replica')
+
+        cache = self.pool.get_client()
+
+        # 自动管道模式下写命令不占用专用连接，之后的读取仍然在主库执行
+        await cache.set(r'replica_ryw', r'primary')
+
+        self.assertIsNone(cache._pool_or_conn)
+        self.assertEqual(await cache.get(r'replica_ryw'), r'primary')
+
+        await cache.release()
+
+        # 释放后的客户端重新从从库读取
+        self.assertEqual(await cache.get(r'replica_ryw'), r'replica')
+
+        await cache.release()
+
+    async def test_delete_pattern_on_primary(self):
+
+        cache = self.pool.get_client()
+
+        await cache.mset(r'replica_pattern_1', 1, r'replica_pattern_2', 2)
+
+        await cache.release()
+
+        # 从库中没有匹配的键，SCAN需要在主库执行
+        self.assertEqual(await cache.delete_pattern(r'replica_pattern_*'), 2)
+        self.assertEqual(self.server._databases[0].data.get(b'replica_pattern_1'), None)
+
+        await cache.release()
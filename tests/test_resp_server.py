@@ -0,0 +1,95 @@
+import asyncio
+
+import aioredis
+
+from aioredis.errors import ReplyError
+
+from tests.base import RespServerTestCase
+
+
+class RespServerTest(RespServerTestCase):
+    """直接使用aioredis连接验证RespServer的协议行为
+    """
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.conn = await aioredis.create_redis(self.server.address)
+
+    async def asyncTearDown(self):
+
+        self.conn.close()
+        await self.conn.wait_closed()
+
+        await super().asyncTearDown()
+
+    async def test_string_expire(self):
+
+        self.assertTrue(await self.conn.set(r'resp_key', r'value', pexpire=50))
+        self.assertEqual(await self.conn.get(r'resp_key'), b'value')
+        self.assertGreater(await self.conn.pttl(r'resp_key'), 0)
+
+        await asyncio.sleep(0.06)
+
+        self.assertIsNone(await self.conn.get(r'resp_key'))
+
+    async def test_wrong_arity(self):
+
+        with self.assertRaises(ReplyError):
+            await self.conn.execute(r'GET')
+
+        # 参数错误不影响连接上的后续命令
+        self.assertEqual(await self.conn.ping(), b'PONG')
+
+    async def test_multi_exec(self):
+
+        tr = self.conn.multi_exec()
+        tr.incr(r'resp_counter')
+        tr.incr(r'resp_counter')
+
+        self.assertEqual(await tr.execute(), [1, 2])
+
+    async def test_scan_with_delete(self):
+
+        keys = {f'resp_scan_{index}'.encode() for index in range(0x40)}
+
+        for key in keys:
+            await self.conn.set(key, b'1')
+
+        seen = set()
+
+        cursor = b'0'
+
+        while True:
+
+            cursor, batch = await self.conn.scan(cursor, count=8)
+
+            seen.update(batch)
+
+            # 遍历期间删除已返回的键，不会导致其余的键被遗漏
+            if batch:
+                await self.conn.unlink(*batch)
+
+            if not cursor:
+                break
+
+        self.assertEqual(seen, keys)
+
+    async def test_pubsub(self):
+
+        sub = await aioredis.create_redis(self.server.address)
+
+        channel, = await sub.subscribe(r'resp_channel')
+
+        self.assertEqual(await self.conn.publish(r'resp_channel', r'message'), 1)
+
+        self.assertEqual(await asyncio.wait_for(channel.get(), 1), b'message')
+
+        sub.close()
+        await sub.wait_closed()
+
+    async def test_unknown_script(self):
+
+        with self.assertRaises(ReplyError):
+            await self.conn.eval(r'return 1')
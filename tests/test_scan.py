@@ -0,0 +1,93 @@
+from unittest import mock
+
+from pynaja.cache.redis import CacheClient
+
+from tests.base import RespServerTestCase, ShardedRespServerTestCase
+
+
+class ScanTest(RespServerTestCase):
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.cache = self.pool.get_client()
+
+        pairs = []
+
+        for index in range(0x30):
+            pairs.extend((f'scan_{index}', index))
+
+        await self.cache.mset(*pairs)
+
+        await self.cache.set(r'other', 1)
+
+    async def asyncTearDown(self):
+
+        await self.cache.release()
+
+        await super().asyncTearDown()
+
+    async def test_iscan(self):
+
+        keys = [key async for key in self.cache.iscan(match=r'scan_*', count=0x10)]
+
+        self.assertEqual(len(keys), 0x30)
+        self.assertEqual(len(set(keys)), 0x30)
+
+        batches = [batch async for batch in self.cache.iscan(match=r'scan_*', count=0x10, batch=True)]
+
+        self.assertTrue(all(isinstance(batch, list) for batch in batches))
+        self.assertEqual(sum(len(batch) for batch in batches), 0x30)
+
+    async def test_isscan_ihscan(self):
+
+        await self.cache.sadd(r'scan_set', *(str(index) for index in range(0x20)))
+        await self.cache.hmset_dict(r'scan_hash', {f'field_{index}': index for index in range(0x20)})
+
+        members = [member async for member in self.cache.isscan(r'scan_set', count=8)]
+        fields = [field async for field in self.cache.ihscan(r'scan_hash', count=8)]
+
+        self.assertEqual(len(set(members)), 0x20)
+        self.assertEqual(len(fields), 0x20)
+
+    async def test_delete_pattern(self):
+
+        with mock.patch.object(CacheClient, r'keys') as keys, \
+                mock.patch.object(CacheClient, r'_unlink_batch', wraps=self.cache._unlink_batch) as unlink_batch:
+
+            self.assertEqual(await self.cache.delete_pattern(r'scan_*', batch_size=0x10), 0x30)
+
+        # 使用SCAN遍历，按批次UNLINK
+        self.assertEqual(keys.call_count, 0)
+        self.assertGreaterEqual(unlink_batch.call_count, 3)
+
+        self.assertEqual(await self.cache.exists(r'other'), 1)
+        self.assertEqual([key async for key in self.cache.iscan(match=r'scan_*')], [])
+
+    async def test_delete_wildcard(self):
+
+        self.assertEqual(await self.cache.delete(r'other', r'scan_1*'), 1 + 0xb)
+
+        self.assertEqual(await self.cache.exists(r'scan_1', r'scan_10', r'scan_2'), 1)
+
+
+class ShardedScanTest(ShardedRespServerTestCase):
+
+    async def test_fan_out(self):
+
+        cache = self.pool.get_client()
+
+        keys = self.spread_keys(r'scan')
+
+        for key in keys:
+            await cache.set(key, 1)
+
+        # 遍历和按模式删除在所有节点上执行
+        self.assertEqual(sorted([key async for key in cache.iscan(match=r'scan_*')]), sorted(keys))
+
+        self.assertEqual(await cache.delete_pattern(r'scan_*'), len(keys))
+
+        self.assertEqual(await cache.exists(*keys), 0)
+
+        await cache.release()
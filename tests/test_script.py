@@ -0,0 +1,62 @@
+from unittest import mock
+
+from pynaja.cache.redis import CacheClient
+
+from tests.base import RespServerTestCase
+
+
+_ECHO_SCRIPT = r'return ARGV[1]'
+
+
+def _echo_script(call, keys, args):
+
+    return args[0]
+
+
+class ScriptRegistryTest(RespServerTestCase):
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.server.register_script(_ECHO_SCRIPT, _echo_script)
+        self.pool.register_script(r'echo', _ECHO_SCRIPT)
+
+        self.cache = self.pool.get_client()
+
+    async def asyncTearDown(self):
+
+        await self.cache.release()
+
+        await super().asyncTearDown()
+
+    async def test_preload(self):
+
+        registry = self.pool.script_registry
+
+        # 内置脚本在连接池初始化时预先加载
+        for name, source in registry.scripts.items():
+            if name != r'echo':
+                self.assertIn(registry.digest(source), self.server._scripts)
+
+    async def test_evalsha(self):
+
+        await self.cache.script_load(_ECHO_SCRIPT)
+
+        with mock.patch.object(CacheClient, r'eval') as _eval:
+            self.assertEqual(await self.cache.run_script(r'echo', [], [r'value']), b'value')
+
+        # 通过EVALSHA执行，不发送脚本源码
+        self.assertEqual(_eval.call_count, 0)
+
+    async def test_reload_on_noscript(self):
+
+        await self.cache.script_flush()
+
+        with mock.patch.object(CacheClient, r'script_load', wraps=self.cache.script_load) as script_load:
+
+            self.assertEqual(await self.cache.run_script(r'echo', [], [r'value']), b'value')
+            self.assertEqual(await self.cache.run_script(_ECHO_SCRIPT, [], [r'value']), b'value')
+
+        # 服务端脚本缓存丢失后自动重新加载一次
+        self.assertEqual(script_load.call_count, 1)
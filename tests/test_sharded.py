@@ -0,0 +1,93 @@
+from tests.base import ShardedRespServerTestCase
+
+
+class ShardedCacheClientTest(ShardedRespServerTestCase):
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.cache = self.pool.get_client()
+
+    async def asyncTearDown(self):
+
+        await self.cache.release()
+
+        await super().asyncTearDown()
+
+    async def test_single_key_routing(self):
+
+        keys = self.spread_keys(r'single')
+
+        for index, key in enumerate(keys):
+            await self.cache.set(key, index)
+
+        for index, key in enumerate(keys):
+            self.assertIn(key.encode(), self.server_of(key)._databases[0].data)
+            self.assertEqual(await self.cache.get(key), index)
+
+    async def test_split_multi_key(self):
+
+        keys = self.spread_keys(r'split')
+
+        pairs = []
+
+        for index, key in enumerate(keys):
+            pairs.extend((key, index))
+
+        await self.cache.mset(*pairs)
+
+        self.assertEqual(await self.cache.mget(*keys), list(range(len(keys))))
+        self.assertEqual(await self.cache.exists(*keys), len(keys))
+
+        self.assertEqual(await self.cache.unlink(*keys[:2]), 2)
+        self.assertEqual(await self.cache.delete(*keys[2:]), len(keys) - 2)
+
+        self.assertEqual(await self.cache.exists(*keys), 0)
+
+    async def test_cross_node_rejected(self):
+
+        keys = self.spread_keys(r'cross')
+
+        # 无法拆分的多键命令跨节点时抛出异常，而不是在单个节点上返回错误结果
+        with self.assertRaises(ValueError):
+            await self.cache.sinter(*keys)
+
+        with self.assertRaises(ValueError):
+            await self.cache.rename(keys[0], keys[1])
+
+        with self.assertRaises(ValueError):
+            await self.cache.msetnx(keys[0], 1, keys[1], 2)
+
+        with self.assertRaises(ValueError):
+            await self.cache._blpop(keys[0], keys[1], timeout=1)
+
+    async def test_hash_tag(self):
+
+        keys = [r'{group}_a', r'{group}_b', r'{group}_c']
+
+        await self.cache.sadd(keys[0], r'1', r'2')
+        await self.cache.sadd(keys[1], r'2', r'3')
+
+        self.assertEqual(await self.cache.sinter(keys[0], keys[1]), [r'2'])
+
+        await self.cache.rename(keys[1], keys[2])
+
+        self.assertEqual(sorted(await self.cache.smembers(keys[2])), [r'2', r'3'])
+
+    async def test_pipeline(self):
+
+        with self.assertRaises(ValueError):
+            self.cache.pipeline()
+
+        with self.assertRaises(ValueError):
+            self.cache.multi_exec()
+
+        key = self.spread_keys(r'pipeline')[-1]
+
+        pipe = self.cache.get_node_client(key).pipeline()
+        pipe.set(key, r'value')
+
+        await pipe.execute()
+
+        self.assertEqual(await self.cache.get(key), r'value')
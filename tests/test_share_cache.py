@@ -0,0 +1,113 @@
+import asyncio
+
+from unittest import mock
+
+from pynaja.cache.redis import ShareCache
+from pynaja.common.async_base import Utils
+
+from tests.base import RespServerTestCase
+
+
+class ShareCacheTest(RespServerTestCase):
+
+    async def asyncSetUp(self):
+
+        await super().asyncSetUp()
+
+        self.cache = self.pool.get_client()
+
+    async def asyncTearDown(self):
+
+        await self.cache.release()
+
+        await super().asyncTearDown()
+
+    async def test_single_compute(self):
+
+        calls = []
+
+        async def _load():
+
+            share_cache = ShareCache(self.cache, r'share_single')
+
+            try:
+
+                result = await share_cache.get()
+
+                if result is None:
+
+                    calls.append(1)
+
+                    await asyncio.sleep(0.05)
+
+                    result = r'value'
+
+                    await share_cache.set(result, 60)
+
+                return result
+
+            finally:
+
+                await share_cache.release()
+
+        # 同一时刻只有获得锁的调用方执行计算，其余调用方等待锁释放后读取结果
+        self.assertEqual(await asyncio.gather(*(_load() for _ in range(4))), [r'value'] * 4)
+        self.assertEqual(len(calls), 1)
+
+    async def test_stale_while_revalidate(self):
+
+        share_cache = ShareCache(self.cache, r'share_stale', soft_ttl=0.05)
+
+        await share_cache.set(r'old', 60)
+        await share_cache.release()
+
+        await asyncio.sleep(0.06)
+
+        refresher = ShareCache(self.cache, r'share_stale', soft_ttl=0.05)
+        reader = ShareCache(self.cache, r'share_stale', soft_ttl=0.05)
+
+        # 软过期后获得锁的调用方负责刷新，其余调用方继续使用旧值
+        self.assertIsNone(await refresher.get())
+        self.assertEqual(await reader.get(), r'old')
+
+        await refresher.set(r'new', 60)
+        await refresher.release()
+        await reader.release()
+
+        share_cache = ShareCache(self.cache, r'share_stale', soft_ttl=0.05)
+
+        self.assertEqual(await share_cache.get(), r'new')
+
+        await share_cache.release()
+
+    async def test_early_refresh(self):
+
+        share_cache = ShareCache(self.cache, r'share_early', soft_ttl=60)
+
+        await share_cache.set(r'value', 60)
+        await share_cache.release()
+
+        # XFetch按计算耗时和随机数提前刷新，随机数接近0时不会提前刷新
+        with mock.patch.object(Utils.random, r'random', return_value=0):
+
+            share_cache = ShareCache(self.cache, r'share_early', soft_ttl=60)
+
+            self.assertEqual(await share_cache.get(), r'value')
+
+            await share_cache.release()
+
+        await self.cache.set(
+            r'share_early',
+            {
+                ShareCache._ENVELOPE_TAG: 1, r'value': r'value',
+                r'soft_expire': Utils.timestamp(True) + 1000, r'delta': 1000,
+            }
+        )
+
+        with mock.patch.object(Utils.random, r'random', return_value=0.999):
+
+            share_cache = ShareCache(self.cache, r'share_early', soft_ttl=60)
+
+            self.assertIsNone(await share_cache.get())
+
+            await share_cache.release()
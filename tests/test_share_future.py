@@ -0,0 +1,111 @@
+import asyncio
+
+from unittest import IsolatedAsyncioTestCase
+
+from pynaja.cache.base import ShareFuture
+
+
+class ShareFutureTest(IsolatedAsyncioTestCase):
+
+    async def test_share_result(self):
+
+        calls = []
+
+        @ShareFuture()
+        async def _load(key):
+            calls.append(key)
+            await asyncio.sleep(0.02)
+            return {r'key': key}
+
+        results = await asyncio.gather(_load(1), _load(1), _load(2))
+
+        self.assertEqual(calls, [1, 2])
+        self.assertEqual(results, [{r'key': 1}, {r'key': 1}, {r'key': 2}])
+
+        # 默认每个等待者得到独立的副本
+        self.assertIsNot(results[0], results[1])
+
+    async def test_exception_fan_out(self):
+
+        calls = []
+
+        @ShareFuture()
+        async def _load():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            raise ValueError(r'failed')
+
+        results = await asyncio.gather(_load(), _load(), return_exceptions=True)
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    async def test_waiter_timeout(self):
+
+        calls = []
+
+        @ShareFuture()
+        async def _load():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return 1
+
+        task = asyncio.ensure_future(_load())
+
+        await asyncio.sleep(0)
+
+        # 单个调用方超时不影响其他调用方
+        with ShareFuture.wait_timeout(0.01):
+            with self.assertRaises(asyncio.TimeoutError):
+                await _load()
+
+        self.assertEqual(await task, 1)
+        self.assertEqual(len(calls), 1)
+
+    async def test_cancel_all_waiters(self):
+
+        cancelled = []
+
+        @ShareFuture(timeout=0.01)
+        async def _load():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        with self.assertRaises(asyncio.TimeoutError):
+            await _load()
+
+        await asyncio.sleep(0)
+
+        # 所有调用方都放弃等待后取消计算任务
+        self.assertEqual(cancelled, [1])
+
+    async def test_copy_policy(self):
+
+        @ShareFuture(copy=ShareFuture.COPY_SHARE)
+        async def _share():
+            await asyncio.sleep(0.01)
+            return {r'items': [1]}
+
+        results = await asyncio.gather(_share(), _share())
+
+        self.assertIs(results[0], results[1])
+
+        @ShareFuture(copy=ShareFuture.COPY_FROZEN)
+        async def _frozen():
+            await asyncio.sleep(0.01)
+            return {r'items': [1], r'tags': {1}}
+
+        results = await asyncio.gather(_frozen(), _frozen())
+
+        self.assertIs(results[0], results[1])
+        self.assertEqual(results[0][r'items'], (1,))
+        self.assertEqual(results[0][r'tags'], frozenset({1}))
+
+        with self.assertRaises(TypeError):
+            results[0][r'items'] = None
+
+        with self.assertRaises(ValueError):
+            ShareFuture(copy=r'unknown')
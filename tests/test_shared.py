@@ -0,0 +1,72 @@
+import os
+
+from unittest import TestCase, mock
+
+from pynaja.cache import shared
+from pynaja.cache.shared import SharedMemoryCache
+
+
+class SharedMemoryCacheTest(TestCase):
+
+    def setUp(self):
+
+        self.name = f'test_{os.getpid()}_{self.id().rsplit(r".", 1)[-1]}'
+
+        self.owner = SharedMemoryCache(self.name, 0x40, 0x80)
+
+    def tearDown(self):
+
+        if self.owner.owner:
+            self.owner.destroy()
+
+    def _attach(self):
+
+        # 同一进程内连接时避免取消创建者在资源跟踪进程中的登记
+        with mock.patch.object(shared.resource_tracker, r'unregister') as unregister:
+            cache = SharedMemoryCache(self.name)
+
+        unregister.assert_called_once_with(cache._byte_array._name, r'shared_memory')
+
+        return cache
+
+    def test_shared_data(self):
+
+        cache = self._attach()
+
+        self.assertFalse(cache.owner)
+
+        self.owner.set(r'key', {r'value': 1})
+
+        self.assertEqual(cache.get(r'key'), {r'value': 1})
+
+        self.assertTrue(cache.delete(r'key'))
+        self.assertIsNone(self.owner.get(r'key'))
+
+        cache.release()
+
+    def test_single_lock_file(self):
+
+        cache = self._attach()
+
+        # 同一进程内的实例共用一个锁文件描述符，释放其中一个不会关闭描述符(否则会释放其他实例持有的锁)
+        self.assertEqual(cache._lock_file, self.owner._lock_file)
+
+        cache.release()
+
+        os.fstat(self.owner._lock_file)
+
+        self.owner.set(r'key', 1)
+
+        self.assertEqual(self.owner.get(r'key'), 1)
+
+    def test_destroy(self):
+
+        lock_file = self.owner._lock_file
+
+        self.owner.destroy()
+
+        with self.assertRaises(OSError):
+            os.fstat(lock_file)
+
+        with self.assertRaises(FileNotFoundError):
+            shared.SharedByteArray(f'shared_cache_{self.name}')
@@ -0,0 +1,84 @@
+from unittest import IsolatedAsyncioTestCase, mock
+
+from pynaja.common.async_base import Utils
+from pynaja.event.async_event import StreamEvent
+
+
+class StreamEventTest(IsolatedAsyncioTestCase):
+    """RespServer不支持Streams命令，使用模拟连接验证消费组的确认和认领逻辑
+    """
+
+    async def asyncSetUp(self):
+
+        self.client = mock.Mock()
+        self.client.xadd = mock.AsyncMock(return_value=b'1-0')
+        self.client.release = mock.AsyncMock()
+
+        self.pool = mock.Mock()
+        self.pool.get_client.return_value = self.client
+        self.pool.create_connection = mock.AsyncMock(side_effect=OSError(r'not connected'))
+
+        self.conn = mock.Mock()
+        self.conn.xack = mock.AsyncMock()
+        self.conn.xclaim = mock.AsyncMock(return_value=[])
+        self.conn.xpending = mock.AsyncMock(return_value=[])
+
+        self.event = StreamEvent(self.pool, r'stream', r'group', claim_idle_time=1000, max_deliveries=3)
+        self.stream = self.event.streams[0]
+
+    async def asyncTearDown(self):
+
+        self.event.close()
+
+    @staticmethod
+    def _message(_type, *args):
+
+        return {b'data': Utils.pickle_dumps({r'type': _type, r'args': args, r'kwargs': {}})}
+
+    async def test_ack_handled(self):
+
+        received = []
+
+        async def _on_ok(value):
+            received.append(value)
+
+        async def _on_error(value):
+            raise ValueError(value)
+
+        self.event.add_listener(r'ok', _on_ok)
+        self.event.add_listener(r'error', _on_error)
+
+        await self.event._event_assigner(self.conn, self.stream, [
+            (b'1-0', self._message(r'ok', 1)),
+            (b'2-0', self._message(r'error', 2)),
+            (b'3-0', self._message(r'unknown', 3)),
+        ])
+
+        # 处理失败的消息不确认，空闲超时后重新投递
+        self.assertEqual(received, [1])
+        self.conn.xack.assert_awaited_once_with(self.stream, r'group', b'1-0', b'3-0')
+
+    async def test_reclaim_pending(self):
+
+        self.conn.xpending.return_value = [
+            (b'1-0', b'consumer', 500, 1),
+            (b'2-0', b'consumer', 2000, 1),
+            (b'3-0', b'consumer', 2000, 3),
+        ]
+
+        await self.event._reclaim_pending(self.conn, self.stream)
+
+        # 空闲未超时的消息不认领，超过最大投递次数的消息确认丢弃
+        self.conn.xack.assert_awaited_once_with(self.stream, r'group', b'3-0')
+        self.conn.xclaim.assert_awaited_once_with(self.stream, r'group', self.event._consumer_name, 1000, b'2-0')
+
+    async def test_dispatch(self):
+
+        self.assertEqual(await self.event.dispatch(r'ok', 1), b'1-0')
+
+        self.client.xadd.side_effect = ConnectionError(r'connection lost')
+
+        with self.assertRaises(ConnectionError):
+            await self.event.dispatch(r'ok', 1)
+
+        self.assertEqual(self.client.release.await_count, 2)
@@ -0,0 +1,165 @@
+from unittest import TestCase
+
+from pynaja.cache.tinylfu import FREQUENCY_COUNTER_MAX, FrequencySketch, TinyLFUCache, object_weigher
+
+
+class _Timer:
+
+    def __init__(self):
+
+        self.now = 0
+
+    def __call__(self):
+
+        return self.now
+
+
+class FrequencySketchTest(TestCase):
+
+    def test_frequency(self):
+
+        sketch = FrequencySketch(0x100)
+
+        for _ in range(5):
+            sketch.increment(r'hot')
+
+        sketch.increment(r'cold')
+
+        self.assertGreaterEqual(sketch.frequency(r'hot'), 5)
+        self.assertGreaterEqual(sketch.frequency(r'cold'), 1)
+        self.assertEqual(sketch.frequency(r'missing'), 0)
+
+    def test_counter_limit(self):
+
+        sketch = FrequencySketch(0x100)
+
+        for _ in range(0x40):
+            sketch.increment(r'hot')
+
+        self.assertEqual(sketch.frequency(r'hot'), FREQUENCY_COUNTER_MAX)
+
+    def test_reset(self):
+
+        sketch = FrequencySketch(0x100)
+
+        for _ in range(8):
+            sketch.increment(r'hot')
+
+        sketch.reset()
+
+        self.assertEqual(sketch.frequency(r'hot'), 4)
+
+        sketch.clear()
+
+        self.assertEqual(sketch.frequency(r'hot'), 0)
+
+
+class TinyLFUCacheTest(TestCase):
+
+    def test_admission(self):
+
+        cache = TinyLFUCache(0x100)
+
+        hot_keys = [f'hot_{index}' for index in range(0x40)]
+
+        for _ in range(4):
+            for key in hot_keys:
+                if cache.get(key) is None:
+                    cache[key] = key
+
+        # 一次性访问的扫描数据频率低于热点数据，不会把热点数据挤出缓存(频率估算存在哈希冲突，允许少量误差)
+        for index in range(0x400):
+            cache[f'scan_{index}'] = index
+
+        self.assertGreaterEqual(sum(key in cache for key in hot_keys), len(hot_keys) * 0.9)
+        self.assertLessEqual(cache.currsize, cache.maxsize)
+
+        stats = cache.stats()
+
+        self.assertGreater(stats[r'rejections'], 0)
+        self.assertEqual(stats[r'count'], len(cache))
+
+    def test_frequent_candidate_admitted(self):
+
+        cache = TinyLFUCache(0x100)
+
+        for index in range(0x100):
+            cache[f'cold_{index}'] = index
+
+        for _ in range(8):
+            cache.get(r'popular')
+
+        self.assertTrue(cache.set(r'popular', 1))
+
+        for index in range(0x10):
+            cache[f'filler_{index}'] = index
+
+        self.assertIn(r'popular', cache)
+
+    def test_weigher(self):
+
+        cache = TinyLFUCache(0x40, weigher=lambda key, val: len(val))
+
+        self.assertFalse(cache.set(r'huge', r'x' * 0x41))
+        self.assertNotIn(r'huge', cache)
+
+        for index in range(0x10):
+            cache[f'key_{index}'] = r'x' * 8
+
+        self.assertLessEqual(cache.currsize, 0x40)
+        self.assertEqual(cache.currsize, sum(len(cache._entries[key].value) for key in cache))
+
+        self.assertGreater(object_weigher(r'key', {r'items': [1, 2, 3]}), object_weigher(r'key', {}))
+
+    def test_update_weight(self):
+
+        cache = TinyLFUCache(0x40, weigher=lambda key, val: len(val))
+
+        cache[r'key'] = r'x' * 8
+        cache[r'key'] = r'x' * 0x10
+
+        self.assertEqual(cache.currsize, 0x10)
+
+        del cache[r'key']
+
+        self.assertEqual(cache.currsize, 0)
+
+    def test_ttl(self):
+
+        timer = _Timer()
+
+        cache = TinyLFUCache(0x10, 10, timer=timer)
+
+        cache[r'default'] = 1
+        cache.set(r'short', 2, ttl=1)
+        cache.set(r'forever', 3, ttl=0)
+
+        timer.now = 2
+
+        self.assertNotIn(r'short', cache)
+        self.assertEqual(cache[r'default'], 1)
+
+        timer.now = 20
+
+        cache.expire()
+
+        self.assertEqual(list(cache), [r'forever'])
+        self.assertEqual(cache.stats()[r'expirations'], 2)
+
+    def test_stats(self):
+
+        cache = TinyLFUCache(0x10)
+
+        cache[r'key'] = 1
+
+        cache.get(r'key')
+        cache.get(r'missing')
+
+        stats = cache.stats()
+
+        self.assertEqual((stats[r'hits'], stats[r'misses']), (1, 1))
+        self.assertEqual(stats[r'hit_rate'], 0.5)
+
+        cache.reset_stats()
+
+        self.assertEqual(cache.stats()[r'hits'], 0)